@@ -0,0 +1,335 @@
+"""
+Throughput and latency benchmarks for the queue.
+
+`Benchmark` enqueues a mix of benchmark jobs on a queue of its own, runs a
+number of workers until the queue is empty and measures how fast the jobs
+went through. It can also fill the jobs table with historical jobs first,
+to show how the queries which have to cope with a large table behave. Run
+it with `manage.py benchmark`, against whichever database is configured.
+"""
+
+from django.conf import settings
+from django.db import connection, connections
+from django.test.utils import override_settings
+from django.utils import timezone
+from django_dbq.management.commands.worker import Worker
+from django_dbq.metrics import Metrics
+from django_dbq.models import Job
+from time import monotonic
+import datetime
+import json
+import logging
+import math
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+BENCHMARK_QUEUE_NAME = "dbq_benchmark"
+
+JOB_NAME_PREFIX = "dbq_benchmark_"
+
+JOB_KINDS = ("noop", "sleep", "cpu")
+
+HISTORY_BATCH_SIZE = 10000
+
+
+def parse_mix(mix):
+    """
+    Parse a job mix like "noop:8,sleep:1,cpu:1" into a dict mapping each
+    kind of job to its weight. Raises ValueError if the mix is invalid.
+    """
+    weights = {}
+    for part in mix.split(","):
+        kind, _, weight = part.strip().partition(":")
+        if kind not in JOB_KINDS:
+            raise ValueError(
+                'Unknown job kind "%s", expected one of %s'
+                % (kind, ", ".join(JOB_KINDS))
+            )
+        try:
+            weights[kind] = int(weight or 1)
+        except ValueError:
+            raise ValueError('Invalid weight for job kind "%s"' % kind)
+        if weights[kind] < 1:
+            raise ValueError('The weight of job kind "%s" must be at least 1' % kind)
+    return weights
+
+
+def percentile(values, percent):
+    """Return the given percentile of a sorted list, by nearest rank"""
+    if not values:
+        return None
+    rank = max(math.ceil(percent / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+class BenchmarkMetrics(Metrics):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.claims = 0
+        self.claim_seconds = 0
+
+    def observe_claim(self, queue_name, seconds, claimed):
+        with self.lock:
+            self.claims += 1
+            self.claim_seconds += seconds
+
+
+class BenchmarkWorker(Worker):
+    """
+    A worker which runs jobs as fast as it can, stops once the queue is
+    empty, and counts the queries it makes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(
+            BENCHMARK_QUEUE_NAME,
+            0,
+            *args,
+            listen=False,
+            metrics=BenchmarkMetrics(),
+            **kwargs
+        )
+        self.queries = 0
+        self.queries_lock = threading.Lock()
+        # Unlike jobs_processed, this isn't reset when the worker reports
+        # its stats on the way out
+        self.jobs_run = 0
+
+    def count_query(self, execute, sql, params, many, context):
+        with self.queries_lock:
+            self.queries += 1
+        return execute(sql, params, many, context)
+
+    def run(self):
+        with connection.execute_wrapper(self.count_query):
+            super().run()
+
+    def run_job_in_thread(self, job):
+        with connection.execute_wrapper(self.count_query):
+            super().run_job_in_thread(job)
+
+    def process_job(self):
+        if self._process_job():
+            self.jobs_processed += 1
+            self.jobs_run += 1
+        else:
+            self.alive = False
+
+    def get_results(self):
+        return {
+            "jobs": self.jobs_run,
+            "queries": self.queries,
+            "claims": self.metrics.claims,
+            "claim_seconds": self.metrics.claim_seconds,
+        }
+
+
+class Benchmark:
+    def __init__(
+        self,
+        jobs=1000,
+        mix="noop",
+        workers=1,
+        prefetch=1,
+        concurrency=1,
+        sleep_seconds=0.01,
+        cpu_iterations=10000,
+        history=0,
+    ):
+        self.jobs = jobs
+        self.mix = parse_mix(mix)
+        self.workers = workers
+        self.prefetch = prefetch
+        self.concurrency = concurrency
+        self.sleep_seconds = sleep_seconds
+        self.cpu_iterations = cpu_iterations
+        self.history = history
+        self.results = {}
+
+    def get_job_settings(self):
+        jobs = dict(getattr(settings, "JOBS", {}))
+        for kind in JOB_KINDS:
+            jobs[JOB_NAME_PREFIX + kind] = {
+                "tasks": ["django_dbq.benchmarks.tasks.%s" % kind]
+            }
+        return jobs
+
+    def run(self):
+        """Run the benchmark and return a dict of results"""
+        with override_settings(JOBS=self.get_job_settings()):
+            self.clean_up()
+            try:
+                if self.history:
+                    self.create_history()
+                self.time_queries()
+                self.enqueue()
+                self.run_workers()
+                self.measure_latency()
+                if self.history:
+                    self.time_delete_old()
+            finally:
+                self.clean_up()
+        return self.results
+
+    def clean_up(self):
+        Job.objects.filter(queue_name=BENCHMARK_QUEUE_NAME).delete()
+
+    def timed(self, name, function, *args, **kwargs):
+        started = monotonic()
+        result = function(*args, **kwargs)
+        self.results[name] = monotonic() - started
+        return result
+
+    def create_history(self):
+        """Fill the table with finished jobs, created two days ago"""
+        created = timezone.now() - datetime.timedelta(days=2)
+        started = monotonic()
+        remaining = self.history
+        while remaining:
+            batch_size = min(remaining, HISTORY_BATCH_SIZE)
+            Job.objects.bulk_create(
+                [
+                    Job(
+                        name=JOB_NAME_PREFIX + "noop",
+                        queue_name=BENCHMARK_QUEUE_NAME,
+                        state=Job.STATES.COMPLETE,
+                        workspace={},
+                    )
+                    for _ in range(batch_size)
+                ]
+            )
+            remaining -= batch_size
+        Job.objects.filter(queue_name=BENCHMARK_QUEUE_NAME).update(created=created)
+        self.results["history_insert_seconds"] = monotonic() - started
+
+    def time_queries(self):
+        """Time the queries which must stay fast however big the table is"""
+        self.timed("queue_depths_seconds", Job.get_queue_depths, exact=True)
+        self.timed("empty_claim_seconds", Job.objects.claim, BENCHMARK_QUEUE_NAME)
+
+    def make_job(self, kind):
+        workspace = {}
+        if kind == "sleep":
+            workspace["seconds"] = self.sleep_seconds
+        elif kind == "cpu":
+            workspace["iterations"] = self.cpu_iterations
+        return Job(
+            name=JOB_NAME_PREFIX + kind,
+            queue_name=BENCHMARK_QUEUE_NAME,
+            workspace=workspace,
+        )
+
+    def get_job_kinds(self):
+        """Spread the kinds of job through the queue in proportion to the
+        weights of the mix"""
+        total = sum(self.mix.values())
+        for index in range(self.jobs):
+            position = index % total
+            for kind, weight in self.mix.items():
+                if position < weight:
+                    yield kind
+                    break
+                position -= weight
+
+    def enqueue(self):
+        jobs = [self.make_job(kind) for kind in self.get_job_kinds()]
+        self.timed("enqueue_seconds", Job.objects.bulk_enqueue, jobs)
+        self.results["enqueue_jobs_per_second"] = self.jobs / max(
+            self.results["enqueue_seconds"], 1e-9
+        )
+
+    def make_worker(self):
+        return BenchmarkWorker(prefetch=self.prefetch, concurrency=self.concurrency)
+
+    def run_workers(self):
+        started = monotonic()
+        if self.workers == 1:
+            worker = self.make_worker()
+            worker.run()
+            worker_results = [worker.get_results()]
+        else:
+            worker_results = self.run_worker_processes()
+        seconds = monotonic() - started
+
+        jobs = sum(result["jobs"] for result in worker_results)
+        claims = sum(result["claims"] for result in worker_results)
+        claim_seconds = sum(result["claim_seconds"] for result in worker_results)
+        self.results.update(
+            {
+                "processing_seconds": seconds,
+                "jobs_per_second": jobs / max(seconds, 1e-9),
+                "claims": claims,
+                "claims_per_second": claims / max(seconds, 1e-9),
+                "mean_claim_seconds": claim_seconds / max(claims, 1),
+                "queries_per_job": sum(result["queries"] for result in worker_results)
+                / max(jobs, 1),
+            }
+        )
+
+    def run_worker_processes(self):
+        """
+        Fork a process per worker, each of which writes its results to a
+        pipe as a line of JSON when the queue is empty.
+        """
+        read_fd, write_fd = os.pipe()
+        connections.close_all()
+        children = []
+        for _ in range(self.workers):
+            pid = os.fork()
+            if pid == 0:
+                exit_code = 0
+                try:
+                    os.close(read_fd)
+                    worker = self.make_worker()
+                    worker.run()
+                    os.write(
+                        write_fd, (json.dumps(worker.get_results()) + "\n").encode()
+                    )
+                except BaseException:
+                    logger.exception("Benchmark worker pid=%s failed", os.getpid())
+                    exit_code = 1
+                finally:
+                    os._exit(exit_code)
+            children.append(pid)
+
+        os.close(write_fd)
+        with os.fdopen(read_fd) as results:
+            output = results.read()
+        failed = 0
+        for pid in children:
+            _, status = os.waitpid(pid, 0)
+            if os.WIFSIGNALED(status) or os.WEXITSTATUS(status) != 0:
+                failed += 1
+        if failed:
+            raise RuntimeError("%s benchmark worker(s) failed" % failed)
+        return [json.loads(line) for line in output.splitlines()]
+
+    def measure_latency(self):
+        """
+        Work out the end-to-end latency of each benchmark job, from when it
+        was created to when its outcome was saved.
+        """
+        latencies = sorted(
+            (modified - created).total_seconds()
+            for created, modified in Job.objects.filter(
+                queue_name=BENCHMARK_QUEUE_NAME, state=Job.STATES.COMPLETE
+            )
+            .exclude(created__lt=timezone.now() - datetime.timedelta(days=1))
+            .values_list("created", "modified")
+        )
+        self.results["completed_jobs"] = len(latencies)
+        for percent in (50, 90, 99):
+            self.results["latency_p%s_seconds" % percent] = percentile(
+                latencies, percent
+            )
+
+    def time_delete_old(self):
+        self.results["delete_old_jobs"] = self.timed(
+            "delete_old_seconds",
+            Job.objects.delete_old,
+            queue_name=BENCHMARK_QUEUE_NAME,
+        )
@@ -0,0 +1,13 @@
+import time
+
+
+def noop(job):
+    pass
+
+
+def sleep(job):
+    time.sleep(job.workspace["seconds"])
+
+
+def cpu(job):
+    job.workspace["result"] = sum(i * i for i in range(job.workspace["iterations"]))
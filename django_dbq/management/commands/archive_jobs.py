@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django_dbq.models import DEFAULT_DELETE_BATCH_SIZE, Job
+
+
+class Command(BaseCommand):
+
+    help = "Move old finished jobs into the archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            help="Archive jobs older than this many hours",
+            default=None,
+            required=False,
+            type=int,
+        )
+        parser.add_argument(
+            "--batch_size",
+            help="Archive this many jobs per query. The default is %s."
+            % DEFAULT_DELETE_BATCH_SIZE,
+            default=DEFAULT_DELETE_BATCH_SIZE,
+            type=int,
+        )
+        parser.add_argument(
+            "--pause",
+            help="Sleep for this many seconds between batches. The default is 0.",
+            default=0,
+            type=float,
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch_size must be at least 1")
+
+        archived = Job.objects.archive_old(
+            hours=options["hours"],
+            batch_size=options["batch_size"],
+            pause_in_seconds=options["pause"],
+            progress=lambda archived: self.stdout.write(
+                "Archived %s old jobs so far" % archived
+            ),
+        )
+        self.stdout.write("Archived old jobs: %s in total" % archived)
+
+        released = Job.objects.release_finished_dependencies()
+        if released:
+            self.stdout.write(
+                "Released the dependents of finished or deleted jobs: %s" % released
+            )
@@ -0,0 +1,121 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django_dbq.benchmarks import BENCHMARK_QUEUE_NAME, Benchmark, parse_mix
+import os
+
+
+class Command(BaseCommand):
+
+    help = "Measure the throughput and latency of the queue on the configured database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--jobs",
+            help="The number of jobs to run. The default is 1000.",
+            default=1000,
+            type=int,
+        )
+        parser.add_argument(
+            "--mix",
+            help='The kinds of job to run and their weights, eg "noop:8,sleep:1,cpu:1". The default is "noop".',
+            default="noop",
+            type=str,
+        )
+        parser.add_argument(
+            "--workers",
+            help="The number of worker processes to run. The default is 1.",
+            default=1,
+            type=int,
+        )
+        parser.add_argument(
+            "--prefetch",
+            help="The --prefetch of each worker. The default is 1.",
+            default=1,
+            type=int,
+        )
+        parser.add_argument(
+            "--concurrency",
+            help="The --concurrency of each worker. The default is 1.",
+            default=1,
+            type=int,
+        )
+        parser.add_argument(
+            "--sleep",
+            help="The number of seconds each sleep job sleeps for. The default is 0.01.",
+            default=0.01,
+            type=float,
+        )
+        parser.add_argument(
+            "--cpu_iterations",
+            help="The number of loop iterations each cpu job runs. The default is 10000.",
+            default=10000,
+            type=int,
+        )
+        parser.add_argument(
+            "--history",
+            help="The number of finished jobs to add to the table before the benchmark, to measure queries against a large table. The default is 0.",
+            default=0,
+            type=int,
+        )
+
+    def handle(self, *args, **options):
+        for option in ("jobs", "workers", "prefetch", "concurrency"):
+            if options[option] < 1:
+                raise CommandError("--%s must be at least 1" % option)
+        if options["history"] < 0:
+            raise CommandError("--history must not be negative")
+
+        try:
+            parse_mix(options["mix"])
+        except ValueError as exception:
+            raise CommandError(str(exception))
+
+        if options["workers"] > 1 and not hasattr(os, "fork"):
+            raise CommandError("--workers is not supported on this platform")
+        if (
+            (options["workers"] > 1 or options["concurrency"] > 1)
+            and connection.vendor == "sqlite"
+            and connection.is_in_memory_db()
+        ):
+            raise CommandError(
+                "Several workers or worker threads can't share an in-memory SQLite database, use a database file"
+            )
+
+        self.stdout.write(
+            'Running benchmark on queue "%s" against %s: jobs=%s mix=%s workers=%s prefetch=%s concurrency=%s history=%s'
+            % (
+                BENCHMARK_QUEUE_NAME,
+                connection.vendor,
+                options["jobs"],
+                options["mix"],
+                options["workers"],
+                options["prefetch"],
+                options["concurrency"],
+                options["history"],
+            )
+        )
+
+        try:
+            results = Benchmark(
+                jobs=options["jobs"],
+                mix=options["mix"],
+                workers=options["workers"],
+                prefetch=options["prefetch"],
+                concurrency=options["concurrency"],
+                sleep_seconds=options["sleep"],
+                cpu_iterations=options["cpu_iterations"],
+                history=options["history"],
+            ).run()
+        except RuntimeError as exception:
+            message = str(exception)
+            if connection.vendor == "sqlite":
+                message += (
+                    '. Several workers sharing a SQLite database need "transaction_mode": '
+                    '"IMMEDIATE" in the database OPTIONS'
+                )
+            raise CommandError(message)
+
+        for name, value in results.items():
+            if isinstance(value, float):
+                value = "%.6f" % value
+            self.stdout.write("%s=%s" % (name, value))
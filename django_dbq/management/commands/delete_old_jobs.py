@@ -1,5 +1,6 @@
-from django.core.management.base import BaseCommand
-from django_dbq.models import Job
+from django.core.management.base import BaseCommand, CommandError
+from django_dbq.models import DEFAULT_DELETE_BATCH_SIZE, Job
+from django_dbq.workspace import get_storage_alias
 
 
 class Command(BaseCommand):
@@ -14,7 +15,40 @@ class Command(BaseCommand):
             required=False,
             type=int,
         )
+        parser.add_argument(
+            "--batch_size",
+            help="Delete this many jobs per query. The default is %s."
+            % DEFAULT_DELETE_BATCH_SIZE,
+            default=DEFAULT_DELETE_BATCH_SIZE,
+            type=int,
+        )
+        parser.add_argument(
+            "--pause",
+            help="Sleep for this many seconds between batches. The default is 0.",
+            default=0,
+            type=float,
+        )
 
     def handle(self, *args, **options):
-        Job.objects.delete_old(hours=options["hours"])
-        self.stdout.write("Deleted old jobs")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch_size must be at least 1")
+
+        deleted = Job.objects.delete_old(
+            hours=options["hours"],
+            batch_size=options["batch_size"],
+            pause_in_seconds=options["pause"],
+            progress=lambda deleted: self.stdout.write(
+                "Deleted %s old jobs so far" % deleted
+            ),
+        )
+        self.stdout.write("Deleted old jobs: %s in total" % deleted)
+
+        released = Job.objects.release_finished_dependencies()
+        if released:
+            self.stdout.write(
+                "Released the dependents of finished or deleted jobs: %s" % released
+            )
+
+        if get_storage_alias() is not None:
+            deleted_files = Job.objects.delete_unused_workspace_files()
+            self.stdout.write("Deleted unused workspace files: %s" % deleted_files)
@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand
-from django_dbq.models import Job
+from django_dbq.models import Job, QueueDepthCounter
 
 
 class Command(BaseCommand):
@@ -9,12 +9,28 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("queue_name", nargs="*", default=["default"], type=str)
         parser.add_argument("--exclude_future_jobs", default=False, type=bool)
+        parser.add_argument(
+            "--exact",
+            action="store_true",
+            default=False,
+            help="Count the waiting jobs, rather than using the queue depth counters.",
+        )
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            default=False,
+            help="Reset the queue depth counters to an exact count of the waiting jobs.",
+        )
 
     def handle(self, *args, **options):
         queue_names = options["queue_name"]
-        queue_depths = Job.get_queue_depths(
-            exclude_future_jobs=options["exclude_future_jobs"]
-        )
+        if options["rebuild"]:
+            queue_depths = QueueDepthCounter.objects.rebuild()
+        else:
+            queue_depths = Job.get_queue_depths(
+                exclude_future_jobs=options["exclude_future_jobs"],
+                exact=options["exact"],
+            )
 
         queue_depths_string = " ".join(
             [
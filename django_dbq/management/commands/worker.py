@@ -1,11 +1,31 @@
-from django.db import transaction
+from asgiref.sync import sync_to_async
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, connections
 from django.utils import timezone
-from django.utils.module_loading import import_string
-from django_dbq.models import Job
-from time import sleep
+from django.core.exceptions import ImproperlyConfigured
+from django_dbq.metrics import Metrics, PrometheusMetrics, get_metrics
+from django_dbq.models import DEFAULT_LEASE_IN_SECONDS, Job
+from django_dbq.notifications import Listener, is_supported as listen_is_supported
+from django_dbq.ratelimit import TokenBucket, parse_rate
+from django_dbq.tasks import (
+    FAILURE_HOOK_KEY,
+    POST_TASK_HOOK_KEY,
+    PRE_TASK_HOOK_KEY,
+    RATE_LIMIT_SCOPE_CLUSTER,
+    RATE_LIMIT_SCOPE_WORKER,
+    get_job_registry,
+    load_job_registry,
+)
+from functools import partial
+from time import monotonic, sleep
+import asyncio
+import datetime
 import logging
+import os
 import signal
+import threading
 
 
 logger = logging.getLogger(__name__)
@@ -13,14 +33,103 @@ logger = logging.getLogger(__name__)
 
 DEFAULT_QUEUE_NAME = "default"
 
+MIN_IDLE_SLEEP_IN_SECONDS = 0.05
+DEFAULT_MAX_IDLE_SLEEP_IN_SECONDS = 1
+DEFAULT_SAFETY_POLL_IN_SECONDS = 5
+
+STATS_INTERVAL_IN_SECONDS = 60
+
+RESTART_DELAY_IN_SECONDS = 1
+
+
+def parse_queue_spec(spec):
+    """
+    Parse a queue given to the worker command as "name" or "name:weight"
+    into a (name, weight) tuple. Raises ValueError if the weight is not a
+    positive integer.
+    """
+    name, _, weight = spec.partition(":")
+    if not name:
+        raise ValueError('Invalid queue "%s"' % spec)
+    if not weight:
+        return name, 1
+    try:
+        weight = int(weight)
+    except ValueError:
+        weight = 0
+    if weight < 1:
+        raise ValueError('The weight of queue "%s" must be a positive integer' % name)
+    return name, weight
+
 
 class Worker:
-    def __init__(self, name, rate_limit_in_seconds):
-        self.queue_name = name
+    """
+    Process jobs from one or more queues.
+
+    `name` is either the name of a single queue, or a dict mapping queue
+    names to integer weights. With several queues, each claim is made from
+    the queue picked by smooth weighted round robin, so that over time the
+    queues are claimed from in proportion to their weights without long
+    runs of any one queue. If the picked queue is empty, the claim falls
+    through to the other queues in a single query.
+    """
+
+    def __init__(
+        self,
+        name,
+        rate_limit_in_seconds,
+        prefetch=1,
+        max_idle_sleep_in_seconds=DEFAULT_MAX_IDLE_SLEEP_IN_SECONDS,
+        listen=True,
+        safety_poll_in_seconds=DEFAULT_SAFETY_POLL_IN_SECONDS,
+        concurrency=1,
+        lease_in_seconds=DEFAULT_LEASE_IN_SECONDS,
+        rate=None,
+        burst=1,
+        metrics=None,
+        run_to_completion=False,
+    ):
+        if isinstance(name, str):
+            name = {name: 1}
+        self.queue_weights = dict(name)
+        self.queue_credits = dict.fromkeys(self.queue_weights, 0)
+        self.queue_name = ", ".join(self.queue_weights)
         self.rate_limit_in_seconds = rate_limit_in_seconds
+        self.prefetch = prefetch
+        self.concurrency = concurrency
+        self.executor = self.create_executor()
+        self.futures = set()
+        self.max_idle_sleep_in_seconds = max_idle_sleep_in_seconds
+        self.safety_poll_in_seconds = safety_poll_in_seconds
+        self.listener = None
+        if listen and listen_is_supported(connection):
+            self.listener = Listener(self.queue_weights)
         self.alive = True
         self.last_job_finished = None
-        self.current_job = None
+        self.current_jobs = set()
+        self.prefetched_jobs = deque()
+        self.idle_sleep_in_seconds = 0
+        self.lease_in_seconds = lease_in_seconds
+        self.last_reclaimed = None
+        self.heartbeat_stopped = threading.Event()
+        self.heartbeat_thread = None
+        self.rate_limiter = TokenBucket(rate, burst) if rate else None
+        job_registry = get_job_registry()
+        self.job_rate_limiters = {
+            job_name: TokenBucket(*job_definition.rate_limit)
+            for job_name, job_definition in job_registry.items()
+            if job_definition.rate_limit_scope == RATE_LIMIT_SCOPE_WORKER
+        }
+        self.cluster_rate_limits = {
+            job_name: job_definition.rate_limit
+            for job_name, job_definition in job_registry.items()
+            if job_definition.rate_limit_scope == RATE_LIMIT_SCOPE_CLUSTER
+        }
+        self.cluster_throttled_until = {}
+        self.throttled_for = None
+        self.metrics = metrics or Metrics()
+        self.run_to_completion = run_to_completion
+        self.reset_stats()
         self.init_signals()
 
     def init_signals(self):
@@ -32,66 +141,481 @@ class Worker:
 
         signal.signal(signal.SIGTERM, self.shutdown)
 
+    def create_executor(self):
+        if self.concurrency > 1:
+            return ThreadPoolExecutor(
+                max_workers=self.concurrency, thread_name_prefix="django_dbq"
+            )
+        return None
+
     def shutdown(self, signum, frame):
         self.alive = False
-        if self.current_job:
-            self.current_job.state = Job.STATES.STOPPING
-            self.current_job.save(update_fields=["state"])
+        self.mark_current_jobs_stopping()
+
+    def mark_current_jobs_stopping(self):
+        current_jobs = list(self.current_jobs)
+        if current_jobs:
+            Job.objects.filter(
+                pk__in=[job.pk for job in current_jobs], state=Job.STATES.PROCESSING
+            ).update(state=Job.STATES.STOPPING)
 
     def run(self):
-        while self.alive:
-            self.process_job()
+        self.metrics.start()
+        self.start_heartbeat()
+        try:
+            while self.alive:
+                self.process_job()
+                if monotonic() - self.stats_started >= STATS_INTERVAL_IN_SECONDS:
+                    self.report_stats()
+        finally:
+            if self.executor:
+                self.executor.shutdown(wait=True)
+            self.release_prefetched_jobs()
+            self.stop_heartbeat()
+            self.report_stats()
+        self.collect_finished_jobs()
 
-    def process_job(self):
-        sleep(1)
+    def start_heartbeat(self):
+        self.heartbeat_stopped.clear()
+        self.heartbeat_thread = threading.Thread(
+            target=self.run_heartbeat, name="django_dbq_heartbeat", daemon=True
+        )
+        self.heartbeat_thread.start()
+
+    def stop_heartbeat(self):
+        self.heartbeat_stopped.set()
+        if self.heartbeat_thread:
+            self.heartbeat_thread.join()
+            self.heartbeat_thread = None
+
+    def run_heartbeat(self):
+        """
+        Call `heartbeat` three times per lease period until the worker stops,
+        on a thread of its own so that leases are kept alive while a long
+        task runs in the main thread.
+        """
+        try:
+            while not self.heartbeat_stopped.wait(self.lease_in_seconds / 3):
+                try:
+                    self.heartbeat()
+                except Exception:
+                    logger.exception("Worker heartbeat failed")
+        finally:
+            connection.close()
+
+    def heartbeat(self):
+        """
+        Renew the leases of every job this worker has claimed, whether it is
+        running or waiting in the prefetch buffer, and once per lease period
+        return jobs whose lease has expired (because the worker which
+        claimed them died) to READY.
+        """
+        jobs = list(self.current_jobs) + list(self.prefetched_jobs)
+        if jobs:
+            Job.objects.renew_leases(jobs, self.lease_in_seconds)
+
+        now = monotonic()
         if (
-            self.last_job_finished
-            and (timezone.now() - self.last_job_finished).total_seconds()
-            < self.rate_limit_in_seconds
+            self.last_reclaimed is None
+            or now - self.last_reclaimed >= self.lease_in_seconds
         ):
+            self.last_reclaimed = now
+            Job.objects.reclaim_expired()
+
+    def reset_stats(self):
+        self.stats_started = monotonic()
+        self.jobs_processed = 0
+        self.idle_polls = 0
+
+    def report_stats(self):
+        """
+        Log the throughput and the rate of empty polls against the database
+        since the stats were last reported, then start a new period.
+        """
+        elapsed = max(monotonic() - self.stats_started, 1e-9)
+        logger.info(
+            'Worker stats: queue="%s" seconds=%.1f jobs=%s jobs_per_second=%.2f idle_polls=%s idle_polls_per_second=%.2f',
+            self.queue_name,
+            elapsed,
+            self.jobs_processed,
+            self.jobs_processed / elapsed,
+            self.idle_polls,
+            self.idle_polls / elapsed,
+        )
+        self.reset_stats()
+
+    def release_prefetched_jobs(self):
+        """
+        Return any prefetched jobs which were never started to READY so that
+        other workers can pick them up. Jobs which are already running are
+        left to finish normally.
+        """
+        if not self.prefetched_jobs:
             return
+        jobs = list(self.prefetched_jobs)
+        self.prefetched_jobs.clear()
+        released = Job.objects.release(jobs)
+        logger.info(
+            'Released %s prefetched job(s) on queue "%s"', released, self.queue_name
+        )
 
-        self._process_job()
+    def process_job(self):
+        """
+        Process a single job, if the rate limit allows it and there is one.
 
-        self.last_job_finished = timezone.now()
+        While jobs are available the worker moves straight on to the next
+        one. When the queue is empty it sleeps, doubling the sleep on each
+        consecutive empty poll up to `max_idle_sleep_in_seconds`. If the
+        worker is listening for new jobs, it instead waits for a notification,
+        polling every `safety_poll_in_seconds` to pick up scheduled jobs.
+        """
+        if self.last_job_finished:
+            seconds_since_last_job = (
+                timezone.now() - self.last_job_finished
+            ).total_seconds()
+            if seconds_since_last_job < self.rate_limit_in_seconds:
+                sleep(self.rate_limit_in_seconds - seconds_since_last_job)
+                return
 
-    def _process_job(self):
-        with transaction.atomic():
-            job = Job.objects.get_ready_or_none(self.queue_name)
-            if not job:
+        if self.rate_limiter:
+            wait_time = self.rate_limiter.wait_time()
+            if wait_time:
+                sleep(wait_time)
                 return
 
-            logger.info(
-                'Processing job: name="%s" queue="%s" id=%s state=%s next_task=%s',
-                job.name,
-                self.queue_name,
-                job.pk,
-                job.state,
-                job.next_task,
+        if self._process_job():
+            self.jobs_processed += 1
+            self.idle_sleep_in_seconds = 0
+            self.last_job_finished = timezone.now()
+            if self.rate_limiter:
+                self.rate_limiter.try_acquire()
+        else:
+            self.idle_polls += 1
+            self.idle_sleep_in_seconds = min(
+                max(self.idle_sleep_in_seconds * 2, MIN_IDLE_SLEEP_IN_SECONDS),
+                self.max_idle_sleep_in_seconds,
             )
-            job.state = Job.STATES.PROCESSING
-            job.save()
-            self.current_job = job
+            if self.listener:
+                self.listener.wait(
+                    min(self.safety_poll_in_seconds, self.throttled_for or float("inf"))
+                )
+            else:
+                sleep(
+                    min(self.idle_sleep_in_seconds, self.throttled_for or float("inf"))
+                )
 
-        try:
-            job.run_pre_task_hook()
-            job.run_next_task()
-            job.update_next_task()
+    def claim_job(self):
+        """
+        Return the next job to process, or None if the queue is empty.
+
+        Jobs are claimed from the database in batches of `prefetch` and
+        buffered locally, so the database is only queried once the buffer
+        has been used up.
+        """
+        if not self.prefetched_jobs:
+            throttled = self.get_throttled_job_names()
+            cluster_throttled = {}
+            queue_name, other_queue_names = self.choose_queue()
+            jobs = self.claim(queue_name, throttled, cluster_throttled)
+            if not jobs and other_queue_names:
+                jobs = self.claim(other_queue_names, throttled, cluster_throttled)
+            self.record_cluster_throttling(cluster_throttled)
+            self.prefetched_jobs.extend(self.take_job_rate_limit_tokens(jobs))
+        if self.prefetched_jobs:
+            return self.prefetched_jobs.popleft()
+        return None
+
+    def claim(self, queue_name, throttled, cluster_throttled):
+        """
+        Claim a batch of jobs from the given queue (or list of queues),
+        recording how long the claim took and how long the jobs waited.
+        """
+        started = monotonic()
+        jobs = Job.objects.claim(
+            queue_name,
+            count=self.prefetch,
+            lease_in_seconds=self.lease_in_seconds,
+            exclude_names=throttled,
+            rate_limits=self.cluster_rate_limits,
+            throttled=cluster_throttled,
+        )
+        self.metrics.observe_claim(
+            queue_name if isinstance(queue_name, str) else ", ".join(queue_name),
+            monotonic() - started,
+            len(jobs),
+        )
+        now = timezone.now()
+        for job in jobs:
+            waiting_since = max(job.created, job.run_after or job.created)
+            self.metrics.observe_queue_wait(
+                job, max((now - waiting_since).total_seconds(), 0)
+            )
+        return jobs
+
+    def get_throttled_job_names(self):
+        """
+        Return the names of the rate limited jobs which have no tokens left,
+        so that they can be left out of the claim, and record in
+        `throttled_for` how long it will be until one of them can run again.
+        """
+        wait_times = {
+            job_name: bucket.wait_time()
+            for job_name, bucket in self.job_rate_limiters.items()
+        }
+        now = monotonic()
+        for job_name, throttled_until in list(self.cluster_throttled_until.items()):
+            if throttled_until > now:
+                wait_times[job_name] = max(
+                    wait_times.get(job_name, 0), throttled_until - now
+                )
+            else:
+                del self.cluster_throttled_until[job_name]
+        throttled = [job_name for job_name, wait in wait_times.items() if wait]
+        self.throttled_for = min(
+            (wait_times[job_name] for job_name in throttled), default=None
+        )
+        return throttled
+
+    def record_cluster_throttling(self, throttled):
+        """
+        Remember which job names ran out of tokens in their shared bucket,
+        so that they are left out of claims until the bucket refills rather
+        than being selected only to be skipped.
+        """
+        now = monotonic()
+        for job_name, wait_time in throttled.items():
+            self.cluster_throttled_until[job_name] = now + wait_time
+        if throttled:
+            self.throttled_for = min(
+                [self.throttled_for or float("inf")] + list(throttled.values())
+            )
 
-            if not job.next_task:
-                job.state = Job.STATES.COMPLETE
+    def take_job_rate_limit_tokens(self, jobs):
+        """
+        Take a token for each claimed job of a rate limited job name. A
+        prefetched batch may contain more jobs of one name than there are
+        tokens, in which case the extra jobs are released straight away.
+        """
+        allowed = []
+        over_limit = []
+        for job in jobs:
+            bucket = self.job_rate_limiters.get(job.name)
+            if bucket is None or bucket.try_acquire():
+                allowed.append(job)
             else:
-                job.state = Job.STATES.READY
+                over_limit.append(job)
+        if over_limit:
+            Job.objects.release(over_limit)
+            self.throttled_for = min(
+                self.job_rate_limiters[job.name].wait_time() for job in over_limit
+            )
+        return allowed
+
+    def choose_queue(self):
+        """
+        Pick the queue to claim from next by smooth weighted round robin.
+        Returns the picked queue name and a list of the other queue names.
+        """
+        if len(self.queue_weights) == 1:
+            return next(iter(self.queue_weights)), []
+
+        for queue_name, weight in self.queue_weights.items():
+            self.queue_credits[queue_name] += weight
+        queue_name = max(self.queue_credits, key=self.queue_credits.get)
+        self.queue_credits[queue_name] -= sum(self.queue_weights.values())
+        return queue_name, [name for name in self.queue_weights if name != queue_name]
+
+    def wait_for_free_slot(self):
+        """
+        When running jobs on a thread pool, block until fewer than
+        `concurrency` jobs are in flight.
+        """
+        self.collect_finished_jobs()
+        while len(self.futures) >= self.concurrency:
+            wait(self.futures, return_when=FIRST_COMPLETED)
+            self.collect_finished_jobs()
+
+    def collect_finished_jobs(self):
+        """
+        Forget about jobs which have finished on the thread pool, re-raising
+        any error they raised while saving so that the worker fails in the
+        same way as it does when running jobs in the main thread.
+        """
+        finished = {future for future in self.futures if future.done()}
+        self.futures -= finished
+        for future in finished:
+            future.result()
+
+    def _process_job(self):
+        """
+        Claim and run a single job, either in the main thread or on the
+        thread pool. Returns False if there was no job to run.
+        """
+        if self.executor:
+            self.wait_for_free_slot()
+
+        job = self.claim_job()
+        if not job:
+            return False
+
+        logger.info(
+            'Processing job: name="%s" queue="%s" id=%s state=%s next_task=%s',
+            job.name,
+            job.queue_name,
+            job.pk,
+            job.state,
+            job.next_task,
+        )
+        self.current_jobs.add(job)
+        self.metrics.set_in_flight(len(self.current_jobs))
+
+        if self.executor:
+            self.futures.add(self.executor.submit(self.run_job_in_thread, job))
+        else:
+            self.run_job(job)
+        return True
+
+    def run_job_in_thread(self, job):
+        try:
+            self.run_job(job)
+        finally:
+            # Each thread has its own database connection; treat every job
+            # like a request and let Django close it according to
+            # CONN_MAX_AGE.
+            close_old_connections()
+
+    def has_hook(self, job, hook_name):
+        return bool(job.get_job_definition().get_hook_name(hook_name))
+
+    def run_hook(self, job, hook_name, run_hook, *args):
+        if not self.has_hook(job, hook_name):
+            return
+        started = monotonic()
+        try:
+            run_hook(*args)
+        finally:
+            self.metrics.observe_hook(job, hook_name, monotonic() - started)
+
+    def runs_to_completion(self, job):
+        """Return True if the remaining tasks of the job should be run in
+        the same claim, rather than returning it to the queue between
+        tasks"""
+        return self.run_to_completion or job.get_job_definition().run_to_completion
+
+    def run_job(self, job):
+        """
+        Run the next task of a claimed job, along with its hooks, and save
+        the outcome. A job which runs to completion has each of its
+        remaining tasks run in turn, with a checkpoint between them.
+        """
+        run_to_completion = self.runs_to_completion(job)
+        saved = False
+        try:
+            while True:
+                succeeded = self.run_task(job)
+                if not (
+                    succeeded
+                    and run_to_completion
+                    and job.state == Job.STATES.READY
+                    and self.alive
+                ):
+                    break
+                if not self.checkpoint(job):
+                    return
+            saved = self.save_outcome(job)
+        finally:
+            self.current_jobs.discard(job)
+            self.metrics.set_in_flight(len(self.current_jobs))
+        if saved:
+            self.metrics.observe_outcome(job)
+
+    def run_task(self, job):
+        """
+        Run the next task of a job, along with its hooks, and set the job's
+        state and next task accordingly. A failed task is either retried, as
+        set out by the job's retry policy, or fails the job. Returns True if
+        the task succeeded.
+        """
+        succeeded = False
+        try:
+            self.run_hook(job, PRE_TASK_HOOK_KEY, job.run_pre_task_hook)
+            task_name = job.next_task
+            started = monotonic()
+            try:
+                job.run_next_task()
+            finally:
+                self.metrics.observe_task(job, task_name, monotonic() - started)
+            self.task_succeeded(job)
+            succeeded = True
         except Exception as exception:
-            logger.exception("Job id=%s failed", job.pk)
-            job.state = Job.STATES.FAILED
-            job.run_failure_hook(exception)
+            if not self.schedule_retry(job, exception):
+                logger.exception("Job id=%s failed", job.pk)
+                job.state = Job.STATES.FAILED
+                self.run_hook(job, FAILURE_HOOK_KEY, job.run_failure_hook, exception)
         finally:
             try:
-                job.run_post_task_hook()
+                self.run_hook(job, POST_TASK_HOOK_KEY, job.run_post_task_hook)
             except:
                 logger.exception("Job id=%s post_task_hook failed", job.pk)
+        return succeeded
+
+    def task_succeeded(self, job):
+        job.update_next_task()
+        job.attempts = 0
+
+        if not job.next_task:
+            job.state = Job.STATES.COMPLETE
+        else:
+            job.state = Job.STATES.READY
+
+    def schedule_retry(self, job, exception):
+        """
+        Count a failed attempt at the job's task and, if the job's retry
+        policy allows it another attempt, return the job to READY with
+        `run_after` set after a backoff, and return True.
+        """
+        job.attempts += 1
+        retry_policy = job.get_job_definition().retry_policy
+        if retry_policy is None or not retry_policy.should_retry(
+            exception, job.attempts
+        ):
+            return False
+        delay = retry_policy.get_delay(job.attempts)
+        job.run_after = timezone.now() + datetime.timedelta(seconds=delay)
+        job.state = Job.STATES.READY
+        logger.warning(
+            "Job id=%s failed, retrying in %.1f seconds (attempt %s of %s)",
+            job.pk,
+            delay,
+            job.attempts + 1,
+            retry_policy.max_attempts,
+            exc_info=True,
+        )
+        return True
+
+    def checkpoint(self, job):
+        """
+        Save the progress of a job which runs to completion between two of
+        its tasks. The job is left PROCESSING, with its lease untouched, so
+        that if the worker dies it is reclaimed and resumed from its next
+        task. Returns False if the job was changed by another process, in
+        which case it must not be run any further.
+        """
+        logger.info(
+            'Checkpointing job: name="%s" id=%s next_task=%s',
+            job.name,
+            job.pk,
+            job.next_task,
+        )
+        job.state = Job.STATES.PROCESSING
+        if not job.save_transition(Job.ACTIVE_STATES, save_lease=False):
+            self.log_lost_update(job)
+            return False
+        return True
 
+    def save_outcome(self, job):
+        """Save the outcome of a job's last task, returning False if the job
+        was changed by another process"""
         logger.info(
             'Updating job: name="%s" id=%s state=%s next_task=%s',
             job.name,
@@ -100,13 +624,298 @@ class Worker:
             job.next_task or "none",
         )
 
+        job.lease_expires = None
+
         try:
-            job.save()
+            saved = job.save_transition(Job.ACTIVE_STATES)
         except:
             logger.exception("Failed to save job: id=%s", job.pk)
             raise
+        if not saved:
+            self.log_lost_update(job)
+        return saved
+
+    def log_lost_update(self, job):
+        logger.warning(
+            "Job id=%s was changed by another process while it was running, "
+            "so its progress was not saved: state=%s next_task=%s",
+            job.pk,
+            job.state,
+            job.next_task or "none",
+        )
+
+
+class AsyncWorker(Worker):
+    """
+    Run jobs as coroutines on a single event loop, with up to `concurrency`
+    jobs in flight at once. Task and hook functions may be `async def`, in
+    which case they run on the event loop; plain functions are run on the
+    loop's default executor with `sync_to_async`, which is given a thread
+    for every job which can be in flight (see `set_task_executor`). Claims and state changes go through the
+    database in a thread with `sync_to_async`, so they never block the loop.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.loop = None
+        self.stopping = None
+        self.task_executor = None
+        super().__init__(*args, **kwargs)
+
+    def create_executor(self):
+        return None
+
+    def set_task_executor(self, loop):
+        """Replace the default executor of the event loop, whose size
+        depends on the number of CPUs, with one which can run a plain task
+        function for every job in flight"""
+        self.task_executor = ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="django_dbq"
+        )
+        loop.set_default_executor(self.task_executor)
+
+    def shutdown(self, signum, frame):
+        self.alive = False
+        if self.loop and self.loop.is_running():
+            # The loop may be running in this thread, so the database must
+            # not be touched from the signal handler.
+            self.stopping = asyncio.run_coroutine_threadsafe(
+                sync_to_async(self.mark_current_jobs_stopping)(), self.loop
+            )
+        else:
+            self.mark_current_jobs_stopping()
+
+    def run(self):
+        asyncio.run(self.arun())
+
+    async def arun(self):
+        self.loop = asyncio.get_running_loop()
+        self.set_task_executor(self.loop)
+        self.metrics.start()
+        self.start_heartbeat()
+        try:
+            while self.alive:
+                await self.aprocess_job()
+                if monotonic() - self.stats_started >= STATS_INTERVAL_IN_SECONDS:
+                    self.report_stats()
+        finally:
+            if self.futures:
+                await asyncio.wait(self.futures)
+            self.task_executor.shutdown(wait=True)
+            if self.stopping:
+                await asyncio.wrap_future(self.stopping)
+            await sync_to_async(self.release_prefetched_jobs)()
+            await sync_to_async(self.stop_heartbeat)()
+            self.report_stats()
+            self.loop = None
+        self.collect_finished_jobs()
+
+    async def aprocess_job(self):
+        """
+        The async equivalent of `process_job`. While jobs are in flight, the
+        worker backs off by sleeping on the event loop; it only waits for a
+        notification once every job has finished.
+        """
+        if self.last_job_finished:
+            seconds_since_last_job = (
+                timezone.now() - self.last_job_finished
+            ).total_seconds()
+            if seconds_since_last_job < self.rate_limit_in_seconds:
+                await asyncio.sleep(self.rate_limit_in_seconds - seconds_since_last_job)
+                return
+
+        if self.rate_limiter:
+            wait_time = self.rate_limiter.wait_time()
+            if wait_time:
+                await asyncio.sleep(wait_time)
+                return
+
+        if await self._aprocess_job():
+            self.jobs_processed += 1
+            self.idle_sleep_in_seconds = 0
+            self.last_job_finished = timezone.now()
+            if self.rate_limiter:
+                self.rate_limiter.try_acquire()
+        else:
+            self.idle_polls += 1
+            self.idle_sleep_in_seconds = min(
+                max(self.idle_sleep_in_seconds * 2, MIN_IDLE_SLEEP_IN_SECONDS),
+                self.max_idle_sleep_in_seconds,
+            )
+            if self.listener and not self.futures:
+                await sync_to_async(self.listener.wait)(
+                    min(self.safety_poll_in_seconds, self.throttled_for or float("inf"))
+                )
+            else:
+                await asyncio.sleep(
+                    min(self.idle_sleep_in_seconds, self.throttled_for or float("inf"))
+                )
+
+    async def await_free_slot(self):
+        self.collect_finished_jobs()
+        while len(self.futures) >= self.concurrency:
+            await asyncio.wait(self.futures, return_when=asyncio.FIRST_COMPLETED)
+            self.collect_finished_jobs()
+
+    async def _aprocess_job(self):
+        await self.await_free_slot()
+
+        job = await sync_to_async(self.claim_job)()
+        if not job:
+            return False
+
+        logger.info(
+            'Processing job: name="%s" queue="%s" id=%s state=%s next_task=%s',
+            job.name,
+            job.queue_name,
+            job.pk,
+            job.state,
+            job.next_task,
+        )
+        self.current_jobs.add(job)
+        self.metrics.set_in_flight(len(self.current_jobs))
+        self.futures.add(asyncio.create_task(self.arun_job(job)))
+        return True
+
+    async def arun_hook(self, job, hook_name, run_hook, *args):
+        if not self.has_hook(job, hook_name):
+            return
+        started = monotonic()
+        try:
+            await run_hook(*args)
+        finally:
+            self.metrics.observe_hook(job, hook_name, monotonic() - started)
+
+    async def arun_job(self, job):
+        """
+        The async equivalent of `run_job`.
+        """
+        run_to_completion = self.runs_to_completion(job)
+        saved = False
+        try:
+            while True:
+                succeeded = await self.arun_task(job)
+                if not (
+                    succeeded
+                    and run_to_completion
+                    and job.state == Job.STATES.READY
+                    and self.alive
+                ):
+                    break
+                if not await sync_to_async(self.checkpoint)(job):
+                    return
+            saved = await sync_to_async(self.save_outcome)(job)
+        finally:
+            self.current_jobs.discard(job)
+            self.metrics.set_in_flight(len(self.current_jobs))
+        if saved:
+            self.metrics.observe_outcome(job)
+
+    async def arun_task(self, job):
+        """
+        The async equivalent of `run_task`.
+        """
+        succeeded = False
+        try:
+            await self.arun_hook(job, PRE_TASK_HOOK_KEY, job.arun_pre_task_hook)
+            task_name = job.next_task
+            started = monotonic()
+            try:
+                await job.arun_next_task()
+            finally:
+                self.metrics.observe_task(job, task_name, monotonic() - started)
+            self.task_succeeded(job)
+            succeeded = True
+        except Exception as exception:
+            if not self.schedule_retry(job, exception):
+                logger.exception("Job id=%s failed", job.pk)
+                job.state = Job.STATES.FAILED
+                await self.arun_hook(
+                    job, FAILURE_HOOK_KEY, job.arun_failure_hook, exception
+                )
+        finally:
+            try:
+                await self.arun_hook(job, POST_TASK_HOOK_KEY, job.arun_post_task_hook)
+            except:
+                logger.exception("Job id=%s post_task_hook failed", job.pk)
+        return succeeded
+
 
-        self.current_job = None
+class Supervisor:
+    """
+    Fork a number of worker processes and look after them.
+
+    The children are forked after Django has been set up, so they share the
+    parent's imports copy-on-write rather than each starting a cold
+    interpreter. Children which crash are restarted. When the supervisor is
+    asked to stop, it forwards SIGTERM to its children and waits for them to
+    drain their jobs and exit.
+    """
+
+    def __init__(self, processes, worker_factory):
+        self.processes = processes
+        self.worker_factory = worker_factory
+        self.alive = True
+        self.children = set()
+        self.init_signals()
+
+    def init_signals(self):
+        signal.signal(signal.SIGINT, self.shutdown)
+
+        # for Windows, which doesn't support the SIGQUIT signal
+        if hasattr(signal, "SIGQUIT"):
+            signal.signal(signal.SIGQUIT, self.shutdown)
+
+        signal.signal(signal.SIGTERM, self.shutdown)
+
+    def shutdown(self, signum, frame):
+        self.alive = False
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def spawn(self):
+        # Children must not share the parent's database connections.
+        connections.close_all()
+        pid = os.fork()
+        if pid == 0:
+            self.children = set()
+            exit_code = 0
+            try:
+                self.worker_factory().run()
+            except BaseException:
+                logger.exception("Worker process pid=%s failed", os.getpid())
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+
+        self.children.add(pid)
+        logger.info("Started worker process pid=%s", pid)
+
+    def run(self):
+        for _ in range(self.processes):
+            self.spawn()
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            self.children.discard(pid)
+
+            if os.WIFSIGNALED(status) or os.WEXITSTATUS(status) != 0:
+                logger.warning(
+                    "Worker process pid=%s exited unexpectedly with status %s",
+                    pid,
+                    status,
+                )
+                if self.alive:
+                    sleep(RESTART_DELAY_IN_SECONDS)
+                if self.alive:
+                    self.spawn()
+            else:
+                logger.info("Worker process pid=%s exited", pid)
 
 
 class Command(BaseCommand):
@@ -114,14 +923,98 @@ class Command(BaseCommand):
     help = "Run a queue worker process"
 
     def add_arguments(self, parser):
-        parser.add_argument("queue_name", nargs="?", default="default", type=str)
+        parser.add_argument(
+            "queue_name",
+            nargs="*",
+            default=[DEFAULT_QUEUE_NAME],
+            type=str,
+            help='The queues to process, each given as "name" or "name:weight". The default is "%s".'
+            % DEFAULT_QUEUE_NAME,
+        )
         parser.add_argument(
             "--rate_limit",
             help="The rate limit in seconds. The default rate limit is 1 job per second.",
             nargs="?",
+            default=None,
+            type=float,
+        )
+        parser.add_argument(
+            "--rate",
+            help='The maximum rate at which this worker starts jobs, eg "50/s" or "3/m". Replaces --rate_limit.',
+            default=None,
+            type=str,
+        )
+        parser.add_argument(
+            "--burst",
+            help="With --rate, the number of jobs which can be started at once after the worker has been idle. The default is 1.",
+            default=1,
+            type=int,
+        )
+        parser.add_argument(
+            "--prefetch",
+            help="The number of jobs to claim from the database at once. The default is 1.",
+            default=1,
+            type=int,
+        )
+        parser.add_argument(
+            "--max_idle_sleep",
+            help="The maximum number of seconds to sleep between polls when the queue is empty. The default is %s."
+            % DEFAULT_MAX_IDLE_SLEEP_IN_SECONDS,
+            default=DEFAULT_MAX_IDLE_SLEEP_IN_SECONDS,
+            type=float,
+        )
+        parser.add_argument(
+            "--concurrency",
+            help="The number of jobs to run at once on a pool of threads. The default is 1.",
             default=1,
             type=int,
         )
+        parser.add_argument(
+            "--async",
+            action="store_true",
+            dest="use_async",
+            default=False,
+            help="Run jobs as coroutines on an event loop, with up to --concurrency jobs in flight at once.",
+        )
+        parser.add_argument(
+            "--processes",
+            help="The number of worker processes to fork and supervise. The default is 1.",
+            default=1,
+            type=int,
+        )
+        parser.add_argument(
+            "--no_listen",
+            action="store_false",
+            dest="listen",
+            default=True,
+            help="On PostgreSQL, poll for new jobs instead of waiting for notifications.",
+        )
+        parser.add_argument(
+            "--safety_poll",
+            help="When waiting for notifications, the number of seconds between polls for scheduled jobs. The default is %s."
+            % DEFAULT_SAFETY_POLL_IN_SECONDS,
+            default=DEFAULT_SAFETY_POLL_IN_SECONDS,
+            type=float,
+        )
+        parser.add_argument(
+            "--lease",
+            help="The number of seconds a claimed job is leased to the worker for. The lease is renewed every third of this, and jobs whose lease expires are returned to READY. The default is %s."
+            % DEFAULT_LEASE_IN_SECONDS,
+            default=DEFAULT_LEASE_IN_SECONDS,
+            type=float,
+        )
+        parser.add_argument(
+            "--metrics",
+            help='Where to send worker metrics: "prometheus:PORT" to serve them to Prometheus, "statsd:HOST:PORT" to send them to statsd, or the import path of a django_dbq.metrics.Metrics subclass.',
+            default=None,
+            type=str,
+        )
+        parser.add_argument(
+            "--run_to_completion",
+            action="store_true",
+            default=False,
+            help="Run all the remaining tasks of each job in one go, with a checkpoint between them, rather than returning the job to the queue after each task.",
+        )
         parser.add_argument(
             "--dry-run",
             action="store_true",
@@ -137,17 +1030,110 @@ class Command(BaseCommand):
         if len(args) != 1:
             raise CommandError("Please supply a single queue job name")
 
-        queue_name = options["queue_name"]
+        queue_specs = options["queue_name"]
+        if isinstance(queue_specs, str):
+            queue_specs = [queue_specs]
+
+        queue_weights = {}
+        for queue_spec in queue_specs:
+            try:
+                queue_name, weight = parse_queue_spec(queue_spec)
+            except ValueError as exception:
+                raise CommandError(str(exception))
+            if queue_name in queue_weights:
+                raise CommandError('Queue "%s" was given more than once' % queue_name)
+            queue_weights[queue_name] = weight
+
         rate_limit_in_seconds = options["rate_limit"]
+        rate = options["rate"]
+        burst = options["burst"]
+
+        if rate is not None:
+            if rate_limit_in_seconds is not None:
+                raise CommandError("Please supply only one of --rate and --rate_limit")
+            try:
+                rate = parse_rate(rate)
+            except ValueError as exception:
+                raise CommandError(str(exception))
+            rate_limit_in_seconds = 0
+        elif rate_limit_in_seconds is None:
+            rate_limit_in_seconds = 1
+
+        if burst < 1:
+            raise CommandError("--burst must be at least 1")
+
+        prefetch = options["prefetch"]
+
+        if prefetch < 1:
+            raise CommandError("--prefetch must be at least 1")
+
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be at least 1")
+
+        processes = options["processes"]
+
+        if processes < 1:
+            raise CommandError("--processes must be at least 1")
+
+        if options["lease"] <= 0:
+            raise CommandError("--lease must be greater than 0")
+
+        if processes > 1 and not hasattr(os, "fork"):
+            raise CommandError("--processes is not supported on this platform")
+
+        metrics = None
+        if options["metrics"]:
+            try:
+                metrics = get_metrics(options["metrics"])
+            except ValueError as exception:
+                raise CommandError(str(exception))
+            if processes > 1 and isinstance(metrics, PrometheusMetrics):
+                raise CommandError(
+                    "Prometheus metrics can't be served from several processes on one port, use statsd with --processes"
+                )
+
+        # Import every task and hook now, so that a misconfigured job stops
+        # the worker from starting and forked worker processes share the
+        # imported modules.
+        try:
+            load_job_registry()
+        except ImproperlyConfigured as exception:
+            raise CommandError(str(exception))
+
+        if rate:
+            self.stdout.write(
+                'Starting job worker for queue "%s" with rate limit of %s job(s) per second and bursts of %s'
+                % (" ".join(queue_specs), rate, burst)
+            )
+        else:
+            self.stdout.write(
+                'Starting job worker for queue "%s" with rate limit of one job per %s second(s)'
+                % (" ".join(queue_specs), rate_limit_in_seconds)
+            )
 
-        self.stdout.write(
-            'Starting job worker for queue "%s" with rate limit of one job per %s second(s)'
-            % (queue_name, rate_limit_in_seconds)
+        worker_factory = partial(
+            AsyncWorker if options["use_async"] else Worker,
+            queue_weights,
+            rate_limit_in_seconds,
+            prefetch=prefetch,
+            max_idle_sleep_in_seconds=options["max_idle_sleep"],
+            listen=options["listen"],
+            safety_poll_in_seconds=options["safety_poll"],
+            concurrency=options["concurrency"],
+            lease_in_seconds=options["lease"],
+            rate=rate,
+            burst=burst,
+            metrics=metrics,
+            run_to_completion=options["run_to_completion"],
         )
 
-        worker = Worker(queue_name, rate_limit_in_seconds)
+        if processes > 1:
+            self.stdout.write("Supervising %s worker processes" % processes)
+            runner = Supervisor(processes, worker_factory)
+        else:
+            runner = worker_factory()
 
         if options["dry_run"]:
             return
 
-        worker.run()
+        runner.run()
@@ -0,0 +1,286 @@
+from django.utils.module_loading import import_string
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bisect
+import logging
+import re
+import socket
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metrics:
+    """
+    Receives measurements from the worker's hot path. This base class
+    ignores them all; subclass it and override the methods you need to send
+    them somewhere. Methods may be called from several threads at once.
+    """
+
+    def start(self):
+        """Called in the worker process before it starts processing jobs"""
+
+    def observe_claim(self, queue_name, seconds, claimed):
+        """A claim query on `queue_name` took `seconds` and claimed
+        `claimed` jobs (0 for a miss)"""
+
+    def observe_queue_wait(self, job, seconds):
+        """`job` waited `seconds` to be claimed since it was created, or
+        since its `run_after` if that is later"""
+
+    def observe_task(self, job, task_name, seconds):
+        """The task `task_name` of `job` ran for `seconds`"""
+
+    def observe_hook(self, job, hook_name, seconds):
+        """The hook `hook_name` (eg "pre_task_hook") of `job` ran for
+        `seconds`"""
+
+    def observe_outcome(self, job):
+        """`job` has been saved in `job.state` after running a task"""
+
+    def set_in_flight(self, count):
+        """The worker is running `count` jobs"""
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, escape_label_value(value)) for name, value in labels
+    )
+
+
+class PrometheusMetrics(Metrics):
+    """
+    Keep metrics in memory and serve them in the Prometheus text format on
+    `port`, on a background thread of the worker process.
+    """
+
+    HISTOGRAMS = {
+        "dbq_claim_duration_seconds": "Time taken by claim queries",
+        "dbq_queue_wait_seconds": "Time jobs waited to be claimed",
+        "dbq_task_duration_seconds": "Time spent running tasks",
+        "dbq_hook_duration_seconds": "Time spent running hooks",
+    }
+    COUNTERS = {
+        "dbq_claims_total": "Claim queries, by whether they claimed any jobs",
+        "dbq_jobs_total": "Jobs which have run a task, by the state they were left in",
+    }
+    GAUGES = {
+        "dbq_jobs_in_flight": "Jobs being run by the worker",
+    }
+
+    def __init__(self, port, address=""):
+        self.port = port
+        self.address = address
+        self.lock = threading.Lock()
+        self.histograms = {name: {} for name in self.HISTOGRAMS}
+        self.counters = {name: {} for name in self.COUNTERS}
+        self.gauges = {name: {} for name in self.GAUGES}
+        self.server = None
+
+    def start(self):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.address, self.port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(
+            target=self.server.serve_forever, name="django_dbq_metrics", daemon=True
+        ).start()
+        logger.info("Serving Prometheus metrics on port %s", self.port)
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            histogram = self.histograms[name].get(labels)
+            if histogram is None:
+                histogram = self.histograms[name][labels] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name, labels, value=1):
+        with self.lock:
+            self.counters[name][labels] = self.counters[name].get(labels, 0) + value
+
+    def observe_claim(self, queue_name, seconds, claimed):
+        self.observe("dbq_claim_duration_seconds", (("queue", queue_name),), seconds)
+        self.increment(
+            "dbq_claims_total",
+            (("queue", queue_name), ("result", "hit" if claimed else "miss")),
+        )
+
+    def observe_queue_wait(self, job, seconds):
+        self.observe(
+            "dbq_queue_wait_seconds",
+            (("job", job.name), ("queue", job.queue_name)),
+            seconds,
+        )
+
+    def observe_task(self, job, task_name, seconds):
+        self.observe(
+            "dbq_task_duration_seconds",
+            (("job", job.name), ("task", task_name)),
+            seconds,
+        )
+
+    def observe_hook(self, job, hook_name, seconds):
+        self.observe(
+            "dbq_hook_duration_seconds",
+            (("job", job.name), ("hook", hook_name)),
+            seconds,
+        )
+
+    def observe_outcome(self, job):
+        self.increment("dbq_jobs_total", (("job", job.name), ("state", job.state)))
+
+    def set_in_flight(self, count):
+        with self.lock:
+            self.gauges["dbq_jobs_in_flight"][()] = count
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, help_text in self.HISTOGRAMS.items():
+                lines += [
+                    "# HELP %s %s" % (name, help_text),
+                    "# TYPE %s histogram" % name,
+                ]
+                for labels, histogram in self.histograms[name].items():
+                    cumulative = 0
+                    bounds = [str(bound) for bound in histogram.buckets] + ["+Inf"]
+                    for bound, count in zip(bounds, histogram.counts):
+                        cumulative += count
+                        lines.append(
+                            "%s_bucket%s %s"
+                            % (
+                                name,
+                                format_labels(labels + (("le", bound),)),
+                                cumulative,
+                            )
+                        )
+                    lines.append(
+                        "%s_sum%s %s" % (name, format_labels(labels), histogram.sum)
+                    )
+                    lines.append(
+                        "%s_count%s %s" % (name, format_labels(labels), cumulative)
+                    )
+            for name, help_text in self.COUNTERS.items():
+                lines += [
+                    "# HELP %s %s" % (name, help_text),
+                    "# TYPE %s counter" % name,
+                ]
+                for labels, value in self.counters[name].items():
+                    lines.append("%s%s %s" % (name, format_labels(labels), value))
+            for name, help_text in self.GAUGES.items():
+                lines += ["# HELP %s %s" % (name, help_text), "# TYPE %s gauge" % name]
+                for labels, value in self.gauges[name].items():
+                    lines.append("%s%s %s" % (name, format_labels(labels), value))
+        return "\n".join(lines) + "\n"
+
+
+def statsd_name(value):
+    """Make a job, task or queue name safe to use as part of a statsd
+    metric name"""
+    return re.sub(r"[^A-Za-z0-9_-]", "_", str(value))
+
+
+class StatsdMetrics(Metrics):
+    """
+    Send metrics to a statsd server over UDP. Timings are sent in
+    milliseconds, with names such as `dbq.task.<job>.<task>`.
+    """
+
+    def __init__(self, host="localhost", port=8125, prefix="dbq"):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = None
+
+    def start(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, name, value, metric_type):
+        if self.socket is None:
+            return
+        try:
+            self.socket.sendto(
+                ("%s.%s:%s|%s" % (self.prefix, name, value, metric_type)).encode(
+                    "utf-8"
+                ),
+                self.address,
+            )
+        except OSError:
+            logger.debug("Failed to send metric %s to statsd", name, exc_info=True)
+
+    def timing(self, name, seconds):
+        self.send(name, round(seconds * 1000, 3), "ms")
+
+    def observe_claim(self, queue_name, seconds, claimed):
+        queue_name = statsd_name(queue_name)
+        self.timing("claim.%s.duration" % queue_name, seconds)
+        self.send("claim.%s.%s" % (queue_name, "hit" if claimed else "miss"), 1, "c")
+
+    def observe_queue_wait(self, job, seconds):
+        self.timing("queue_wait.%s" % statsd_name(job.queue_name), seconds)
+
+    def observe_task(self, job, task_name, seconds):
+        self.timing(
+            "task.%s.%s" % (statsd_name(job.name), statsd_name(task_name)), seconds
+        )
+
+    def observe_hook(self, job, hook_name, seconds):
+        self.timing("hook.%s.%s" % (statsd_name(job.name), hook_name), seconds)
+
+    def observe_outcome(self, job):
+        self.send("jobs.%s.%s" % (statsd_name(job.name), job.state.lower()), 1, "c")
+
+    def set_in_flight(self, count):
+        self.send("in_flight", count, "g")
+
+
+def get_metrics(spec):
+    """
+    Build the metrics for the worker's --metrics option, given as
+    "prometheus:PORT", "statsd:HOST:PORT" or the import path of a Metrics
+    subclass. Raises ValueError if the spec is invalid.
+    """
+    kind, _, options = spec.partition(":")
+    try:
+        if kind == "prometheus":
+            return PrometheusMetrics(int(options))
+        if kind == "statsd":
+            host, _, port = options.rpartition(":")
+            return StatsdMetrics(host or "localhost", int(port or 8125))
+        metrics_class = import_string(spec)
+    except (ImportError, ValueError) as exception:
+        raise ValueError('Invalid metrics "%s": %s' % (spec, exception))
+    if not (isinstance(metrics_class, type) and issubclass(metrics_class, Metrics)):
+        raise ValueError('"%s" is not a subclass of Metrics' % spec)
+    return metrics_class()
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.15 on 2026-10-16 23:01
+
+import django_dbq.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_dbq", "0006_alter_job_state"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="job",
+            index=django_dbq.models.PartialIndex(
+                condition=models.Q(("state__in", ["READY", "NEW"])),
+                fields=["queue_name", "-priority", "created", "run_after"],
+                name="django_dbq_job_claim_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-16 23:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_dbq", "0007_job_claim_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="lease_expires",
+            field=models.DateTimeField(null=True),
+        ),
+    ]
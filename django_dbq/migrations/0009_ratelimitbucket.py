@@ -0,0 +1,24 @@
+# Generated by Django 5.1.15 on 2026-10-16 23:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_dbq", "0008_job_lease_expires"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RateLimitBucket",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+                ("tokens", models.FloatField()),
+                ("updated", models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.15 on 2026-10-16 23:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_dbq", "0009_ratelimitbucket"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="QueueDepthCounter",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("queue_name", models.CharField(max_length=20)),
+                ("shard", models.PositiveSmallIntegerField()),
+                ("count", models.BigIntegerField(default=0)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("queue_name", "shard"),
+                        name="django_dbq_queuedepthcounter_unique",
+                    )
+                ],
+            },
+        ),
+    ]
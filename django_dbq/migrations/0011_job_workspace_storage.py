@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-16 23:23
+
+import django_dbq.workspace
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_dbq", "0010_queuedepthcounter"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="job",
+            name="workspace",
+            field=django_dbq.workspace.WorkspaceField(null=True),
+        ),
+    ]
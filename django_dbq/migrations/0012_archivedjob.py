@@ -0,0 +1,49 @@
+# Generated by Django 5.1.15 on 2026-10-16 23:25
+
+import django_dbq.workspace
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_dbq", "0011_job_workspace_storage"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedJob",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(editable=False, primary_key=True, serialize=False),
+                ),
+                ("created", models.DateTimeField(db_index=True)),
+                ("modified", models.DateTimeField()),
+                ("archived", models.DateTimeField(db_index=True)),
+                ("name", models.CharField(db_index=True, max_length=100)),
+                (
+                    "state",
+                    models.CharField(
+                        choices=[
+                            ("NEW", "New"),
+                            ("READY", "Ready"),
+                            ("PROCESSING", "Processing"),
+                            ("STOPPING", "Stopping"),
+                            ("FAILED", "Failed"),
+                            ("COMPLETE", "Complete"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("next_task", models.CharField(blank=True, max_length=100)),
+                ("workspace", django_dbq.workspace.WorkspaceField(null=True)),
+                ("queue_name", models.CharField(default="default", max_length=20)),
+                ("priority", models.SmallIntegerField(default=0)),
+                ("run_after", models.DateTimeField(null=True)),
+            ],
+            options={
+                "ordering": ["created"],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.15 on 2026-10-16 23:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_dbq", "0012_archivedjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivedjob",
+            name="attempts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="job",
+            name="attempts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
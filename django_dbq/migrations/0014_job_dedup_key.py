@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-16 23:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_dbq", "0013_job_attempts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivedjob",
+            name="dedup_key",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name="job",
+            name="dedup_key",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="job",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("state__in", ["NEW", "READY", "PROCESSING", "STOPPING"])
+                ),
+                fields=("dedup_key",),
+                name="django_dbq_job_dedup_key_unique",
+            ),
+        ),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 5.1.15 on 2026-10-16 23:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_dbq", "0014_job_dedup_key"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="JobDependency",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+            ],
+        ),
+        migrations.RemoveConstraint(
+            model_name="job",
+            name="django_dbq_job_dedup_key_unique",
+        ),
+        migrations.AddField(
+            model_name="job",
+            name="has_dependents",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="job",
+            name="pending_dependencies",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name="archivedjob",
+            name="state",
+            field=models.CharField(
+                choices=[
+                    ("NEW", "New"),
+                    ("READY", "Ready"),
+                    ("BLOCKED", "Blocked"),
+                    ("PROCESSING", "Processing"),
+                    ("STOPPING", "Stopping"),
+                    ("FAILED", "Failed"),
+                    ("COMPLETE", "Complete"),
+                ],
+                max_length=20,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="job",
+            name="state",
+            field=models.CharField(
+                choices=[
+                    ("NEW", "New"),
+                    ("READY", "Ready"),
+                    ("BLOCKED", "Blocked"),
+                    ("PROCESSING", "Processing"),
+                    ("STOPPING", "Stopping"),
+                    ("FAILED", "Failed"),
+                    ("COMPLETE", "Complete"),
+                ],
+                db_index=True,
+                default="NEW",
+                max_length=20,
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="job",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("state__in", ["NEW", "READY", "BLOCKED", "PROCESSING", "STOPPING"])
+                ),
+                fields=("dedup_key",),
+                name="django_dbq_job_dedup_key_unique",
+            ),
+        ),
+        migrations.AddField(
+            model_name="jobdependency",
+            name="depends_on",
+            field=models.ForeignKey(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="dependents",
+                to="django_dbq.job",
+            ),
+        ),
+        migrations.AddField(
+            model_name="jobdependency",
+            name="job",
+            field=models.ForeignKey(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="dependencies",
+                to="django_dbq.job",
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-16 23:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_dbq", "0015_job_dependencies"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="claim_id",
+            field=models.UUIDField(editable=False, null=True),
+        ),
+    ]
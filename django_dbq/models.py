@@ -1,16 +1,50 @@
-from django.db import models
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections, models, transaction
 from django.utils import timezone
-from django.utils.module_loading import import_string
 from django_dbq.tasks import (
+    get_job_definition,
     get_next_task_name,
     get_pre_task_hook_name,
     get_post_task_hook_name,
     get_failure_hook_name,
     get_creation_hook_name,
 )
-from django.db.models import JSONField, UUIDField, Count, TextChoices, Q
+from django_dbq.notifications import notify
+from django_dbq.workspace import (
+    OFFLOADED,
+    STORAGE_DIRECTORY,
+    MARKER_KEY,
+    StoredWorkspace,
+    WorkspaceField,
+    get_storage,
+    get_storage_alias,
+    workspace_changed,
+)
+from django.db.models import (
+    UUIDField,
+    Case,
+    Count,
+    Exists,
+    F,
+    OuterRef,
+    Sum,
+    TextChoices,
+    Q,
+    When,
+)
+from django.db.models.expressions import RawSQL, Value
+from django.db.models.fields.json import KeyTextTransform
+import collections
+import copy
 import datetime
+import functools
+import inspect
+import itertools
 import logging
+import operator
+import random
+import time
 import uuid
 
 
@@ -19,6 +53,117 @@ logger = logging.getLogger(__name__)
 
 DEFAULT_DELETE_JOBS_AFTER_HOURS = 24
 
+DEFAULT_ARCHIVE_JOBS_AFTER_HOURS = 24
+
+DEFAULT_BULK_ENQUEUE_BATCH_SIZE = 1000
+
+DEFAULT_DELETE_BATCH_SIZE = 1000
+
+DEFAULT_LEASE_IN_SECONDS = 60
+
+DEFAULT_WORKSPACE_FILE_GRACE_IN_SECONDS = 60 * 60
+
+# The claimable states, given the quoted table and column names
+CLAIMABLE_STATES_SQL = "%s.%s IN ('READY', 'NEW')"
+
+QUEUE_DEPTH_COUNTER_SHARDS = 16
+
+ON_DUPLICATE_IGNORE = "ignore"
+
+ON_DUPLICATE_REPLACE = "replace"
+
+# The fields of a waiting job which are replaced by a duplicate enqueued
+# with on_duplicate="replace"
+DUPLICATE_REPLACED_FIELDS = ("workspace", "priority", "run_after")
+
+# The fields of a claimed job which only the claim, the worker's heartbeat and
+# the saved outcome write, and which a plain save leaves alone
+CLAIM_FIELDS = ("lease_expires", "claim_id")
+
+# The previous state of a job whose state wasn't loaded from the database
+NOT_LOADED = object()
+
+
+def call_task_function(function, *args):
+    """Call a task or hook function, running it to completion if it is a
+    coroutine function"""
+    if inspect.iscoroutinefunction(function):
+        return async_to_sync(function)(*args)
+    return function(*args)
+
+
+def call_in_worker_thread(function, *args):
+    """Call a plain task or hook function on a thread of the event loop's
+    executor, closing the thread's database connection afterwards unless
+    it is persistent"""
+    try:
+        return function(*args)
+    finally:
+        close_old_connections()
+
+
+async def acall_task_function(function, *args):
+    """
+    Await a task or hook function, running it in a thread (where it may use
+    the ORM) if it is a plain function.
+
+    Plain functions aren't run thread sensitively, so each gets a thread of
+    its own and several can run at once, rather than queueing up for the
+    single thread which `sync_to_async` uses by default.
+    """
+    if inspect.iscoroutinefunction(function):
+        return await function(*args)
+    return await sync_to_async(call_in_worker_thread, thread_sensitive=False)(
+        function, *args
+    )
+
+
+def get_workspace_file_names(queryset, storage_alias):
+    """Return the names of the workspace files in the given storage which
+    the jobs in `queryset` refer to"""
+    return {
+        name
+        for kind, alias, name in queryset.filter(workspace__has_key=MARKER_KEY)
+        .annotate(
+            workspace_kind=KeyTextTransform(MARKER_KEY, "workspace"),
+            workspace_storage=KeyTextTransform("storage", "workspace"),
+            workspace_name=KeyTextTransform("name", "workspace"),
+        )
+        .values_list("workspace_kind", "workspace_storage", "workspace_name")
+        if kind == OFFLOADED and alias == storage_alias
+    }
+
+
+def under_claim(jobs):
+    """Return a filter matching the given jobs only while they are still
+    under the claim they were loaded with (see `JobManager.claim`)"""
+    pks_by_claim = collections.defaultdict(list)
+    for job in jobs:
+        pks_by_claim[job.claim_id].append(job.pk)
+    return functools.reduce(
+        operator.or_,
+        (Q(pk__in=pks, claim_id=claim_id) for claim_id, pks in pks_by_claim.items()),
+    )
+
+
+class PartialIndex(models.Index):
+    """
+    An index whose condition is only applied on backends which support
+    partial indexes. Elsewhere (eg MySQL) it is created as a plain index.
+    """
+
+    def create_sql(self, model, schema_editor, using="", **kwargs):
+        if (
+            self.condition is not None
+            and not schema_editor.connection.features.supports_partial_indexes
+        ):
+            path, args, index_kwargs = self.deconstruct()
+            index_kwargs.pop("condition")
+            return models.Index(*args, **index_kwargs).create_sql(
+                model, schema_editor, using=using, **kwargs
+            )
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
 
 class JobManager(models.Manager):
     def get_ready_or_none(self, queue_name, max_retries=3):
@@ -51,9 +196,526 @@ class JobManager(models.Manager):
                     retries_left,
                 )
 
-    def delete_old(self, hours=None):
+    def claim(
+        self,
+        queue_name,
+        count=1,
+        max_retries=3,
+        lease_in_seconds=None,
+        exclude_names=None,
+        rate_limits=None,
+        throttled=None,
+    ):
+        """
+        Claim up to `count` jobs in state READY or NEW for a given queue (or
+        list of queues, see `to_process`).
+
+        The jobs are locked with `to_process` and moved to PROCESSING with a
+        single UPDATE inside one transaction, so claiming a batch costs the
+        same number of round trips as claiming a single job. The claimed jobs
+        are returned in the order they should be processed. Retries in case
+        of database deadlock in the same way as `get_ready_or_none`.
+
+        If `lease_in_seconds` is given, the jobs are leased to the caller for
+        that long. The lease must be kept alive with `renew_leases`, or the
+        jobs will be returned to READY by `reclaim_expired`. Jobs with a name
+        in `exclude_names` are left in the queue.
+
+        `rate_limits` maps job names to the (rate, burst) of a limit shared
+        by every worker, see `RateLimitBucket`. Jobs with those names are
+        only claimed while their bucket has tokens; the buckets are only
+        touched when the claim picks up such a job, so claims of other jobs
+        cost nothing extra. If `throttled` is given, it is updated with the
+        number of seconds until each job name which ran out of tokens can
+        be claimed again.
+        """
+        retries_left = max_retries
+        while True:
+            try:
+                with transaction.atomic(using=self.db):
+                    jobs = self.to_process(queue_name)
+                    if exclude_names:
+                        jobs = jobs.exclude(name__in=exclude_names)
+                    jobs = list(jobs[:count])
+                    if jobs and rate_limits:
+                        jobs = self.take_rate_limit_tokens(jobs, rate_limits, throttled)
+                    if jobs:
+                        now = timezone.now()
+                        lease_expires = None
+                        if lease_in_seconds is not None:
+                            lease_expires = now + datetime.timedelta(
+                                seconds=lease_in_seconds
+                            )
+                        claim_id = uuid.uuid4()
+                        self.filter(pk__in=[job.pk for job in jobs]).update(
+                            state=Job.STATES.PROCESSING,
+                            modified=now,
+                            lease_expires=lease_expires,
+                            claim_id=claim_id,
+                        )
+                        for job in jobs:
+                            job.state = Job.STATES.PROCESSING
+                            job.modified = now
+                            job.lease_expires = lease_expires
+                            job.claim_id = claim_id
+                            job._saved_waiting_queue = None
+                            job.track_workspace()
+                        QueueDepthCounter.objects.adjust(
+                            {
+                                name: -count
+                                for name, count in collections.Counter(
+                                    job.queue_name for job in jobs
+                                ).items()
+                            },
+                            using=self.db,
+                        )
+                    return jobs
+            except Exception as e:
+                if retries_left == 0:
+                    raise
+                retries_left -= 1
+                logger.warning(
+                    "Caught %s when claiming READY jobs, retrying %s more times",
+                    str(e),
+                    retries_left,
+                )
+
+    def take_rate_limit_tokens(self, jobs, rate_limits, throttled=None):
         """
-        Delete all jobs older than hours, or DEFAULT_DELETE_JOBS_AFTER_HOURS
+        Take a token from the shared bucket of each of the given (locked)
+        jobs with a rate limited name, and return the jobs which got one.
+        The rest are left as they are, and are unlocked when the claim's
+        transaction commits.
+        """
+        requested = collections.Counter(
+            job.name for job in jobs if job.name in rate_limits
+        )
+        if not requested:
+            return jobs
+
+        taken = RateLimitBucket.objects.take(requested, rate_limits)
+        granted = {name: tokens for name, (tokens, _) in taken.items()}
+        if throttled is not None:
+            throttled.update(
+                {name: wait_time for name, (_, wait_time) in taken.items() if wait_time}
+            )
+
+        allowed = []
+        for job in jobs:
+            if job.name not in granted:
+                allowed.append(job)
+            elif granted[job.name]:
+                granted[job.name] -= 1
+                allowed.append(job)
+        return allowed
+
+    def release(self, jobs):
+        """
+        Return claimed jobs which were never started to READY, so that they
+        can be picked up by another worker. Only jobs which are still in
+        state PROCESSING, under the claim they were loaded with, are touched.
+        """
+        if not jobs:
+            return 0
+        if not QueueDepthCounter.objects.is_enabled():
+            return self.filter(under_claim(jobs), state=Job.STATES.PROCESSING).update(
+                state=Job.STATES.READY, modified=timezone.now(), lease_expires=None
+            )
+
+        jobs_by_queue = collections.defaultdict(list)
+        for job in jobs:
+            jobs_by_queue[job.queue_name].append(job)
+        released = {}
+        with transaction.atomic(using=self.db):
+            for queue_name, queue_jobs in jobs_by_queue.items():
+                released[queue_name] = self.filter(
+                    under_claim(queue_jobs), state=Job.STATES.PROCESSING
+                ).update(
+                    state=Job.STATES.READY, modified=timezone.now(), lease_expires=None
+                )
+            QueueDepthCounter.objects.adjust(released, using=self.db)
+        return sum(released.values())
+
+    def renew_leases(self, jobs, lease_in_seconds=DEFAULT_LEASE_IN_SECONDS):
+        """
+        Extend the leases of claimed jobs to `lease_in_seconds` from now,
+        with a single UPDATE. Jobs which have already finished (or have been
+        reclaimed, even if they have been claimed again since) are not
+        touched. Returns the number of leases renewed.
+
+        Only the database is updated, so `Job.save` leaves the lease of a
+        claimed job alone rather than writing back the stale one.
+        """
+        if not jobs:
+            return 0
+        lease_expires = timezone.now() + datetime.timedelta(seconds=lease_in_seconds)
+        return self.filter(
+            under_claim(jobs),
+            state__in=(Job.STATES.PROCESSING, Job.STATES.STOPPING),
+            lease_expires__isnull=False,
+        ).update(lease_expires=lease_expires)
+
+    def reclaim_expired(self):
+        """
+        Return jobs whose lease has expired to READY, with a single UPDATE.
+
+        A lease expires when the worker which claimed the job stopped
+        renewing it, usually because the worker process or its host died
+        part way through. The job is picked up again from its current
+        `next_task`. Returns the number of jobs reclaimed.
+        """
+        expired = self.filter(
+            state__in=(Job.STATES.PROCESSING, Job.STATES.STOPPING),
+            lease_expires__lt=timezone.now(),
+        )
+        if QueueDepthCounter.objects.is_enabled():
+            # Reclaim one queue at a time, so that the counters know how
+            # many jobs went back to each queue.
+            reclaimed_by_queue = {}
+            with transaction.atomic(using=self.db):
+                for queue_name in set(expired.values_list("queue_name", flat=True)):
+                    reclaimed_by_queue[queue_name] = expired.filter(
+                        queue_name=queue_name
+                    ).update(
+                        state=Job.STATES.READY,
+                        modified=timezone.now(),
+                        lease_expires=None,
+                    )
+                QueueDepthCounter.objects.adjust(reclaimed_by_queue, using=self.db)
+            reclaimed = sum(reclaimed_by_queue.values())
+        else:
+            reclaimed = expired.update(
+                state=Job.STATES.READY, modified=timezone.now(), lease_expires=None
+            )
+        if reclaimed:
+            logger.warning("Reclaimed %s job(s) with an expired lease", reclaimed)
+        return reclaimed
+
+    def enqueue(self, job, on_duplicate=None, depends_on=()):
+        """Create a single job with `bulk_enqueue`, returning the job if it
+        was created or None if it wasn't"""
+        created = self.bulk_enqueue(
+            [job], on_duplicate=on_duplicate, depends_on=depends_on
+        )
+        return created[0] if created else None
+
+    def bulk_enqueue(
+        self,
+        jobs,
+        batch_size=DEFAULT_BULK_ENQUEUE_BATCH_SIZE,
+        on_duplicate=None,
+        depends_on=(),
+    ):
+        """
+        Create many jobs at once, inserting them in batches of `batch_size`.
+
+        Unlike `bulk_create`, this gives each job the same treatment as
+        `Job.save`: its first task and default workspace are set and its
+        creation hook is run. Jobs whose creation hook raises an exception
+        are not created. Returns the list of jobs which were created.
+
+        Only one unfinished job can have a given `dedup_key`. By default, a
+        job which duplicates one raises IntegrityError. With `on_duplicate`
+        set to "ignore" the duplicate is dropped instead, and with "replace"
+        the workspace, priority and run_after of the existing job are
+        replaced with the duplicate's if it is still waiting to be processed
+        (otherwise the duplicate is dropped).
+
+        If `depends_on` (a list of jobs or their primary keys) is given, the
+        jobs are created BLOCKED until every one of those jobs is COMPLETE
+        (see `release_dependents`). Dependencies which are already COMPLETE,
+        or no longer exist, are ignored. If any of them has FAILED, the jobs
+        are created FAILED.
+        """
+        if on_duplicate not in (None, ON_DUPLICATE_IGNORE, ON_DUPLICATE_REPLACE):
+            raise ValueError('Invalid on_duplicate "%s"' % on_duplicate)
+
+        created = []
+        jobs = iter(jobs)
+        with transaction.atomic(using=self.db):
+            # Lock the dependencies, so that none of them can finish before
+            # the jobs which depend on it have been recorded.
+            dependency_states = dict(
+                self.select_for_update()
+                .filter(pk__in=[getattr(job, "pk", job) for job in depends_on])
+                .values_list("pk", "state")
+            )
+            dependencies_failed = Job.STATES.FAILED in dependency_states.values()
+            pending_dependencies = [
+                pk
+                for pk, state in dependency_states.items()
+                if state not in Job.FINISHED_STATES
+            ]
+
+            while True:
+                chunk = list(itertools.islice(jobs, batch_size))
+                if not chunk:
+                    break
+                batch = [job for job in chunk if job.prepare_for_creation()]
+                if not batch:
+                    continue
+                for job in batch:
+                    if dependencies_failed:
+                        job.state = Job.STATES.FAILED
+                    elif pending_dependencies:
+                        job.state = Job.STATES.BLOCKED
+                        job.pending_dependencies = len(pending_dependencies)
+                if on_duplicate is None:
+                    inserted = self.bulk_create(batch, batch_size=batch_size)
+                else:
+                    inserted = self.create_deduplicated(batch, on_duplicate)
+                if pending_dependencies and not dependencies_failed:
+                    JobDependency.objects.using(self.db).bulk_create(
+                        [
+                            JobDependency(job_id=job.pk, depends_on_id=pk)
+                            for job in inserted
+                            for pk in pending_dependencies
+                        ]
+                    )
+                created.extend(inserted)
+
+            if created and pending_dependencies and not dependencies_failed:
+                self.filter(pk__in=pending_dependencies, has_dependents=False).update(
+                    has_dependents=True
+                )
+
+            for using in {job._state.db for job in created}:
+                QueueDepthCounter.objects.adjust(
+                    collections.Counter(
+                        job.queue_name
+                        for job in created
+                        if job._state.db == using and job.is_waiting()
+                    ),
+                    using=using,
+                )
+            for job in created:
+                job._saved_waiting_queue = job.get_waiting_queue()
+
+            for queue_name, using in {
+                (job.queue_name, job._state.db) for job in created
+            }:
+                notify(queue_name, using=using)
+
+        return created
+
+    def create_deduplicated(self, jobs, on_duplicate):
+        """
+        Insert a batch of jobs, dealing with any which duplicate an
+        unfinished job (or each other) as `on_duplicate` says, and return
+        the jobs which were inserted.
+
+        Duplicates are skipped by the database with the partial unique
+        index on `dedup_key`, so that two processes can't enqueue the same
+        work at once. Backends without partial indexes (eg MySQL) check for
+        duplicates before inserting instead, which isn't safe against
+        concurrent inserts.
+        """
+        last_by_key = {}
+        for job in jobs:
+            if job.dedup_key is not None:
+                if on_duplicate == ON_DUPLICATE_REPLACE:
+                    last_by_key[job.dedup_key] = job
+                else:
+                    last_by_key.setdefault(job.dedup_key, job)
+        jobs = [
+            job
+            for job in jobs
+            if job.dedup_key is None or last_by_key[job.dedup_key] is job
+        ]
+
+        if connections[self.db].features.supports_partial_indexes:
+            self.bulk_create(jobs, ignore_conflicts=True)
+            inserted_pks = set(
+                self.filter(pk__in=[job.pk for job in jobs]).values_list(
+                    "pk", flat=True
+                )
+            )
+            inserted = [job for job in jobs if job.pk in inserted_pks]
+        else:
+            existing_keys = set(
+                self.filter(
+                    dedup_key__in=last_by_key, state__in=Job.UNFINISHED_STATES
+                ).values_list("dedup_key", flat=True)
+            )
+            inserted = self.bulk_create(
+                [job for job in jobs if job.dedup_key not in existing_keys]
+            )
+
+        if on_duplicate == ON_DUPLICATE_REPLACE:
+            inserted_keys = {job.dedup_key for job in inserted}
+            self.replace_waiting_duplicates(
+                [
+                    job
+                    for job in jobs
+                    if job.dedup_key is not None and job.dedup_key not in inserted_keys
+                ]
+            )
+        return inserted
+
+    def replace_waiting_duplicates(self, duplicates):
+        """
+        Replace the DUPLICATE_REPLACED_FIELDS of the waiting jobs which the
+        given jobs duplicate, with a single UPDATE. The waiting jobs are
+        locked first, so a worker can't claim one part way through.
+        """
+        if not duplicates:
+            return
+        existing = {
+            job.dedup_key: job
+            for job in self.select_for_update()
+            .filter(
+                dedup_key__in=[job.dedup_key for job in duplicates],
+                state__in=Job.WAITING_STATES,
+            )
+            .only("pk", "dedup_key")
+        }
+        replaced = []
+        for duplicate in duplicates:
+            job = existing.get(duplicate.dedup_key)
+            if job is not None:
+                for field_name in DUPLICATE_REPLACED_FIELDS:
+                    setattr(job, field_name, getattr(duplicate, field_name))
+                replaced.append(job)
+        self.bulk_update(replaced, DUPLICATE_REPLACED_FIELDS)
+
+    def release_dependents(self, job):
+        """
+        Update the jobs which are BLOCKED on `job` now that it has finished
+        (or is about to be deleted), in the transaction which saves (or
+        deletes) it.
+
+        If `job` is COMPLETE, the pending dependency count of every job
+        blocked on it is decremented with a single UPDATE, which makes the
+        jobs with no dependencies left READY. Otherwise `job` will never
+        complete, so the jobs blocked on it can never run: they are FAILED
+        too, along with the jobs blocked on those and so on. Either way, the
+        dependency rows of `job` are then deleted.
+        """
+        dependencies = JobDependency.objects.using(self.db).filter(depends_on=job.pk)
+        if job.state == Job.STATES.COMPLETE:
+            # Lock the dependency rows, so that a job can't be released
+            # twice, and then the dependents, so that when two of their
+            # dependencies complete at once the second sees the count left
+            # by the first.
+            dependent_pks = list(
+                dependencies.select_for_update().values_list("job_id", flat=True)
+            )
+            dependents = list(
+                self.select_for_update()
+                .filter(pk__in=dependent_pks, state=Job.STATES.BLOCKED)
+                .only("pk", "queue_name", "pending_dependencies")
+            )
+            released = [
+                dependent
+                for dependent in dependents
+                if dependent.pending_dependencies == 1
+            ]
+            if dependents:
+                # The new state is picked by primary key, rather than from
+                # pending_dependencies, because MySQL evaluates SET
+                # assignments left to right, so the CASE would see the
+                # count after the decrement.
+                self.filter(pk__in=[dependent.pk for dependent in dependents]).update(
+                    state=Case(
+                        When(
+                            pk__in=[dependent.pk for dependent in released],
+                            then=Value(Job.STATES.READY),
+                        ),
+                        default=Value(Job.STATES.BLOCKED),
+                    ),
+                    pending_dependencies=F("pending_dependencies") - 1,
+                    modified=timezone.now(),
+                )
+            released = collections.Counter(
+                dependent.queue_name for dependent in released
+            )
+            QueueDepthCounter.objects.adjust(released, using=self.db)
+            for queue_name in released:
+                notify(queue_name, using=self.db)
+            dependencies.delete()
+        else:
+            self.fail_dependents(job)
+
+    def release_dependents_of(self, jobs):
+        """Release the jobs BLOCKED on any of the jobs in the queryset
+        `jobs`, which are about to be deleted, with `release_dependents`"""
+        for job in jobs.filter(
+            Exists(JobDependency.objects.filter(depends_on=OuterRef("pk")))
+        ).only("pk", "state"):
+            self.release_dependents(job)
+
+    def release_finished_dependencies(self):
+        """
+        Release the jobs BLOCKED on jobs which have finished, or have been
+        deleted, without their dependents being released, because they were
+        changed or deleted with queryset methods such as `update` and
+        `delete`. Deleted jobs count as COMPLETE, as they do in
+        `bulk_enqueue`. Returns the number of such jobs.
+        """
+        depends_on_pks = set(
+            JobDependency.objects.using(self.db)
+            .exclude(
+                Exists(
+                    self.filter(
+                        pk=OuterRef("depends_on_id"), state__in=Job.UNFINISHED_STATES
+                    )
+                )
+            )
+            .values_list("depends_on_id", flat=True)
+        )
+        states = dict(self.filter(pk__in=depends_on_pks).values_list("pk", "state"))
+        for pk in depends_on_pks:
+            with transaction.atomic(using=self.db):
+                self.release_dependents(
+                    Job(pk=pk, state=states.get(pk, Job.STATES.COMPLETE))
+                )
+        return len(depends_on_pks)
+
+    def fail_dependents(self, job):
+        """FAIL the jobs which are BLOCKED on `job`, directly or through
+        other blocked jobs, one level of dependencies at a time"""
+        failed = 0
+        failed_pks = [job.pk]
+        while failed_pks:
+            dependencies = JobDependency.objects.using(self.db).filter(
+                depends_on__in=failed_pks
+            )
+            failed_pks = list(
+                self.select_for_update()
+                .filter(pk__in=dependencies.values("job_id"), state=Job.STATES.BLOCKED)
+                .values_list("pk", flat=True)
+            )
+            if failed_pks:
+                failed += self.filter(pk__in=failed_pks).update(
+                    state=Job.STATES.FAILED, modified=timezone.now()
+                )
+            dependencies.delete()
+        if failed:
+            logger.warning("Failed %s job(s) blocked on failed job %s", failed, job.pk)
+        return failed
+
+    def delete_old(
+        self,
+        hours=None,
+        batch_size=DEFAULT_DELETE_BATCH_SIZE,
+        pause_in_seconds=0,
+        progress=None,
+        queue_name=None,
+    ):
+        """
+        Delete all jobs older than hours, or DEFAULT_DELETE_JOBS_AFTER_HOURS,
+        only from `queue_name` if it is given
+
+        Jobs are deleted in batches of `batch_size`, in primary key order,
+        with `QuerySet.delete`. As long as nothing cascades from jobs and no
+        delete signals are connected to them, each batch is a single DELETE
+        statement which never loads the jobs into Python (otherwise Django
+        loads each batch to send the signals). This keeps each statement
+        (and the locks it holds) short. The jobs blocked on a deleted job are
+        released first (see `release_dependents_of`), or FAILED if it didn't
+        complete. `pause_in_seconds` is slept between batches to give other
+        queries a look in, and `progress` (if given) is called with the
+        running total after each batch. Returns the number of jobs deleted.
         """
         delete_jobs_in_states = [
             Job.STATES.FAILED,
@@ -68,14 +730,165 @@ class JobManager(models.Manager):
             ", ".join(delete_jobs_in_states),
             delete_jobs_created_before.isoformat(),
         )
-        Job.objects.filter(
+        old_jobs = self.filter(
             state__in=delete_jobs_in_states, created__lte=delete_jobs_created_before
-        ).delete()
+        )
+        if queue_name is not None:
+            old_jobs = old_jobs.filter(queue_name=queue_name)
+
+        def delete_batch(batch_queryset):
+            with transaction.atomic(using=batch_queryset.db):
+                self.release_dependents_of(batch_queryset)
+                return batch_queryset.delete()[0]
+
+        return self.process_in_batches(
+            old_jobs, delete_batch, batch_size, pause_in_seconds, progress
+        )
+
+    def archive_old(
+        self,
+        hours=None,
+        batch_size=DEFAULT_DELETE_BATCH_SIZE,
+        pause_in_seconds=0,
+        progress=None,
+    ):
+        """
+        Move COMPLETE and FAILED jobs older than hours (or
+        DEFAULT_ARCHIVE_JOBS_AFTER_HOURS) out of the jobs table into
+        `ArchivedJob`, so that the jobs table only holds the jobs which are
+        still in use.
+
+        Each batch is copied with a single INSERT ... SELECT and deleted as
+        in `delete_old`, in one transaction, so the jobs don't pass through
+        Python. Batches are handled as in `delete_old`. Returns the
+        number of jobs archived.
+        """
+        archive_jobs_created_before = timezone.now() - datetime.timedelta(
+            hours=hours or DEFAULT_ARCHIVE_JOBS_AFTER_HOURS
+        )
+        logger.info(
+            "Archiving all jobs in states COMPLETE, FAILED created before %s",
+            archive_jobs_created_before.isoformat(),
+        )
+        old_jobs = self.filter(
+            state__in=[Job.STATES.COMPLETE, Job.STATES.FAILED],
+            created__lte=archive_jobs_created_before,
+        )
+
+        def archive_batch(batch_queryset):
+            with transaction.atomic(using=batch_queryset.db):
+                ArchivedJob.objects.copy_jobs(batch_queryset)
+                self.release_dependents_of(batch_queryset)
+                return batch_queryset.delete()[0]
+
+        return self.process_in_batches(
+            old_jobs, archive_batch, batch_size, pause_in_seconds, progress
+        )
+
+    def process_in_batches(
+        self, queryset, process_batch, batch_size, pause_in_seconds, progress
+    ):
+        """
+        Call `process_batch` with querysets of up to `batch_size` of the jobs
+        in `queryset`, in primary key order, until `queryset` is empty.
+        `process_batch` must remove the jobs from `queryset` and return the
+        number it removed. `pause_in_seconds` is slept between batches, and
+        `progress` (if given) is called with the running total after each
+        batch. Returns the total.
+        """
+        processed = 0
+        while True:
+            batch = list(
+                queryset.order_by("pk").values_list("pk", flat=True)[:batch_size]
+            )
+            if not batch:
+                break
+            processed += process_batch(self.filter(pk__in=batch))
+            if progress:
+                progress(processed)
+            if len(batch) < batch_size:
+                break
+            if pause_in_seconds:
+                time.sleep(pause_in_seconds)
+        return processed
+
+    def delete_unused_workspace_files(
+        self, grace_in_seconds=DEFAULT_WORKSPACE_FILE_GRACE_IN_SECONDS
+    ):
+        """
+        Delete the files of offloaded workspaces (see django_dbq.workspace)
+        which no job refers to any more, because the job has been deleted or
+        its workspace has been saved again since. Files modified in the last
+        `grace_in_seconds` are kept, so that the file of a job which hasn't
+        been committed yet is left alone. Returns the number of files deleted.
+        """
+        storage_alias = get_storage_alias()
+        if storage_alias is None:
+            return 0
+        storage = get_storage(storage_alias)
+        keep_modified_after = timezone.now() - datetime.timedelta(
+            seconds=grace_in_seconds
+        )
+
+        # List the files before looking for references to them, so that any
+        # file which isn't referenced by then is no longer in use.
+        try:
+            _, file_names = storage.listdir(STORAGE_DIRECTORY)
+        except FileNotFoundError:
+            return 0
+        referenced = get_workspace_file_names(self.all(), storage_alias)
+        referenced |= get_workspace_file_names(
+            ArchivedJob.objects.using(self.db), storage_alias
+        )
+
+        deleted = 0
+        for file_name in file_names:
+            name = "%s/%s" % (STORAGE_DIRECTORY, file_name)
+            if name in referenced:
+                continue
+            if storage.get_modified_time(name) >= keep_modified_after:
+                continue
+            storage.delete(name)
+            deleted += 1
+        return deleted
 
     def to_process(self, queue_name):
-        return self.select_for_update().filter(
-            models.Q(queue_name=queue_name)
-            & models.Q(state__in=(Job.STATES.READY, Job.STATES.NEW))
+        """
+        Return the jobs which are ready to be processed on the given queue,
+        locked for update.
+
+        Where the backend supports it, the lock is taken with SKIP LOCKED so
+        that concurrent workers claim different rows rather than queueing up
+        behind the lock on the same one. Other backends fall back to a plain
+        SELECT ... FOR UPDATE (which is a no-op on SQLite).
+
+        The claimable states are written into the query as literals rather
+        than parameters, so that the planner can prove the query only needs
+        rows covered by the partial `django_dbq_job_claim_idx` index. The
+        column is qualified with the table name, so that it stays
+        unambiguous if the queryset is joined to another table.
+
+        `queue_name` may also be a list of queue names, in which case jobs
+        from all of those queues are returned in priority order.
+        """
+        if isinstance(queue_name, str):
+            queue_filter = models.Q(queue_name=queue_name)
+        else:
+            queue_filter = models.Q(queue_name__in=queue_name)
+
+        queryset = self.select_for_update()
+        connection = connections[queryset.db]
+        if connection.features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True)
+        claimable_states_sql = CLAIMABLE_STATES_SQL % (
+            connection.ops.quote_name(Job._meta.db_table),
+            connection.ops.quote_name(Job._meta.get_field("state").column),
+        )
+        return queryset.filter(
+            queue_filter
+            & models.Q(
+                RawSQL(claimable_states_sql, (), output_field=models.BooleanField())
+            )
             & models.Q(
                 models.Q(run_after__isnull=True)
                 | models.Q(run_after__lte=timezone.now())
@@ -87,6 +900,7 @@ class Job(models.Model):
     class STATES(TextChoices):
         NEW = "NEW"
         READY = "READY"
+        BLOCKED = "BLOCKED"
         PROCESSING = "PROCESSING"
         STOPPING = "STOPPING"
         FAILED = "FAILED"
@@ -100,37 +914,277 @@ class Job(models.Model):
         max_length=20, choices=STATES.choices, default=STATES.NEW, db_index=True
     )
     next_task = models.CharField(max_length=100, blank=True)
-    workspace = JSONField(null=True)
+    workspace = WorkspaceField(null=True)
     queue_name = models.CharField(max_length=20, default="default", db_index=True)
     priority = models.SmallIntegerField(default=0, db_index=True)
     run_after = models.DateTimeField(null=True, db_index=True)
+    lease_expires = models.DateTimeField(null=True)
+    # Set afresh each time the job is claimed, so that the outcome saved by
+    # a worker which has lost its claim can be detected
+    claim_id = UUIDField(null=True, editable=False)
+    attempts = models.PositiveIntegerField(default=0)
+    dedup_key = models.CharField(max_length=255, null=True, blank=True)
+    # The number of unfinished jobs this BLOCKED job is waiting on
+    pending_dependencies = models.PositiveIntegerField(default=0)
+    # Set once another job has been made to depend on this one, so that
+    # jobs without dependents don't look for them when they finish
+    has_dependents = models.BooleanField(default=False)
 
     class Meta:
         ordering = ["-priority", "created"]
+        indexes = [
+            # Matches the filter and ordering of JobManager.to_process, and
+            # only covers the jobs which are waiting to be claimed so that it
+            # stays small however much history the table holds.
+            PartialIndex(
+                fields=["queue_name", "-priority", "created", "run_after"],
+                condition=Q(state__in=["READY", "NEW"]),
+                name="django_dbq_job_claim_idx",
+            ),
+        ]
+        constraints = [
+            # At most one unfinished job for each dedup_key. Finished jobs
+            # are left out, so that the same work can be enqueued again once
+            # it has been done.
+            models.UniqueConstraint(
+                fields=["dedup_key"],
+                condition=Q(
+                    state__in=["NEW", "READY", "BLOCKED", "PROCESSING", "STOPPING"]
+                ),
+                name="django_dbq_job_dedup_key_unique",
+            ),
+        ]
 
     objects = JobManager()
 
+    WAITING_STATES = (STATES.NEW, STATES.READY)
+
+    ACTIVE_STATES = (STATES.PROCESSING, STATES.STOPPING)
+
+    UNFINISHED_STATES = WAITING_STATES + (STATES.BLOCKED,) + ACTIVE_STATES
+
+    FINISHED_STATES = (STATES.COMPLETE, STATES.FAILED)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if "state" in field_names and "queue_name" in field_names:
+            instance._saved_waiting_queue = instance.get_waiting_queue()
+        return instance
+
+    def is_waiting(self):
+        return self.state in self.WAITING_STATES
+
+    def get_waiting_queue(self):
+        """Return the name of the queue this job is waiting on, or None if it
+        isn't waiting to be processed"""
+        return self.queue_name if self.is_waiting() else None
+
     def save(self, *args, **kwargs):
-        if self._state.adding:
-            self.next_task = get_next_task_name(self.name)
-            self.workspace = self.workspace or {}
+        adding = self._state.adding
+        if adding and not self.prepare_for_creation():
+            return  # cancel the save
 
-            try:
-                self.run_creation_hook()
-            except Exception as exception:  # noqa
-                logger.exception(
-                    "Failed to create new job, creation hook raised an exception"
+        if (
+            not adding
+            and kwargs.get("update_fields") is None
+            and self.__dict__.get("claim_id", NOT_LOADED) is not None
+        ):
+            # The lease of a claimed job is renewed in the database by the
+            # worker's heartbeat, so a full save would write back the stale
+            # lease the job was claimed with.
+            deferred = self.get_deferred_fields()
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.attname not in deferred
+                and field.name not in CLAIM_FIELDS
+            ]
+        previous_waiting_queue = None if adding else self.get_saved_waiting_queue()
+        if not adding and self.state in self.FINISHED_STATES:
+            # Release the jobs blocked on this one, as save_transition does.
+            # The row is locked while its has_dependents flag is read, so
+            # that no dependent can be added before the job is saved.
+            using = kwargs.get("using") or self._state.db
+            with transaction.atomic(using=using):
+                self.has_dependents = bool(
+                    Job.objects.using(using)
+                    .select_for_update()
+                    .filter(pk=self.pk)
+                    .values_list("has_dependents", flat=True)
+                    .first()
                 )
-                return  # cancel the save
+                super().save(*args, **kwargs)
+                if self.has_dependents:
+                    Job.objects.db_manager(using).release_dependents(self)
+        else:
+            super().save(*args, **kwargs)
+
+        self.update_queue_depth_counters(previous_waiting_queue)
+
+        if adding:
+            notify(self.queue_name, using=self._state.db)
 
-        return super().save(*args, **kwargs)
+    def delete(self, *args, **kwargs):
+        previous_waiting_queue = self.get_saved_waiting_queue()
+        using = kwargs.get("using") or self._state.db
+        with transaction.atomic(using=using):
+            Job.objects.db_manager(using).release_dependents_of(
+                Job.objects.using(using).filter(pk=self.pk)
+            )
+            result = super().delete(*args, **kwargs)
+        self.update_queue_depth_counters(previous_waiting_queue, deleted=True)
+        return result
+
+    def get_saved_waiting_queue(self):
+        """
+        Return the queue this job was waiting on when it was loaded or last
+        saved. If its state wasn't loaded, and queue depth counters are
+        enabled, it is read from the database, so that the counters can be
+        kept right.
+        """
+        previous_waiting_queue = getattr(self, "_saved_waiting_queue", NOT_LOADED)
+        if (
+            previous_waiting_queue is NOT_LOADED
+            and QueueDepthCounter.objects.is_enabled()
+        ):
+            saved = (
+                Job.objects.using(self._state.db)
+                .filter(pk=self.pk)
+                .values_list("state", "queue_name")
+                .first()
+            )
+            previous_waiting_queue = (
+                saved[1] if saved and saved[0] in self.WAITING_STATES else None
+            )
+        return previous_waiting_queue
+
+    def update_queue_depth_counters(self, previous_waiting_queue, deleted=False):
+        """
+        Move this job between the queue depth counters after it has been
+        saved or deleted, given the queue it was waiting on before (if any,
+        see `get_saved_waiting_queue`). Counters are left alone if the
+        previous queue is unknown, which only happens when they are disabled.
+
+        The counters only see jobs saved and deleted one at a time (or
+        through the manager's methods). Jobs changed with queryset methods
+        such as `update` and `delete` aren't counted, so rebuild the
+        counters (see `QueueDepthCounterManager.rebuild`) afterwards.
+        """
+        waiting_queue = None if deleted else self.get_waiting_queue()
+        if previous_waiting_queue is not NOT_LOADED:
+            deltas = collections.Counter()
+            if previous_waiting_queue:
+                deltas[previous_waiting_queue] -= 1
+            if waiting_queue:
+                deltas[waiting_queue] += 1
+            QueueDepthCounter.objects.adjust(deltas, using=self._state.db)
+        self._saved_waiting_queue = waiting_queue
+
+    def track_workspace(self):
+        """Remember the workspace as it is now, so that `save_transition`
+        only writes it if it is changed. A stored workspace which hasn't
+        been accessed yet isn't loaded."""
+        workspace = self.__dict__.get("workspace")
+        if not isinstance(workspace, StoredWorkspace):
+            workspace = copy.deepcopy(workspace)
+        self._saved_workspace = workspace
+
+    def save_transition(self, from_states, save_lease=True):
+        """
+        Save a change of state with a single UPDATE of the job's state,
+        next_task, attempts, run_after and (unless `save_lease` is False)
+        lease, which only applies while the job is still in one of
+        `from_states` in the database, under the same claim (see
+        `JobManager.claim`). The workspace is only written if it
+        has changed since `track_workspace` was called, so that a large
+        workspace isn't rewritten on every transition.
+
+        Returns False, without writing anything, if the job was moved out of
+        `from_states` by someone else in the meantime (for example reclaimed
+        after its lease expired), or was claimed again since, so that the
+        lost update can be detected.
+
+        When the job finishes and other jobs depend on it, they are released
+        (see `JobManager.release_dependents`) in the same transaction.
+        """
+        fields = {
+            "state": self.state,
+            "next_task": self.next_task,
+            "attempts": self.attempts,
+            "run_after": self.run_after,
+            "modified": timezone.now(),
+        }
+        if save_lease:
+            fields["lease_expires"] = self.lease_expires
+        workspace = self.__dict__.get("workspace")
+        changed = workspace_changed(
+            workspace,
+            getattr(self, "_saved_workspace", NOT_LOADED),
+            self._meta.get_field("workspace").encoder,
+        )
+        if changed:
+            fields["workspace"] = workspace
+
+        previous_waiting_queue = self.get_saved_waiting_queue()
+        transition = Job.objects.using(self._state.db).filter(
+            pk=self.pk, state__in=from_states, claim_id=self.claim_id
+        )
+        finished = self.state in self.FINISHED_STATES
+        updated = 0
+        if not finished:
+            updated = transition.update(**fields)
+        elif not self.has_dependents:
+            # A dependent may have been enqueued since the job was loaded,
+            # in which case this matches nothing and the job is saved below.
+            updated = transition.filter(has_dependents=False).update(**fields)
+        if finished and not updated:
+            with transaction.atomic(using=self._state.db):
+                updated = transition.filter(has_dependents=True).update(**fields)
+                if updated:
+                    self.has_dependents = True
+                    Job.objects.db_manager(self._state.db).release_dependents(self)
+        if not updated:
+            return False
+
+        self.modified = fields["modified"]
+        self.update_queue_depth_counters(previous_waiting_queue)
+        if changed:
+            self.track_workspace()
+        return True
+
+    def prepare_for_creation(self):
+        """
+        Set the first task and default workspace of a new job and run its
+        creation hook. Returns False if the creation hook raised an exception,
+        in which case the job should not be created.
+        """
+        self.next_task = get_next_task_name(self.name)
+        self.workspace = self.workspace or {}
+
+        try:
+            self.run_creation_hook()
+        except Exception as exception:  # noqa
+            logger.exception(
+                "Failed to create new job, creation hook raised an exception"
+            )
+            return False
+        return True
 
     def update_next_task(self):
         self.next_task = get_next_task_name(self.name, self.next_task) or ""
 
+    def get_job_definition(self):
+        return get_job_definition(self.name)
+
     def run_next_task(self):
-        next_task_function = import_string(self.next_task)
-        next_task_function(self)
+        next_task_function = self.get_job_definition().get_task_function(self.next_task)
+        call_task_function(next_task_function, self)
+
+    async def arun_next_task(self):
+        next_task_function = self.get_job_definition().get_task_function(self.next_task)
+        await acall_task_function(next_task_function, self)
 
     def get_pre_task_hook_name(self):
         return get_pre_task_hook_name(self.name)
@@ -148,32 +1202,80 @@ class Job(models.Model):
         pre_task_hook_name = self.get_pre_task_hook_name()
         if pre_task_hook_name:
             logger.info("Running pre_task hook %s for job", pre_task_hook_name)
-            pre_task_hook_function = import_string(pre_task_hook_name)
-            pre_task_hook_function(self)
+            pre_task_hook_function = self.get_job_definition().get_callable(
+                pre_task_hook_name
+            )
+            call_task_function(pre_task_hook_function, self)
+
+    async def arun_pre_task_hook(self):
+        pre_task_hook_name = self.get_pre_task_hook_name()
+        if pre_task_hook_name:
+            logger.info("Running pre_task hook %s for job", pre_task_hook_name)
+            pre_task_hook_function = self.get_job_definition().get_callable(
+                pre_task_hook_name
+            )
+            await acall_task_function(pre_task_hook_function, self)
 
     def run_post_task_hook(self):
         post_task_hook_name = self.get_post_task_hook_name()
         if post_task_hook_name:
             logger.info("Running post_task hook %s for job", post_task_hook_name)
-            post_task_hook_function = import_string(post_task_hook_name)
-            post_task_hook_function(self)
+            post_task_hook_function = self.get_job_definition().get_callable(
+                post_task_hook_name
+            )
+            call_task_function(post_task_hook_function, self)
+
+    async def arun_post_task_hook(self):
+        post_task_hook_name = self.get_post_task_hook_name()
+        if post_task_hook_name:
+            logger.info("Running post_task hook %s for job", post_task_hook_name)
+            post_task_hook_function = self.get_job_definition().get_callable(
+                post_task_hook_name
+            )
+            await acall_task_function(post_task_hook_function, self)
 
     def run_failure_hook(self, exception):
         failure_hook_name = self.get_failure_hook_name()
         if failure_hook_name:
             logger.info("Running failure hook %s for job", failure_hook_name)
-            failure_hook_function = import_string(failure_hook_name)
-            failure_hook_function(self, exception)
+            failure_hook_function = self.get_job_definition().get_callable(
+                failure_hook_name
+            )
+            call_task_function(failure_hook_function, self, exception)
+
+    async def arun_failure_hook(self, exception):
+        failure_hook_name = self.get_failure_hook_name()
+        if failure_hook_name:
+            logger.info("Running failure hook %s for job", failure_hook_name)
+            failure_hook_function = self.get_job_definition().get_callable(
+                failure_hook_name
+            )
+            await acall_task_function(failure_hook_function, self, exception)
 
     def run_creation_hook(self):
         creation_hook_name = self.get_creation_hook_name()
         if creation_hook_name:
             logger.info("Running creation hook %s for job", creation_hook_name)
-            creation_hook_function = import_string(creation_hook_name)
-            creation_hook_function(self)
+            creation_hook_function = self.get_job_definition().get_callable(
+                creation_hook_name
+            )
+            call_task_function(creation_hook_function, self)
 
     @staticmethod
-    def get_queue_depths(*, exclude_future_jobs=False):
+    def get_queue_depths(*, exclude_future_jobs=False, exact=False):
+        """
+        Return a dict mapping queue names to the number of jobs waiting on
+        them. If queue depth counters are enabled, they are used unless an
+        `exact` count is asked for or future jobs are to be excluded (which
+        the counters know nothing about).
+        """
+        if (
+            not exact
+            and not exclude_future_jobs
+            and QueueDepthCounter.objects.is_enabled()
+        ):
+            return QueueDepthCounter.objects.get_queue_depths()
+
         jobs_waiting_in_queue = Job.objects.filter(
             state__in=(Job.STATES.READY, Job.STATES.NEW)
         )
@@ -192,3 +1294,228 @@ class Job(models.Model):
             annotation_dict["queue_name"]: annotation_dict["queue_name__count"]
             for annotation_dict in annotation_dicts
         }
+
+
+class QueueDepthCounterManager(models.Manager):
+    def is_enabled(self):
+        return getattr(settings, "DBQ_QUEUE_DEPTH_COUNTERS", False)
+
+    def adjust(self, deltas, using=None):
+        """
+        Add the given changes (a dict mapping queue names to the change in
+        the number of waiting jobs) to the counters, if they are enabled.
+        Each change goes to a randomly chosen shard of the queue's counter,
+        so that concurrent workers rarely wait on each other's row locks.
+        """
+        if not self.is_enabled():
+            return
+        counters = self.db_manager(using)
+        for queue_name, delta in deltas.items():
+            if not delta:
+                continue
+            shard = random.randrange(QUEUE_DEPTH_COUNTER_SHARDS)
+            shard_counter = counters.filter(queue_name=queue_name, shard=shard)
+            if not shard_counter.update(count=F("count") + delta):
+                counters.bulk_create(
+                    [QueueDepthCounter(queue_name=queue_name, shard=shard)],
+                    ignore_conflicts=True,
+                )
+                shard_counter.update(count=F("count") + delta)
+
+    def get_queue_depths(self):
+        """Return the counted queue depths, leaving out empty queues in the
+        same way as `Job.get_queue_depths`"""
+        depths = self.values("queue_name").annotate(depth=Sum("count"))
+        return {
+            depth["queue_name"]: depth["depth"]
+            for depth in depths
+            if depth["depth"] > 0
+        }
+
+    def rebuild(self):
+        """
+        Reset the counters to an exact count of the waiting jobs, eg after
+        enabling the counters on an existing table or after jobs were
+        changed with queryset updates (which the counters don't see). Jobs
+        which change state while the counters are rebuilt may be miscounted,
+        so run this when the queues are quiet.
+        """
+        depths = Job.get_queue_depths(exact=True)
+        with transaction.atomic(using=self.db):
+            self.all().delete()
+            self.bulk_create(
+                [
+                    QueueDepthCounter(queue_name=queue_name, shard=0, count=depth)
+                    for queue_name, depth in depths.items()
+                ]
+            )
+        return depths
+
+
+class QueueDepthCounter(models.Model):
+    """
+    One shard of the counter of jobs waiting (in state NEW or READY) on a
+    queue, maintained when DBQ_QUEUE_DEPTH_COUNTERS is enabled. The depth
+    of a queue is the sum of its shards.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    queue_name = models.CharField(max_length=20)
+    shard = models.PositiveSmallIntegerField()
+    count = models.BigIntegerField(default=0)
+
+    objects = QueueDepthCounterManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["queue_name", "shard"],
+                name="django_dbq_queuedepthcounter_unique",
+            ),
+        ]
+
+
+class RateLimitBucketManager(models.Manager):
+    def take(self, requested, rate_limits):
+        """
+        Take tokens from the buckets of the given job names. `requested`
+        maps job names to the number of tokens wanted, and `rate_limits`
+        maps them to their (rate, burst). Must be called inside a
+        transaction, as the bucket rows are locked until it commits.
+
+        Returns a dict mapping each job name to the number of tokens taken
+        and the number of seconds until the next token is available (0 if
+        there are tokens left).
+        """
+        now = timezone.now()
+        buckets = self.select_for_update().in_bulk(list(requested))
+        missing = [name for name in requested if name not in buckets]
+        if missing:
+            self.bulk_create(
+                [
+                    RateLimitBucket(name=name, tokens=rate_limits[name][1], updated=now)
+                    for name in missing
+                ],
+                ignore_conflicts=True,
+            )
+            buckets = self.select_for_update().in_bulk(list(requested))
+
+        taken = {}
+        for name, count in requested.items():
+            rate, burst = rate_limits[name]
+            bucket = buckets[name]
+            elapsed = max((now - bucket.updated).total_seconds(), 0)
+            tokens = min(burst, bucket.tokens + elapsed * rate)
+            granted = min(count, int(tokens))
+            bucket.tokens = tokens - granted
+            bucket.updated = now
+            wait_time = 0 if bucket.tokens >= 1 else (1 - bucket.tokens) / rate
+            taken[name] = (granted, wait_time)
+
+        self.bulk_update(buckets.values(), ["tokens", "updated"])
+        return taken
+
+
+class RateLimitBucket(models.Model):
+    """
+    A token bucket shared by every worker, enforcing a rate limit with
+    "scope": "cluster" for one job name. Tokens are refilled lazily from
+    the time the bucket was last updated whenever they are taken.
+    """
+
+    name = models.CharField(max_length=100, primary_key=True)
+    tokens = models.FloatField()
+    updated = models.DateTimeField()
+
+    objects = RateLimitBucketManager()
+
+
+class JobDependency(models.Model):
+    """
+    Records that `job` is BLOCKED until `depends_on` is COMPLETE. Rows are
+    deleted as soon as `depends_on` finishes, or before it is deleted (see
+    `JobManager.release_dependents_of`), rather than cascading, so there are
+    no foreign key constraints in the database.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    job = models.ForeignKey(
+        Job,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="dependencies",
+    )
+    depends_on = models.ForeignKey(
+        Job,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="dependents",
+    )
+
+
+class ArchivedJobManager(models.Manager):
+    def copy_jobs(self, jobs):
+        """
+        Copy a queryset of jobs into the archive with a single INSERT ...
+        SELECT, stamped with the time they were archived. Returns the
+        number of jobs copied.
+        """
+        field_names = [
+            field.attname
+            for field in self.model._meta.concrete_fields
+            if field.name != "archived"
+        ]
+        select_sql, params = (
+            jobs.order_by()
+            .annotate(
+                archived_at=Value(timezone.now(), output_field=models.DateTimeField())
+            )
+            .values_list(*field_names, "archived_at")
+            .query.get_compiler(using=jobs.db)
+            .as_sql()
+        )
+        connection = connections[jobs.db]
+        columns = [
+            self.model._meta.get_field(name).column
+            for name in field_names + ["archived"]
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO %s (%s) %s"
+                % (
+                    connection.ops.quote_name(self.model._meta.db_table),
+                    ", ".join(connection.ops.quote_name(column) for column in columns),
+                    select_sql,
+                ),
+                params,
+            )
+            return cursor.rowcount
+
+
+class ArchivedJob(models.Model):
+    """
+    A finished job, moved out of the jobs table by `Job.objects.archive_old`
+    so that the jobs table stays small. Its fields are copied unchanged from
+    the job, including a compressed or offloaded workspace.
+    """
+
+    STATES = Job.STATES
+
+    id = UUIDField(primary_key=True, editable=False)
+    created = models.DateTimeField(db_index=True)
+    modified = models.DateTimeField()
+    archived = models.DateTimeField(db_index=True)
+    name = models.CharField(max_length=100, db_index=True)
+    state = models.CharField(max_length=20, choices=Job.STATES.choices)
+    next_task = models.CharField(max_length=100, blank=True)
+    workspace = WorkspaceField(null=True)
+    queue_name = models.CharField(max_length=20, default="default")
+    priority = models.SmallIntegerField(default=0)
+    run_after = models.DateTimeField(null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    dedup_key = models.CharField(max_length=255, null=True, blank=True)
+
+    objects = ArchivedJobManager()
+
+    class Meta:
+        ordering = ["created"]
@@ -0,0 +1,98 @@
+from django.db import DEFAULT_DB_ALIAS, connections
+import logging
+import select
+
+
+logger = logging.getLogger(__name__)
+
+
+CHANNEL_PREFIX = "django_dbq_"
+
+
+def is_supported(connection):
+    """Return True if the given connection can LISTEN for new jobs"""
+    return connection.vendor == "postgresql"
+
+
+def get_channel_name(queue_name):
+    """Return the name of the notification channel for the given queue"""
+    return CHANNEL_PREFIX + queue_name
+
+
+def notify(queue_name, using=DEFAULT_DB_ALIAS):
+    """
+    Tell any workers listening on the given queue that a job has been
+    enqueued. PostgreSQL only delivers the notification when the current
+    transaction commits, and collapses identical notifications sent in the
+    same transaction into one. On other backends this does nothing.
+    """
+    connection = connections[using]
+    if not is_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, '')", [get_channel_name(queue_name)])
+
+
+class Listener:
+    """
+    Wait for jobs to be enqueued on a set of queues using PostgreSQL's
+    LISTEN/NOTIFY. The LISTEN is (re-)issued whenever Django opens a new
+    underlying database connection.
+    """
+
+    def __init__(self, queue_names, using=DEFAULT_DB_ALIAS):
+        self.queue_names = list(queue_names)
+        self.using = using
+        self.listening_on = None
+        self.notified = False
+
+    def listen(self):
+        connection = connections[self.using]
+        connection.ensure_connection()
+        if connection.connection is self.listening_on:
+            return connection.connection
+
+        with connection.cursor() as cursor:
+            for queue_name in self.queue_names:
+                cursor.execute(
+                    "LISTEN %s"
+                    % connection.ops.quote_name(get_channel_name(queue_name))
+                )
+        self.listening_on = connection.connection
+        if hasattr(self.listening_on, "add_notify_handler"):
+            # psycopg 3 hands notifications which arrive during other queries
+            # to handlers rather than buffering them.
+            self.listening_on.add_notify_handler(self.handle_notify)
+        logger.info("Listening for new jobs on queues %s", ", ".join(self.queue_names))
+        return self.listening_on
+
+    def handle_notify(self, notification):
+        self.notified = True
+
+    def wait(self, timeout):
+        """
+        Block until a job is enqueued on one of the queues, or until `timeout`
+        seconds have passed. Returns True if a notification was received.
+        """
+        from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+        raw_connection = self.listen()
+
+        if is_psycopg3:
+            if not self.notified:
+                for _ in raw_connection.notifies(timeout=timeout, stop_after=1):
+                    self.notified = True
+            received = self.notified
+            self.notified = False
+            return received
+
+        # psycopg2 buffers notifications which arrive during other queries,
+        # so check for those before waiting on the socket.
+        if not raw_connection.notifies:
+            readable, _, _ = select.select([raw_connection], [], [], timeout)
+            if not readable:
+                return False
+            raw_connection.poll()
+        received = bool(raw_connection.notifies)
+        raw_connection.notifies.clear()
+        return received
@@ -0,0 +1,63 @@
+from time import monotonic
+
+
+RATE_UNITS = {
+    "s": 1,
+    "m": 60,
+    "h": 60 * 60,
+}
+
+
+def parse_rate(rate):
+    """
+    Parse a rate given as a number of jobs per second (eg 0.5) or as a
+    string like "50/s", "3/m" or "100/h" into a number of jobs per second.
+    Raises ValueError if the rate is invalid or not positive.
+    """
+    if isinstance(rate, str):
+        count, _, unit = rate.partition("/")
+        try:
+            per_second = float(count) / RATE_UNITS[unit or "s"]
+        except (KeyError, ValueError):
+            raise ValueError('Invalid rate "%s", expected eg "50/s" or "3/m"' % rate)
+    else:
+        per_second = float(rate)
+    if per_second <= 0:
+        raise ValueError('Rate "%s" must be greater than 0' % rate)
+    return per_second
+
+
+class TokenBucket:
+    """
+    A token bucket which refills at `rate` tokens per second, up to `burst`
+    tokens. It starts full, so up to `burst` jobs can be started at once,
+    after which jobs are started at `rate` per second.
+
+    Not thread-safe: each worker only uses its buckets from the thread which
+    claims jobs.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+
+    def refill(self):
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Return the number of seconds until a token is available"""
+        self.refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def try_acquire(self):
+        """Take a token if one is available, returning True if it was taken"""
+        if self.wait_time() > 0:
+            return False
+        self.tokens -= 1
+        return True
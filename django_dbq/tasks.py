@@ -1,4 +1,12 @@
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from django_dbq.ratelimit import parse_rate
+from types import MappingProxyType
+import functools
+import random
 
 
 TASK_LIST_KEY = "tasks"
@@ -6,41 +14,295 @@ PRE_TASK_HOOK_KEY = "pre_task_hook"
 POST_TASK_HOOK_KEY = "post_task_hook"
 FAILURE_HOOK_KEY = "failure_hook"
 CREATION_HOOK_KEY = "creation_hook"
+RATE_LIMIT_KEY = "rate_limit"
+RUN_TO_COMPLETION_KEY = "run_to_completion"
+RETRY_KEY = "retry"
 
+RATE_LIMIT_SCOPE_WORKER = "worker"
+RATE_LIMIT_SCOPE_CLUSTER = "cluster"
+RATE_LIMIT_SCOPES = (RATE_LIMIT_SCOPE_WORKER, RATE_LIMIT_SCOPE_CLUSTER)
 
-def get_next_task_name(job_name, current_task=None):
-    """Given a job name and (optionally) a task name, return the
-    next task in the list. If the current_task is None, return the
-    first task. If current_task is the last task in the list, return None"""
+DEFAULT_RETRY_BACKOFF_IN_SECONDS = 5
+DEFAULT_RETRY_MAX_BACKOFF_IN_SECONDS = 60 * 60
+DEFAULT_RETRY_JITTER = 0.5
+
+HOOK_KEYS = (
+    PRE_TASK_HOOK_KEY,
+    POST_TASK_HOOK_KEY,
+    FAILURE_HOOK_KEY,
+    CREATION_HOOK_KEY,
+)
+
+
+class RetryPolicy:
+    """
+    How the failed tasks of a job are retried: up to `max_attempts`
+    attempts in all, `backoff` seconds after the first failure, doubling
+    after each failure up to `max_backoff` seconds. Each delay is cut by a
+    random fraction of up to `jitter`, so that jobs which failed together
+    don't all retry together. Only instances of the `exceptions` (given as
+    import paths, default any Exception) are retried.
+    """
+
+    def __init__(
+        self,
+        max_attempts,
+        backoff=DEFAULT_RETRY_BACKOFF_IN_SECONDS,
+        max_backoff=DEFAULT_RETRY_MAX_BACKOFF_IN_SECONDS,
+        jitter=DEFAULT_RETRY_JITTER,
+        exceptions=(),
+    ):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.exception_paths = tuple(exceptions)
+        self._exceptions = None
+
+    def get_exceptions(self):
+        """Import the exceptions to retry, raising ImproperlyConfigured if
+        any of them can't be imported or isn't an exception class"""
+        if self._exceptions is None:
+            exceptions = []
+            for path in self.exception_paths:
+                try:
+                    exception_class = import_string(path)
+                except ImportError as exception:
+                    raise ImproperlyConfigured(
+                        'Retry exception "%s" could not be imported: %s'
+                        % (path, exception)
+                    )
+                if not (
+                    isinstance(exception_class, type)
+                    and issubclass(exception_class, BaseException)
+                ):
+                    raise ImproperlyConfigured(
+                        'Retry exception "%s" is not an exception class' % path
+                    )
+                exceptions.append(exception_class)
+            self._exceptions = tuple(exceptions) or (Exception,)
+        return self._exceptions
+
+    def should_retry(self, exception, attempts):
+        """Return True if a task which has failed `attempts` times, most
+        recently with `exception`, should be attempted again"""
+        return attempts < self.max_attempts and isinstance(
+            exception, self.get_exceptions()
+        )
+
+    def get_delay(self, attempts):
+        """Return the number of seconds to wait before retrying a task which
+        has failed `attempts` times"""
+        delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+        return delay * (1 - self.jitter * random.random())
+
+
+class JobDefinition:
+    """
+    The configuration of a single job in settings.JOBS.
+
+    Task and hook callables are imported the first time they are needed and
+    cached for the life of the process. Call `load` to import them all up
+    front, which also checks that every one of them exists.
+    """
+
+    def __init__(self, name, config):
+        tasks = config.get(TASK_LIST_KEY) if isinstance(config, dict) else None
+        if not tasks or isinstance(tasks, str):
+            raise ImproperlyConfigured(
+                'JOBS["%s"] must be a dict with a non-empty "%s" list'
+                % (name, TASK_LIST_KEY)
+            )
+
+        self.name = name
+        self.config = MappingProxyType(dict(config))
+        self.tasks = tuple(tasks)
+        self.next_tasks = MappingProxyType(dict(zip(self.tasks, self.tasks[1:])))
+        self.hooks = MappingProxyType({key: config.get(key) for key in HOOK_KEYS})
+        self.rate_limit, self.rate_limit_scope = self.parse_rate_limit(
+            config.get(RATE_LIMIT_KEY)
+        )
+        self.run_to_completion = bool(config.get(RUN_TO_COMPLETION_KEY, False))
+        self.retry_policy = self.parse_retry(config.get(RETRY_KEY))
+        self._callables = {}
+
+    def parse_rate_limit(self, rate_limit):
+        """
+        Parse the "rate_limit" of the job, given either as a rate (eg "5/s")
+        or as a dict with a "rate" and optional "burst" and "scope". Returns
+        a (rate per second, burst) tuple and the scope, or (None, None) if
+        the job isn't rate limited.
+        """
+        if rate_limit is None:
+            return None, None
+        if not isinstance(rate_limit, dict):
+            rate_limit = {"rate": rate_limit}
+        try:
+            rate = parse_rate(rate_limit["rate"])
+            burst = int(rate_limit.get("burst", 1))
+        except (KeyError, TypeError, ValueError) as exception:
+            raise ImproperlyConfigured(
+                'JOBS["%s"]["%s"] is invalid: %s'
+                % (self.name, RATE_LIMIT_KEY, exception)
+            )
+        if burst < 1:
+            raise ImproperlyConfigured(
+                'JOBS["%s"]["%s"]["burst"] must be at least 1'
+                % (self.name, RATE_LIMIT_KEY)
+            )
+        scope = rate_limit.get("scope", RATE_LIMIT_SCOPE_WORKER)
+        if scope not in RATE_LIMIT_SCOPES:
+            raise ImproperlyConfigured(
+                'JOBS["%s"]["%s"]["scope"] must be one of %s'
+                % (self.name, RATE_LIMIT_KEY, ", ".join(RATE_LIMIT_SCOPES))
+            )
+        return (rate, burst), scope
 
-    task_list = settings.JOBS[job_name][TASK_LIST_KEY]
+    def parse_retry(self, retry):
+        """
+        Parse the "retry" policy of the job, given either as a maximum number
+        of attempts or as a dict with "max_attempts" and optional "backoff",
+        "max_backoff", "jitter" and "exceptions". Returns a RetryPolicy, or
+        None if failed tasks aren't retried.
+        """
+        if retry is None:
+            return None
+        if not isinstance(retry, dict):
+            retry = {"max_attempts": retry}
+        exceptions = retry.get("exceptions", ())
+        if isinstance(exceptions, str):
+            exceptions = (exceptions,)
+        try:
+            retry_policy = RetryPolicy(
+                int(retry["max_attempts"]),
+                backoff=float(retry.get("backoff", DEFAULT_RETRY_BACKOFF_IN_SECONDS)),
+                max_backoff=float(
+                    retry.get("max_backoff", DEFAULT_RETRY_MAX_BACKOFF_IN_SECONDS)
+                ),
+                jitter=float(retry.get("jitter", DEFAULT_RETRY_JITTER)),
+                exceptions=exceptions,
+            )
+        except (KeyError, TypeError, ValueError) as exception:
+            raise ImproperlyConfigured(
+                'JOBS["%s"]["%s"] is invalid: %s' % (self.name, RETRY_KEY, exception)
+            )
+        if retry_policy.max_attempts < 1:
+            raise ImproperlyConfigured(
+                'JOBS["%s"]["%s"]["max_attempts"] must be at least 1'
+                % (self.name, RETRY_KEY)
+            )
+        if retry_policy.backoff < 0 or retry_policy.max_backoff < 0:
+            raise ImproperlyConfigured(
+                'JOBS["%s"]["%s"] backoffs must not be negative'
+                % (self.name, RETRY_KEY)
+            )
+        if not 0 <= retry_policy.jitter <= 1:
+            raise ImproperlyConfigured(
+                'JOBS["%s"]["%s"]["jitter"] must be between 0 and 1'
+                % (self.name, RETRY_KEY)
+            )
+        return retry_policy
 
-    if current_task is None:
-        return task_list[0]
+    def get_next_task_name(self, current_task=None):
+        """Given (optionally) a task name, return the next task in the list.
+        If the current_task is None, return the first task. If current_task
+        is the last task in the list, return None"""
+        if current_task is None:
+            return self.tasks[0]
+        if current_task not in self.tasks:
+            raise ValueError(
+                '"%s" is not a task of job "%s"' % (current_task, self.name)
+            )
+        return self.next_tasks.get(current_task)
 
-    next_task_index = task_list.index(current_task) + 1
+    def get_hook_name(self, key):
+        """Return the name of the given hook (as a string) or None"""
+        return self.hooks[key]
 
-    try:
-        return task_list[next_task_index]
-    except IndexError:
-        return None
+    def get_callable(self, path):
+        try:
+            return self._callables[path]
+        except KeyError:
+            function = self._callables[path] = import_string(path)
+            return function
+
+    def get_task_function(self, task_name):
+        return self.get_callable(task_name)
+
+    def load(self):
+        """
+        Import every task, hook and retried exception of this job, raising
+        ImproperlyConfigured if any of them can't be imported or isn't
+        callable.
+        """
+        hook_names = [name for name in self.hooks.values() if name]
+        for path in self.tasks + tuple(hook_names):
+            try:
+                function = self.get_callable(path)
+            except ImportError as exception:
+                raise ImproperlyConfigured(
+                    'Job "%s" refers to "%s", which could not be imported: %s'
+                    % (self.name, path, exception)
+                )
+            if not callable(function):
+                raise ImproperlyConfigured(
+                    'Job "%s" refers to "%s", which is not callable' % (self.name, path)
+                )
+        if self.retry_policy:
+            self.retry_policy.get_exceptions()
+
+
+@functools.lru_cache(maxsize=None)
+def get_job_registry():
+    """Return a read-only mapping of job name to JobDefinition, built from
+    settings.JOBS the first time it is called"""
+    return MappingProxyType(
+        {name: JobDefinition(name, config) for name, config in settings.JOBS.items()}
+    )
+
+
+@receiver(setting_changed)
+def clear_job_registry(setting, **kwargs):
+    if setting == "JOBS":
+        get_job_registry.cache_clear()
+
+
+def load_job_registry():
+    """Build the registry and import every task and hook in it, so that a
+    misconfigured job fails straight away rather than when it is first run"""
+    registry = get_job_registry()
+    for job_definition in registry.values():
+        job_definition.load()
+    return registry
+
+
+def get_job_definition(job_name):
+    """Return the JobDefinition for the given job name"""
+    return get_job_registry()[job_name]
+
+
+def get_next_task_name(job_name, current_task=None):
+    """Given a job name and (optionally) a task name, return the
+    next task in the list. If the current_task is None, return the
+    first task. If current_task is the last task in the list, return None"""
+    return get_job_definition(job_name).get_next_task_name(current_task)
 
 
 def get_pre_task_hook_name(job_name):
     """Return the name of the pre task hook for the given job (as a string) or None"""
-    return settings.JOBS[job_name].get(PRE_TASK_HOOK_KEY)
+    return get_job_definition(job_name).get_hook_name(PRE_TASK_HOOK_KEY)
 
 
 def get_post_task_hook_name(job_name):
     """Return the name of the post_task hook for the given job (as a string) or None"""
-    return settings.JOBS[job_name].get(POST_TASK_HOOK_KEY)
+    return get_job_definition(job_name).get_hook_name(POST_TASK_HOOK_KEY)
 
 
 def get_failure_hook_name(job_name):
     """Return the name of the failure hook for the given job (as a string) or None"""
-    return settings.JOBS[job_name].get(FAILURE_HOOK_KEY)
+    return get_job_definition(job_name).get_hook_name(FAILURE_HOOK_KEY)
 
 
 def get_creation_hook_name(job_name):
     """Return the name of the creation hook for the given job (as a string) or None"""
-    return settings.JOBS[job_name].get(CREATION_HOOK_KEY)
+    return get_job_definition(job_name).get_hook_name(CREATION_HOOK_KEY)
@@ -1,16 +1,47 @@
+from asgiref.sync import async_to_sync
 from datetime import datetime, timedelta, timezone as datetime_timezone
-from unittest import mock
+from functools import partial
+from unittest import mock, skipUnless
+import asyncio
+import os
+import signal
+import tempfile
+import threading
+import uuid
 
 import freezegun
+from django.core.exceptions import ImproperlyConfigured
 from django.core.management import call_command
-from django.test import TestCase
-from django.test.utils import override_settings
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.db.models.signals import pre_delete
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils import timezone
 
-from django_dbq.management.commands.worker import Worker
-from django_dbq.models import Job
+from django_dbq.benchmarks import BENCHMARK_QUEUE_NAME, parse_mix
+from django_dbq.management.commands.worker import AsyncWorker, Supervisor, Worker
+from django_dbq.metrics import Metrics, PrometheusMetrics, StatsdMetrics, get_metrics
+from django_dbq.models import (
+    ArchivedJob,
+    Job,
+    JobDependency,
+    QueueDepthCounter,
+    RateLimitBucket,
+)
+from django_dbq.notifications import Listener, notify
+from django_dbq.ratelimit import TokenBucket, parse_rate
+from django_dbq.tasks import RetryPolicy, get_job_definition, get_next_task_name
+from django_dbq.workspace import StoredWorkspace
 
 from io import StringIO
+import socket
+import urllib.request
 
 
 def test_task(job=None):
@@ -26,6 +57,60 @@ def failing_task(job):
     raise Exception("uh oh")
 
 
+def appending_task(job):
+    job.workspace.setdefault("ran", []).append(job.next_task)
+
+
+appending_task_2 = appending_task
+
+appending_task_3 = appending_task
+
+
+def interrupting_task(job):
+    raise KeyboardInterrupt
+
+
+def reading_task(job):
+    job.workspace["input"]
+
+
+def reclaimed_task(job):
+    Job.objects.filter(pk=job.pk).update(state=Job.STATES.READY)
+
+
+concurrency_barrier = threading.Barrier(3, timeout=10)
+
+
+def barrier_task(job):
+    concurrency_barrier.wait()
+
+
+plain_concurrency_barrier = threading.Barrier(2, timeout=5)
+
+
+def plain_barrier_task(job):
+    plain_concurrency_barrier.wait()
+
+
+async_tasks_in_flight = []
+
+
+async def async_task(job):
+    async_tasks_in_flight.append(job.pk)
+    job.workspace["max_in_flight"] = len(async_tasks_in_flight)
+    await asyncio.sleep(0.05)
+    async_tasks_in_flight.remove(job.pk)
+    job.workspace["output"] = "async task ran"
+
+
+async def async_failing_task(job):
+    raise Exception("uh oh")
+
+
+async def async_failure_hook(job, exception):
+    failure_hook(job, exception)
+
+
 def pre_task_hook(job):
     job.workspace["output"] = "pre task hook ran"
     job.workspace["job_id"] = str(job.id)
@@ -47,7 +132,13 @@ def creation_hook(job):
     job.workspace["job_id"] = str(job.id)
 
 
-@override_settings(JOBS={"testjob": {"tasks": ["a"]}})
+def failing_creation_hook(job):
+    if job.workspace.get("fail"):
+        raise Exception("uh oh")
+    creation_hook(job)
+
+
+@override_settings(JOBS={"testjob": {"tasks": ["django_dbq.tests.test_task"]}})
 class WorkerManagementCommandTestCase(TestCase):
     def test_worker_no_args(self):
         stdout = StringIO()
@@ -62,6 +153,41 @@ class WorkerManagementCommandTestCase(TestCase):
         output = stdout.getvalue()
         self.assertTrue("test_queue" in output)
 
+    def test_worker_with_weighted_queues(self):
+        stdout = StringIO()
+        call_command(
+            "worker", "high:5", "default:2", "low", dry_run=True, stdout=stdout
+        )
+        output = stdout.getvalue()
+        self.assertTrue("high:5 default:2 low" in output)
+
+    def test_worker_rejects_invalid_queue_weight(self):
+        for spec in ["high:0", "high:lots", ":2"]:
+            with self.subTest(spec=spec):
+                with self.assertRaises(CommandError):
+                    call_command("worker", spec, dry_run=True, stdout=StringIO())
+
+    def test_worker_rejects_repeated_queue(self):
+        with self.assertRaises(CommandError):
+            call_command("worker", "high", "high:2", dry_run=True, stdout=StringIO())
+
+    @override_settings(JOBS={"testjob": {"tasks": ["django_dbq.tests.missing"]}})
+    def test_worker_fails_fast_on_misconfigured_job(self):
+        with self.assertRaisesMessage(CommandError, "django_dbq.tests.missing"):
+            call_command("worker", dry_run=True, stdout=StringIO())
+
+    @override_settings(
+        JOBS={
+            "testjob": {
+                "tasks": ["django_dbq.tests.test_task"],
+                "failure_hook": "django_dbq.tests.concurrency_barrier",
+            }
+        }
+    )
+    def test_worker_fails_fast_on_hook_which_is_not_callable(self):
+        with self.assertRaisesMessage(CommandError, "not callable"):
+            call_command("worker", dry_run=True, stdout=StringIO())
+
 
 @freezegun.freeze_time("2025-01-01T12:00:00Z")
 @override_settings(JOBS={"testjob": {"tasks": ["a"]}})
@@ -183,6 +309,112 @@ class QueueDepthTestCase(TestCase):
         self.assertEqual(output.strip(), "event=queue_depths otherqueue=0")
 
 
+@override_settings(
+    JOBS={
+        "testjob": {"tasks": ["django_dbq.tests.test_task"]},
+        "twostepjob": {
+            "tasks": ["django_dbq.tests.test_task", "django_dbq.tests.test_task"]
+        },
+    },
+    DBQ_QUEUE_DEPTH_COUNTERS=True,
+)
+class QueueDepthCounterTestCase(TestCase):
+    def assertDepths(self, expected):
+        self.assertEqual(Job.get_queue_depths(), expected)
+        self.assertEqual(Job.get_queue_depths(exact=True), expected)
+
+    def test_counters_follow_jobs_through_the_worker(self):
+        Job.objects.create(name="testjob")
+        Job.objects.create(name="twostepjob", queue_name="other")
+        Job.objects.bulk_enqueue([Job(name="testjob") for _ in range(2)])
+        Job.objects.create(name="testjob", state=Job.STATES.COMPLETE)
+        self.assertDepths({"default": 3, "other": 1})
+
+        Worker("default", 0)._process_job()
+        self.assertDepths({"default": 2, "other": 1})
+
+        worker = Worker("other", 0)
+        job = worker.claim_job()
+        self.assertDepths({"default": 2})
+        worker.run_job(job)
+        self.assertDepths({"default": 2, "other": 1})
+
+        Job.objects.release(Job.objects.claim("default", count=2))
+        self.assertDepths({"default": 2, "other": 1})
+
+        Job.objects.filter(
+            queue_name="default", state=Job.STATES.READY
+        ).first().delete()
+        self.assertDepths({"default": 1, "other": 1})
+
+    def test_counters_follow_reclaimed_jobs(self):
+        Job.objects.create(name="testjob")
+        Job.objects.create(name="testjob", queue_name="other")
+        Job.objects.claim(["default", "other"], count=2, lease_in_seconds=-1)
+        self.assertDepths({})
+
+        self.assertEqual(Job.objects.reclaim_expired(), 2)
+        self.assertDepths({"default": 1, "other": 1})
+
+    def test_counters_are_read_without_touching_jobs(self):
+        Job.objects.create(name="testjob")
+
+        with CaptureQueriesContext(connection) as context:
+            Job.get_queue_depths()
+
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertNotIn(Job._meta.db_table, context.captured_queries[0]["sql"])
+
+    def test_counters_are_sharded(self):
+        for _ in range(100):
+            Job.objects.create(name="testjob")
+
+        self.assertLessEqual(QueueDepthCounter.objects.count(), 16)
+        self.assertGreater(QueueDepthCounter.objects.count(), 1)
+        self.assertDepths({"default": 100})
+
+    def test_counters_follow_jobs_saved_without_their_state(self):
+        for _ in range(3):
+            Job.objects.create(name="testjob")
+        self.assertDepths({"default": 3})
+
+        job = Job.objects.only("pk", "name").first()
+        job.state = Job.STATES.COMPLETE
+        job.save()
+        self.assertDepths({"default": 2})
+
+        Job.objects.filter(state=Job.STATES.NEW).only("pk", "name").first().delete()
+        self.assertDepths({"default": 1})
+
+    def test_rebuild_resets_counters(self):
+        Job.objects.create(name="testjob")
+        Job.objects.create(name="testjob")
+        Job.objects.update(state=Job.STATES.COMPLETE)
+        self.assertEqual(Job.get_queue_depths(), {"default": 2})
+
+        stdout = StringIO()
+        call_command("queue_depth", rebuild=True, stdout=stdout)
+
+        self.assertEqual(stdout.getvalue().strip(), "event=queue_depths default=0")
+        self.assertDepths({})
+
+    def test_queue_depth_command_exact(self):
+        Job.objects.create(name="testjob")
+        QueueDepthCounter.objects.update(count=5)
+
+        stdout = StringIO()
+        call_command("queue_depth", exact=True, stdout=stdout)
+
+        self.assertEqual(stdout.getvalue().strip(), "event=queue_depths default=1")
+
+    @override_settings(DBQ_QUEUE_DEPTH_COUNTERS=False)
+    def test_counters_are_not_kept_when_disabled(self):
+        Job.objects.create(name="testjob")
+        Job.objects.claim("default")
+
+        self.assertFalse(QueueDepthCounter.objects.exists())
+
+
 @freezegun.freeze_time()
 @mock.patch("django_dbq.management.commands.worker.sleep")
 class WorkerProcessProcessJobTestCase(TestCase):
@@ -192,19 +424,27 @@ class WorkerProcessProcessJobTestCase(TestCase):
         self.mock_worker.queue_name = "default"
         self.mock_worker.rate_limit_in_seconds = 5
         self.mock_worker.last_job_finished = None
+        self.mock_worker.max_idle_sleep_in_seconds = 1
+        self.mock_worker.idle_sleep_in_seconds = 0
+        self.mock_worker.jobs_processed = 0
+        self.mock_worker.idle_polls = 0
+        self.mock_worker.listener = None
+        self.mock_worker.rate_limiter = None
+        self.mock_worker.throttled_for = None
 
     def test_process_job_no_previous_job_run(self, mock_sleep):
         Worker.process_job(self.mock_worker)
-        self.assertEqual(mock_sleep.call_count, 1)
+        self.assertEqual(mock_sleep.call_count, 0)
         self.assertEqual(self.mock_worker._process_job.call_count, 1)
         self.assertEqual(self.mock_worker.last_job_finished, timezone.now())
+        self.assertEqual(self.mock_worker.jobs_processed, 1)
 
     def test_process_job_previous_job_too_soon(self, mock_sleep):
         self.mock_worker.last_job_finished = timezone.now() - timezone.timedelta(
             seconds=2
         )
         Worker.process_job(self.mock_worker)
-        self.assertEqual(mock_sleep.call_count, 1)
+        mock_sleep.assert_called_once_with(3)
         self.assertEqual(self.mock_worker._process_job.call_count, 0)
         self.assertEqual(
             self.mock_worker.last_job_finished,
@@ -216,22 +456,125 @@ class WorkerProcessProcessJobTestCase(TestCase):
             seconds=7
         )
         Worker.process_job(self.mock_worker)
-        self.assertEqual(mock_sleep.call_count, 1)
+        self.assertEqual(mock_sleep.call_count, 0)
         self.assertEqual(self.mock_worker._process_job.call_count, 1)
         self.assertEqual(self.mock_worker.last_job_finished, timezone.now())
 
+    def test_process_job_backs_off_while_queue_is_empty(self, mock_sleep):
+        self.mock_worker._process_job.return_value = False
+        for _ in range(7):
+            Worker.process_job(self.mock_worker)
+        self.assertEqual(
+            [call.args[0] for call in mock_sleep.call_args_list],
+            [0.05, 0.1, 0.2, 0.4, 0.8, 1, 1],
+        )
+        self.assertEqual(self.mock_worker.idle_polls, 7)
+        self.assertIsNone(self.mock_worker.last_job_finished)
+
+    def test_process_job_waits_for_notification_when_listening(self, mock_sleep):
+        self.mock_worker._process_job.return_value = False
+        self.mock_worker.listener = mock.MagicMock()
+        self.mock_worker.safety_poll_in_seconds = 5
+        Worker.process_job(self.mock_worker)
+        self.assertEqual(mock_sleep.call_count, 0)
+        self.mock_worker.listener.wait.assert_called_once_with(5)
+
+    def test_process_job_waits_for_rate_limiter(self, mock_sleep):
+        self.mock_worker.rate_limit_in_seconds = 0
+        self.mock_worker.rate_limiter = mock.MagicMock(
+            **{"wait_time.return_value": 0.02}
+        )
+        Worker.process_job(self.mock_worker)
+        mock_sleep.assert_called_once_with(0.02)
+        self.assertEqual(self.mock_worker._process_job.call_count, 0)
+
+    def test_process_job_resets_back_off_when_a_job_is_found(self, mock_sleep):
+        self.mock_worker.rate_limit_in_seconds = 0
+        self.mock_worker._process_job.side_effect = [False, False, True, False]
+        for _ in range(4):
+            Worker.process_job(self.mock_worker)
+        self.assertEqual(
+            [call.args[0] for call in mock_sleep.call_args_list], [0.05, 0.1, 0.05]
+        )
+
+
+@override_settings(JOBS={"testjob": {"tasks": ["django_dbq.tests.test_task"]}})
+class WorkerStatsTestCase(TestCase):
+    @mock.patch("django_dbq.management.commands.worker.logger")
+    def test_report_stats_logs_throughput_and_idle_polls(self, mock_logger):
+        Job.objects.create(name="testjob")
+        with freezegun.freeze_time() as frozen_time:
+            worker = Worker("default", 0)
+            with mock.patch("django_dbq.management.commands.worker.sleep"):
+                worker.process_job()
+                worker.process_job()
+            frozen_time.tick(10)
+            worker.report_stats()
+
+        args = mock_logger.info.call_args.args
+        self.assertTrue(args[0].startswith("Worker stats"))
+        self.assertEqual(args[1:], ("default", 10, 1, 0.1, 1, 0.1))
+        self.assertEqual(worker.jobs_processed, 0)
+        self.assertEqual(worker.idle_polls, 0)
+
+
+@override_settings(JOBS={"testjob": {"tasks": ["a"]}})
+class NotificationTestCase(TransactionTestCase):
+    def tearDown(self):
+        connection.close()
+        super().tearDown()
+
+    @skipUnless(connection.vendor == "postgresql", "Requires PostgreSQL")
+    def test_listener_is_woken_by_new_job(self):
+        listener = Listener(["default"])
+        self.assertFalse(listener.wait(0))
+
+        Job.objects.create(name="testjob", queue_name="other")
+        self.assertFalse(listener.wait(0.1))
+
+        Job.objects.create(name="testjob")
+        self.assertTrue(listener.wait(5))
+        self.assertFalse(listener.wait(0))
+
+    def test_worker_only_listens_where_supported(self):
+        self.assertEqual(
+            Worker("default", 1).listener is not None,
+            connection.vendor == "postgresql",
+        )
+        self.assertIsNone(Worker("default", 1, listen=False).listener)
+
+    def test_notify_does_nothing_on_other_backends(self):
+        if connection.vendor == "postgresql":
+            self.skipTest("Notifications are supported on PostgreSQL")
+        with self.assertNumQueries(0):
+            notify("default")
+
 
 @override_settings(JOBS={"testjob": {"tasks": ["a"]}})
 class ShutdownTestCase(TestCase):
     def test_shutdown_sets_state_to_stopping(self):
-        job = Job.objects.create(name="testjob")
+        Job.objects.create(name="testjob")
         worker = Worker("default", 1)
-        worker.current_job = job
+        [job] = Job.objects.claim("default")
+        worker.current_jobs.add(job)
 
         worker.shutdown(None, None)
 
         job.refresh_from_db()
         self.assertEqual(job.state, Job.STATES.STOPPING)
+        self.assertFalse(worker.alive)
+
+    def test_shutdown_sets_all_in_flight_jobs_to_stopping(self):
+        for _ in range(3):
+            Job.objects.create(name="testjob")
+        worker = Worker("default", 1, concurrency=3)
+        jobs = Job.objects.claim("default", count=2)
+        worker.current_jobs.update(jobs)
+
+        worker.shutdown(None, None)
+
+        self.assertEqual(Job.objects.filter(state=Job.STATES.STOPPING).count(), 2)
+        self.assertEqual(Job.objects.filter(state=Job.STATES.NEW).count(), 1)
 
 
 @override_settings(JOBS={"testjob": {"tasks": ["a"]}})
@@ -326,6 +669,555 @@ class JobTestCase(TestCase):
 
         self.assertEqual(Job.objects.get_ready_or_none("default"), expected)
 
+    def test_to_process_can_be_joined_to_other_jobs(self):
+        dependency = Job.objects.create(name="testjob")
+        dependent = Job.objects.enqueue(Job(name="testjob"), depends_on=[dependency])
+        Job.objects.filter(pk=dependent.pk).update(state=Job.STATES.READY)
+
+        self.assertEqual(
+            list(
+                Job.objects.to_process("default").filter(
+                    dependencies__depends_on__state=Job.STATES.NEW
+                )
+            ),
+            [dependent],
+        )
+
+    def test_to_process_skips_locked_rows_where_supported(self):
+        self.assertEqual(
+            Job.objects.to_process("default").query.select_for_update_skip_locked,
+            connection.features.has_select_for_update_skip_locked,
+        )
+
+
+@override_settings(JOBS={"testjob": {"tasks": ["a"]}})
+class ClaimIndexTestCase(TestCase):
+    def create_jobs(self, count, **kwargs):
+        Job.objects.bulk_create(
+            [Job(name="testjob", next_task="a", **kwargs) for _ in range(count)]
+        )
+
+    def assertClaimUsesIndex(self):
+        plan = Job.objects.to_process("default")[:1].explain()
+        self.assertIn("django_dbq_job_claim_idx", plan)
+        self.assertNotIn("TEMP B-TREE", plan)  # SQLite sorting the rows
+        self.assertNotRegex(plan, r"\bSort\b")  # PostgreSQL sorting the rows
+
+    @skipUnlessDBFeature("supports_partial_indexes")
+    def test_claim_query_uses_claim_index_as_table_grows(self):
+        self.create_jobs(10, state=Job.STATES.READY)
+        self.create_jobs(10, state=Job.STATES.READY, queue_name="other")
+
+        for history_size in (100, 1000, 5000):
+            self.create_jobs(
+                history_size - Job.objects.filter(state=Job.STATES.COMPLETE).count(),
+                state=Job.STATES.COMPLETE,
+            )
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+            self.assertClaimUsesIndex()
+
+
+@override_settings(JOBS={"testjob": {"tasks": ["a"]}})
+class ClaimContentionTestCase(TransactionTestCase):
+    @skipUnlessDBFeature("has_select_for_update_skip_locked")
+    def test_concurrent_claimers_get_different_jobs(self):
+        """
+        Each claimer holds its row lock until all of them have claimed a job.
+        Without SKIP LOCKED the claimers would block on the same row and the
+        barrier would time out.
+        """
+        claimer_count = 5
+        for _ in range(claimer_count):
+            Job.objects.create(name="testjob")
+
+        barrier = threading.Barrier(claimer_count, timeout=10)
+        claimed = []
+        errors = []
+
+        def claim():
+            try:
+                with transaction.atomic():
+                    job = Job.objects.get_ready_or_none("default")
+                    claimed.append(job.pk)
+                    barrier.wait()
+            except Exception as exception:  # pragma: no cover
+                errors.append(exception)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=claim) for _ in range(claimer_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(claimed)), claimer_count)
+
+
+@override_settings(JOBS={"testjob": {"tasks": ["a"]}})
+class ClaimJobsTestCase(TestCase):
+    def test_claim_moves_jobs_to_processing(self):
+        job_1 = Job.objects.create(name="testjob", priority=1)
+        job_2 = Job.objects.create(name="testjob", state=Job.STATES.READY)
+        job_3 = Job.objects.create(name="testjob")
+        Job.objects.create(name="testjob", queue_name="lol")
+
+        claimed = Job.objects.claim("default", count=2)
+
+        self.assertEqual(claimed, [job_1, job_2])
+        self.assertTrue(all(job.state == Job.STATES.PROCESSING for job in claimed))
+        self.assertEqual(
+            set(
+                Job.objects.filter(state=Job.STATES.PROCESSING).values_list(
+                    "pk", flat=True
+                )
+            ),
+            {job_1.pk, job_2.pk},
+        )
+        self.assertEqual(Job.objects.claim("default", count=2), [job_3])
+        self.assertEqual(Job.objects.claim("default", count=2), [])
+
+    def test_claim_uses_a_single_update(self):
+        for _ in range(3):
+            Job.objects.create(name="testjob")
+
+        with CaptureQueriesContext(connection) as context:
+            Job.objects.claim("default", count=3)
+
+        updates = [
+            query for query in context.captured_queries if "UPDATE" in query["sql"]
+        ]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Job.objects.filter(state=Job.STATES.PROCESSING).count(), 3)
+
+    def test_release_returns_processing_jobs_to_ready(self):
+        job_1 = Job.objects.create(name="testjob")
+        job_2 = Job.objects.create(name="testjob")
+        claimed = Job.objects.claim("default", count=2)
+        Job.objects.filter(pk=job_2.pk).update(state=Job.STATES.COMPLETE)
+
+        self.assertEqual(Job.objects.release(claimed), 1)
+
+        job_1.refresh_from_db()
+        job_2.refresh_from_db()
+        self.assertEqual(job_1.state, Job.STATES.READY)
+        self.assertEqual(job_2.state, Job.STATES.COMPLETE)
+
+
+@override_settings(JOBS={"testjob": {"tasks": ["django_dbq.tests.test_task"]}})
+class PrefetchTestCase(TestCase):
+    def test_worker_processes_prefetched_jobs_from_buffer(self):
+        for _ in range(3):
+            Job.objects.create(name="testjob")
+        worker = Worker("default", 1, prefetch=2)
+
+        worker._process_job()
+
+        self.assertEqual(len(worker.prefetched_jobs), 1)
+        self.assertEqual(Job.objects.filter(state=Job.STATES.COMPLETE).count(), 1)
+        self.assertEqual(Job.objects.filter(state=Job.STATES.PROCESSING).count(), 1)
+        self.assertEqual(Job.objects.filter(state=Job.STATES.NEW).count(), 1)
+
+        with mock.patch.object(Job.objects, "claim") as mock_claim:
+            worker._process_job()
+        self.assertEqual(mock_claim.call_count, 0)
+        self.assertEqual(Job.objects.filter(state=Job.STATES.COMPLETE).count(), 2)
+
+    def test_run_releases_prefetched_jobs_on_shutdown(self):
+        for _ in range(3):
+            Job.objects.create(name="testjob")
+        worker = Worker("default", 1, prefetch=3)
+
+        def process_one_job_then_stop():
+            worker._process_job()
+            worker.alive = False
+
+        with mock.patch.object(
+            worker, "process_job", side_effect=process_one_job_then_stop
+        ):
+            worker.run()
+
+        self.assertEqual(len(worker.prefetched_jobs), 0)
+        self.assertEqual(Job.objects.filter(state=Job.STATES.COMPLETE).count(), 1)
+        self.assertEqual(Job.objects.filter(state=Job.STATES.READY).count(), 2)
+
+    def test_worker_rejects_invalid_prefetch(self):
+        with self.assertRaises(CommandError):
+            call_command("worker", prefetch=0, dry_run=True, stdout=StringIO())
+
+
+@override_settings(JOBS={"testjob": {"tasks": ["django_dbq.tests.test_task"]}})
+class MultiQueueTestCase(TestCase):
+    def test_claims_follow_weights(self):
+        worker = Worker({"high": 5, "default": 2, "low": 1}, 1)
+
+        chosen = [worker.choose_queue()[0] for _ in range(16)]
+
+        self.assertEqual(chosen.count("high"), 10)
+        self.assertEqual(chosen.count("default"), 4)
+        self.assertEqual(chosen.count("low"), 2)
+        self.assertNotIn(["high"] * 4, [chosen[i : i + 4] for i in range(13)])
+
+    def test_claim_falls_through_to_other_queues(self):
+        low_job = Job.objects.create(name="testjob", queue_name="low")
+        worker = Worker({"high": 5, "low": 1}, 1)
+
+        with CaptureQueriesContext(connection) as context:
+            job = worker.claim_job()
+
+        self.assertEqual(job, low_job)
+        selects = [
+            query
+            for query in context.captured_queries
+            if query["sql"].startswith("SELECT")
+        ]
+        self.assertEqual(len(selects), 2)
+
+    def test_single_queue_makes_one_query_when_empty(self):
+        worker = Worker("default", 1)
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertIsNone(worker.claim_job())
+
+        selects = [
+            query
+            for query in context.captured_queries
+            if query["sql"].startswith("SELECT")
+        ]
+        self.assertEqual(len(selects), 1)
+
+    def test_worker_processes_jobs_from_every_queue(self):
+        Job.objects.create(name="testjob", queue_name="high")
+        Job.objects.create(name="testjob", queue_name="low")
+        Job.objects.create(name="testjob", queue_name="other")
+        worker = Worker({"high": 2, "low": 1}, 0)
+
+        while worker._process_job():
+            pass
+
+        self.assertEqual(
+            set(
+                Job.objects.filter(state=Job.STATES.COMPLETE).values_list(
+                    "queue_name", flat=True
+                )
+            ),
+            {"high", "low"},
+        )
+
+
+class RateLimitTestCase(SimpleTestCase):
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate("50/s"), 50)
+        self.assertEqual(parse_rate("3/m"), 0.05)
+        self.assertEqual(parse_rate("360/h"), 0.1)
+        self.assertEqual(parse_rate("2"), 2)
+        self.assertEqual(parse_rate(0.5), 0.5)
+        for rate in ["lots/s", "5/d", "0/s", -1]:
+            with self.subTest(rate=rate):
+                with self.assertRaises(ValueError):
+                    parse_rate(rate)
+
+    @mock.patch("django_dbq.ratelimit.monotonic")
+    def test_token_bucket_allows_bursts_then_refills_at_rate(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        bucket = TokenBucket(rate=10, burst=3)
+
+        self.assertEqual([bucket.try_acquire() for _ in range(4)], [True] * 3 + [False])
+        self.assertAlmostEqual(bucket.wait_time(), 0.1)
+
+        mock_monotonic.return_value = 100.25
+        self.assertEqual([bucket.try_acquire() for _ in range(3)], [True, True, False])
+
+        mock_monotonic.return_value = 200
+        self.assertEqual(bucket.wait_time(), 0)
+        self.assertEqual(bucket.tokens, 3)
+
+    @override_settings(
+        JOBS={
+            "slowjob": {"tasks": ["a"], "rate_limit": "3/m"},
+            "burstyjob": {"tasks": ["a"], "rate_limit": {"rate": "5/s", "burst": 10}},
+            "fastjob": {"tasks": ["a"]},
+        }
+    )
+    def test_job_definition_rate_limit(self):
+        self.assertEqual(get_job_definition("slowjob").rate_limit, (0.05, 1))
+        self.assertEqual(get_job_definition("burstyjob").rate_limit, (5, 10))
+        self.assertIsNone(get_job_definition("fastjob").rate_limit)
+
+    def test_job_definition_rejects_invalid_rate_limit(self):
+        for rate_limit in [
+            "fast",
+            {"burst": 2},
+            {"rate": "1/s", "burst": 0},
+            {"rate": "1/s", "scope": "galaxy"},
+        ]:
+            with self.subTest(rate_limit=rate_limit):
+                with override_settings(
+                    JOBS={"testjob": {"tasks": ["a"], "rate_limit": rate_limit}}
+                ):
+                    with self.assertRaises(ImproperlyConfigured):
+                        get_job_definition("testjob")
+
+
+@override_settings(
+    JOBS={
+        "slowjob": {"tasks": ["django_dbq.tests.test_task"], "rate_limit": "1/m"},
+        "fastjob": {"tasks": ["django_dbq.tests.test_task"]},
+    }
+)
+class JobRateLimitTestCase(TestCase):
+    def test_throttled_job_names_are_left_in_the_queue(self):
+        for name in ["slowjob", "slowjob", "fastjob", "fastjob"]:
+            Job.objects.create(name=name)
+        worker = Worker("default", 0)
+
+        while worker._process_job():
+            pass
+
+        self.assertEqual(
+            sorted(
+                Job.objects.filter(state=Job.STATES.COMPLETE).values_list(
+                    "name", flat=True
+                )
+            ),
+            ["fastjob", "fastjob", "slowjob"],
+        )
+        self.assertEqual(Job.objects.get(state=Job.STATES.NEW).name, "slowjob")
+        self.assertAlmostEqual(worker.throttled_for, 60, places=0)
+
+    def test_prefetched_jobs_over_the_limit_are_released(self):
+        for _ in range(3):
+            Job.objects.create(name="slowjob")
+        worker = Worker("default", 0, prefetch=3)
+
+        job = worker.claim_job()
+
+        self.assertEqual(job.name, "slowjob")
+        self.assertEqual(len(worker.prefetched_jobs), 0)
+        self.assertEqual(Job.objects.filter(state=Job.STATES.READY).count(), 2)
+
+    def test_worker_command_accepts_rate_and_burst(self):
+        stdout = StringIO()
+        call_command("worker", rate="50/s", burst=100, dry_run=True, stdout=stdout)
+        self.assertTrue("50.0 job(s) per second" in stdout.getvalue())
+
+    def test_worker_command_rejects_invalid_rate(self):
+        for options in [
+            {"rate": "fast"},
+            {"rate": "5/s", "burst": 0},
+            {"rate": "5/s", "rate_limit": 1},
+        ]:
+            with self.subTest(options=options):
+                with self.assertRaises(CommandError):
+                    call_command("worker", dry_run=True, stdout=StringIO(), **options)
+
+
+@override_settings(
+    JOBS={
+        "partnerjob": {
+            "tasks": ["django_dbq.tests.test_task"],
+            "rate_limit": {"rate": "1/s", "burst": 2, "scope": "cluster"},
+        },
+        "otherjob": {"tasks": ["django_dbq.tests.test_task"]},
+    }
+)
+@freezegun.freeze_time("2026-01-01 12:00:00")
+class ClusterRateLimitTestCase(TestCase):
+    def test_take_grants_tokens_up_to_burst_and_refills(self):
+        with transaction.atomic():
+            taken = RateLimitBucket.objects.take(
+                {"partnerjob": 3}, {"partnerjob": (1, 2)}
+            )
+        self.assertEqual(taken, {"partnerjob": (2, 1)})
+
+        with freezegun.freeze_time("2026-01-01 12:00:01.5"):
+            with transaction.atomic():
+                taken = RateLimitBucket.objects.take(
+                    {"partnerjob": 3}, {"partnerjob": (1, 2)}
+                )
+        self.assertEqual(taken, {"partnerjob": (1, 0.5)})
+
+    def test_claim_only_takes_jobs_with_tokens(self):
+        for name in ["partnerjob", "partnerjob", "partnerjob", "otherjob"]:
+            Job.objects.create(name=name)
+        throttled = {}
+
+        jobs = Job.objects.claim(
+            "default",
+            count=4,
+            rate_limits={"partnerjob": (1, 2)},
+            throttled=throttled,
+        )
+
+        self.assertEqual(
+            sorted(job.name for job in jobs), ["otherjob", "partnerjob", "partnerjob"]
+        )
+        self.assertEqual(Job.objects.get(state=Job.STATES.NEW).name, "partnerjob")
+        self.assertEqual(throttled, {"partnerjob": 1})
+
+    def test_limit_is_shared_between_workers(self):
+        for _ in range(3):
+            Job.objects.create(name="partnerjob")
+        worker_1 = Worker("default", 0, prefetch=3)
+        worker_2 = Worker("default", 0, prefetch=3)
+
+        self.assertIsNotNone(worker_1.claim_job())
+        self.assertEqual(len(worker_1.prefetched_jobs), 1)
+        self.assertIsNone(worker_2.claim_job())
+        self.assertEqual(worker_2.throttled_for, 1)
+
+    def test_throttled_names_are_left_out_of_later_claims(self):
+        for name in ["partnerjob", "partnerjob", "partnerjob", "otherjob"]:
+            Job.objects.create(name=name)
+        worker = Worker("default", 0)
+        worker.claim_job()
+        worker.claim_job()
+
+        with mock.patch.object(
+            Job.objects, "claim", wraps=Job.objects.claim
+        ) as mock_claim:
+            self.assertEqual(worker.claim_job().name, "otherjob")
+        self.assertEqual(mock_claim.call_args.kwargs["exclude_names"], ["partnerjob"])
+
+    def test_claims_of_unlimited_jobs_do_not_touch_buckets(self):
+        Job.objects.create(name="otherjob")
+
+        with CaptureQueriesContext(connection) as context:
+            Job.objects.claim("default", rate_limits={"partnerjob": (1, 2)})
+
+        self.assertFalse(
+            any(
+                RateLimitBucket._meta.db_table in query["sql"]
+                for query in context.captured_queries
+            )
+        )
+
+
+@override_settings(JOBS={"testjob": {"tasks": ["django_dbq.tests.test_task"]}})
+@freezegun.freeze_time("2026-01-01 12:00:00")
+class LeaseTestCase(TestCase):
+    def test_claim_sets_lease(self):
+        Job.objects.create(name="testjob")
+
+        (job,) = Job.objects.claim("default", lease_in_seconds=30)
+
+        job.refresh_from_db()
+        self.assertEqual(job.lease_expires, timezone.now() + timedelta(seconds=30))
+
+    def test_renew_leases_extends_claimed_jobs_only(self):
+        Job.objects.create(name="testjob")
+        Job.objects.create(name="testjob")
+        job_1, job_2 = Job.objects.claim("default", count=2, lease_in_seconds=30)
+        Job.objects.filter(pk=job_2.pk).update(state=Job.STATES.COMPLETE)
+
+        with freezegun.freeze_time("2026-01-01 12:00:20"):
+            self.assertEqual(Job.objects.renew_leases([job_1, job_2], 30), 1)
+
+        job_1.refresh_from_db()
+        job_2.refresh_from_db()
+        self.assertEqual(job_1.lease_expires, timezone.now() + timedelta(seconds=50))
+        self.assertEqual(job_2.lease_expires, timezone.now() + timedelta(seconds=30))
+
+    def test_save_keeps_renewed_lease(self):
+        Job.objects.create(name="testjob")
+        (job,) = Job.objects.claim("default", lease_in_seconds=30)
+
+        with freezegun.freeze_time("2026-01-01 12:00:20"):
+            Job.objects.renew_leases([job], 30)
+        job.workspace["progress"] = 1
+        job.save()
+
+        saved = Job.objects.get()
+        self.assertEqual(saved.workspace, {"progress": 1})
+        self.assertEqual(saved.lease_expires, timezone.now() + timedelta(seconds=50))
+        self.assertEqual(saved.claim_id, job.claim_id)
+
+    def test_stale_claim_is_not_renewed_or_released(self):
+        Job.objects.create(name="testjob")
+        (stale,) = Job.objects.claim("default", lease_in_seconds=30)
+        Job.objects.filter(pk=stale.pk).update(
+            lease_expires=timezone.now() - timedelta(seconds=1)
+        )
+        Job.objects.reclaim_expired()
+        (current,) = Job.objects.claim("default", lease_in_seconds=30)
+
+        with freezegun.freeze_time("2026-01-01 12:00:20"):
+            self.assertEqual(Job.objects.renew_leases([stale], 30), 0)
+        self.assertEqual(Job.objects.release([stale]), 0)
+
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.PROCESSING)
+        self.assertEqual(job.lease_expires, current.lease_expires)
+        self.assertEqual(Job.objects.release([current]), 1)
+
+    def test_reclaim_expired_returns_jobs_to_ready(self):
+        expired = timezone.now() - timedelta(seconds=1)
+        leased = timezone.now() + timedelta(seconds=1)
+        processing = Job.objects.create(name="testjob")
+        stopping = Job.objects.create(name="testjob")
+        still_leased = Job.objects.create(name="testjob")
+        unleased = Job.objects.create(name="testjob")
+        Job.objects.filter(pk=processing.pk).update(
+            state=Job.STATES.PROCESSING, lease_expires=expired
+        )
+        Job.objects.filter(pk=stopping.pk).update(
+            state=Job.STATES.STOPPING, lease_expires=expired
+        )
+        Job.objects.filter(pk=still_leased.pk).update(
+            state=Job.STATES.PROCESSING, lease_expires=leased
+        )
+        Job.objects.filter(pk=unleased.pk).update(state=Job.STATES.PROCESSING)
+
+        self.assertEqual(Job.objects.reclaim_expired(), 2)
+
+        for job in (processing, stopping):
+            job.refresh_from_db()
+            self.assertEqual(job.state, Job.STATES.READY)
+            self.assertIsNone(job.lease_expires)
+        for job in (still_leased, unleased):
+            job.refresh_from_db()
+            self.assertEqual(job.state, Job.STATES.PROCESSING)
+
+    def test_heartbeat_renews_running_and_prefetched_jobs(self):
+        for _ in range(2):
+            Job.objects.create(name="testjob")
+        worker = Worker("default", 1, prefetch=2, lease_in_seconds=30)
+        running = worker.claim_job()
+        worker.current_jobs.add(running)
+
+        with freezegun.freeze_time("2026-01-01 12:00:20"):
+            worker.heartbeat()
+
+        self.assertEqual(
+            set(Job.objects.values_list("lease_expires", flat=True)),
+            {timezone.now() + timedelta(seconds=50)},
+        )
+
+    def test_heartbeat_reclaims_expired_jobs_once_per_lease(self):
+        worker = Worker("default", 1, lease_in_seconds=30)
+
+        with mock.patch.object(Job.objects, "reclaim_expired") as mock_reclaim:
+            worker.heartbeat()
+            worker.heartbeat()
+
+        self.assertEqual(mock_reclaim.call_count, 1)
+
+    def test_finished_job_has_no_lease(self):
+        Job.objects.create(name="testjob")
+        worker = Worker("default", 1, lease_in_seconds=30)
+
+        worker._process_job()
+
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.COMPLETE)
+        self.assertIsNone(job.lease_expires)
+
+    def test_worker_rejects_invalid_lease(self):
+        with self.assertRaises(CommandError):
+            call_command("worker", lease=0, dry_run=True, stdout=StringIO())
+
 
 @override_settings(JOBS={"testjob": {"tasks": ["a", "b", "c"]}})
 class JobTaskTestCase(TestCase):
@@ -340,6 +1232,62 @@ class JobTaskTestCase(TestCase):
         self.assertEqual(job.next_task, "")
 
 
+class JobRegistryTestCase(SimpleTestCase):
+    @override_settings(
+        JOBS={
+            "testjob": {
+                "tasks": [
+                    "django_dbq.tests.test_task",
+                    "django_dbq.tests.failing_task",
+                ],
+                "pre_task_hook": "django_dbq.tests.pre_task_hook",
+            }
+        }
+    )
+    def test_job_definition(self):
+        job_definition = get_job_definition("testjob")
+        self.assertEqual(
+            job_definition.get_next_task_name(), "django_dbq.tests.test_task"
+        )
+        self.assertEqual(
+            job_definition.get_next_task_name("django_dbq.tests.test_task"),
+            "django_dbq.tests.failing_task",
+        )
+        self.assertIsNone(
+            job_definition.get_next_task_name("django_dbq.tests.failing_task")
+        )
+        self.assertEqual(
+            job_definition.get_hook_name("pre_task_hook"),
+            "django_dbq.tests.pre_task_hook",
+        )
+        self.assertIsNone(job_definition.get_hook_name("failure_hook"))
+        self.assertIs(
+            job_definition.get_task_function("django_dbq.tests.test_task"), test_task
+        )
+
+    @override_settings(JOBS={"testjob": {"tasks": ["django_dbq.tests.test_task"]}})
+    def test_callables_are_imported_once(self):
+        job_definition = get_job_definition("testjob")
+        job_definition.load()
+        with mock.patch("django_dbq.tasks.import_string") as mock_import_string:
+            for _ in range(3):
+                get_job_definition("testjob").get_task_function(
+                    "django_dbq.tests.test_task"
+                )
+        self.assertEqual(mock_import_string.call_count, 0)
+
+    def test_registry_follows_settings(self):
+        with override_settings(JOBS={"testjob": {"tasks": ["a"]}}):
+            self.assertEqual(get_next_task_name("testjob"), "a")
+        with override_settings(JOBS={"testjob": {"tasks": ["b"]}}):
+            self.assertEqual(get_next_task_name("testjob"), "b")
+
+    @override_settings(JOBS={"testjob": {"tasks": []}})
+    def test_job_without_tasks_is_misconfigured(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_job_definition("testjob")
+
+
 @override_settings(JOBS={"testjob": {"tasks": ["django_dbq.tests.test_task"]}})
 class ProcessJobTestCase(TestCase):
     def test_process_job(self):
@@ -360,14 +1308,905 @@ class ProcessJobTestCase(TestCase):
 
 @override_settings(
     JOBS={
-        "testjob": {
-            "tasks": ["django_dbq.tests.test_task"],
-            "creation_hook": "django_dbq.tests.creation_hook",
-        }
+        "testjob": {"tasks": ["django_dbq.tests.test_task"]},
+        "workspacejob": {"tasks": ["django_dbq.tests.workspace_test_task"]},
+        "reclaimedjob": {"tasks": ["django_dbq.tests.reclaimed_task"]},
     }
 )
-class JobCreationHookTestCase(TestCase):
-    def test_creation_hook(self):
+class TransitionTestCase(TestCase):
+    def get_job_updates(self, context):
+        return [
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].startswith('UPDATE "django_dbq_job"')
+        ]
+
+    def test_outcome_is_saved_without_unchanged_workspace(self):
+        Job.objects.create(name="testjob", workspace={"big": "x" * 1000})
+
+        with CaptureQueriesContext(connection) as context:
+            Worker("default", 1)._process_job()
+
+        claim, outcome = self.get_job_updates(context)
+        self.assertIn('"state" IN', outcome)
+        self.assertNotIn('"workspace"', outcome)
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.COMPLETE)
+        self.assertEqual(job.workspace, {"big": "x" * 1000})
+
+    def test_outcome_is_saved_with_changed_workspace(self):
+        Job.objects.create(name="workspacejob", workspace={"input": "in"})
+
+        with CaptureQueriesContext(connection) as context:
+            Worker("default", 1)._process_job()
+
+        claim, outcome = self.get_job_updates(context)
+        self.assertIn('"workspace"', outcome)
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.COMPLETE)
+        self.assertEqual(job.workspace, {"input": "in", "output": "in-output"})
+
+    def test_outcome_of_stopping_job_is_saved(self):
+        Job.objects.create(name="testjob")
+        (job,) = Job.objects.claim("default")
+        Job.objects.filter(pk=job.pk).update(state=Job.STATES.STOPPING)
+        job.state = Job.STATES.COMPLETE
+
+        self.assertTrue(job.save_transition(Job.ACTIVE_STATES))
+
+        self.assertEqual(Job.objects.get().state, Job.STATES.COMPLETE)
+
+    def test_outcome_of_job_claimed_again_is_not_saved(self):
+        Job.objects.create(name="testjob")
+        (stale,) = Job.objects.claim("default", lease_in_seconds=60)
+        Job.objects.filter(pk=stale.pk).update(
+            lease_expires=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(Job.objects.reclaim_expired(), 1)
+        (current,) = Job.objects.claim("default", lease_in_seconds=60)
+
+        stale.state = Job.STATES.COMPLETE
+        self.assertFalse(stale.save_transition(Job.ACTIVE_STATES))
+        self.assertFalse(stale.save_transition(Job.ACTIVE_STATES, save_lease=False))
+
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.PROCESSING)
+        self.assertEqual(job.lease_expires, current.lease_expires)
+
+        current.state = Job.STATES.COMPLETE
+        self.assertTrue(current.save_transition(Job.ACTIVE_STATES))
+        self.assertEqual(Job.objects.get().state, Job.STATES.COMPLETE)
+
+    def test_lost_update_is_detected(self):
+        Job.objects.create(name="reclaimedjob", workspace={"input": "in"})
+        metrics = RecordingMetrics()
+
+        with self.assertLogs("django_dbq", level="WARNING"):
+            Worker("default", 1, metrics=metrics)._process_job()
+
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.READY)
+        self.assertEqual(job.next_task, "django_dbq.tests.reclaimed_task")
+        self.assertNotIn("outcome", [call[0] for call in metrics.calls])
+
+
+@override_settings(
+    JOBS={
+        "testjob": {"tasks": ["django_dbq.tests.test_task"]},
+        "workspacejob": {"tasks": ["django_dbq.tests.workspace_test_task"]},
+        "readingjob": {"tasks": ["django_dbq.tests.reading_task"]},
+    },
+    DBQ_WORKSPACE_COMPRESSION_THRESHOLD=100,
+)
+class WorkspaceStorageTestCase(TestCase):
+    big_workspace = {"input": "in", "padding": "x" * 1000}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        storage_settings = override_settings(
+            STORAGES={
+                "workspaces": {
+                    "BACKEND": "django.core.files.storage.FileSystemStorage",
+                    "OPTIONS": {"location": directory.name},
+                }
+            }
+        )
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+        self.directory = directory.name
+
+    def list_files(self):
+        return sorted(os.listdir(os.path.join(self.directory, "dbq_workspaces")))
+
+    def get_stored_workspace(self):
+        return Job.objects.values_list("workspace", flat=True).get()
+
+    def test_small_workspace_is_stored_as_is(self):
+        Job.objects.create(name="testjob", workspace={"input": "in"})
+
+        self.assertEqual(self.get_stored_workspace(), {"input": "in"})
+
+    def test_big_workspace_is_compressed_and_loaded_lazily(self):
+        Job.objects.create(name="testjob", workspace=self.big_workspace)
+
+        self.assertEqual(self.get_stored_workspace().kind, "zlib")
+        job = Job.objects.get()
+        self.assertIsInstance(job.__dict__["workspace"], StoredWorkspace)
+        self.assertEqual(job.workspace, self.big_workspace)
+
+    @override_settings(
+        DBQ_WORKSPACE_STORAGE="workspaces", DBQ_WORKSPACE_STORAGE_THRESHOLD=1500
+    )
+    def test_values_return_stored_workspaces(self):
+        Job.objects.create(name="testjob", workspace={"input": "in"})
+        Job.objects.create(name="testjob", workspace=self.big_workspace)
+        bigger_workspace = {"padding": "x" * 2000}
+        Job.objects.create(name="testjob", workspace=bigger_workspace)
+
+        small, compressed, offloaded = [
+            row["workspace"] for row in Job.objects.order_by("created").values()
+        ]
+
+        self.assertEqual(small, {"input": "in"})
+        self.assertIsInstance(compressed, StoredWorkspace)
+        self.assertEqual(compressed.kind, "zlib")
+        self.assertEqual(compressed.load(), self.big_workspace)
+        self.assertIsInstance(offloaded, StoredWorkspace)
+        self.assertEqual(offloaded.kind, "storage")
+        self.assertEqual(offloaded.load(), bigger_workspace)
+        self.assertEqual(
+            [
+                workspace.load()
+                for workspace in Job.objects.order_by("created").values_list(
+                    "workspace", flat=True
+                )[1:]
+            ],
+            [self.big_workspace, bigger_workspace],
+        )
+
+    @override_settings(
+        DBQ_WORKSPACE_STORAGE="workspaces", DBQ_WORKSPACE_STORAGE_THRESHOLD=500
+    )
+    def test_bigger_workspace_is_offloaded(self):
+        Job.objects.create(name="testjob", workspace=self.big_workspace)
+
+        stored = self.get_stored_workspace()
+        self.assertEqual(stored.kind, "storage")
+        self.assertEqual(
+            ["dbq_workspaces/%s" % name for name in self.list_files()],
+            [stored.stored["name"]],
+        )
+        self.assertEqual(Job.objects.get().workspace, self.big_workspace)
+
+    @override_settings(
+        DBQ_WORKSPACE_STORAGE="workspaces", DBQ_WORKSPACE_STORAGE_THRESHOLD=500
+    )
+    def test_worker_does_not_load_or_rewrite_unused_workspace(self):
+        Job.objects.create(name="testjob", workspace=self.big_workspace)
+        stored = self.get_stored_workspace()
+
+        with mock.patch.object(StoredWorkspace, "load") as mock_load:
+            Worker("default", 1)._process_job()
+
+        mock_load.assert_not_called()
+        self.assertEqual(Job.objects.get().state, Job.STATES.COMPLETE)
+        self.assertEqual(self.get_stored_workspace().stored, stored.stored)
+
+    def test_worker_does_not_rewrite_workspace_which_was_only_read(self):
+        Job.objects.create(name="readingjob", workspace=self.big_workspace)
+
+        with CaptureQueriesContext(connection) as context:
+            Worker("default", 1)._process_job()
+
+        outcome = [
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].startswith('UPDATE "django_dbq_job"')
+        ][-1]
+        self.assertNotIn('"workspace"', outcome)
+        self.assertEqual(Job.objects.get().state, Job.STATES.COMPLETE)
+
+    @override_settings(
+        DBQ_WORKSPACE_STORAGE="workspaces", DBQ_WORKSPACE_STORAGE_THRESHOLD=500
+    )
+    def test_unused_workspace_files_are_deleted(self):
+        Job.objects.create(name="workspacejob", workspace=self.big_workspace)
+        Worker("default", 1)._process_job()
+        self.assertEqual(len(self.list_files()), 2)
+
+        self.assertEqual(Job.objects.delete_unused_workspace_files(), 0)
+        self.assertEqual(
+            Job.objects.delete_unused_workspace_files(grace_in_seconds=0), 1
+        )
+
+        self.assertEqual(len(self.list_files()), 1)
+        self.assertEqual(
+            Job.objects.get().workspace,
+            dict(self.big_workspace, output="in-output"),
+        )
+
+    @override_settings(
+        DBQ_WORKSPACE_STORAGE="workspaces", DBQ_WORKSPACE_STORAGE_THRESHOLD=500
+    )
+    def test_workspace_files_of_archived_jobs_are_kept(self):
+        job = Job.objects.create(name="testjob", workspace=self.big_workspace)
+        Job.objects.filter(pk=job.pk).update(
+            state=Job.STATES.COMPLETE, created=timezone.now() - timedelta(days=2)
+        )
+        Job.objects.archive_old()
+
+        self.assertEqual(
+            Job.objects.delete_unused_workspace_files(grace_in_seconds=0), 0
+        )
+        self.assertEqual(ArchivedJob.objects.get().workspace, self.big_workspace)
+
+
+@override_settings(
+    JOBS={
+        "testjob": {
+            "tasks": [
+                "django_dbq.tests.appending_task",
+                "django_dbq.tests.appending_task_2",
+                "django_dbq.tests.appending_task_3",
+            ]
+        },
+        "completingjob": {
+            "tasks": [
+                "django_dbq.tests.appending_task",
+                "django_dbq.tests.appending_task_2",
+                "django_dbq.tests.appending_task_3",
+            ],
+            "run_to_completion": True,
+        },
+        "interruptedjob": {
+            "tasks": [
+                "django_dbq.tests.appending_task",
+                "django_dbq.tests.interrupting_task",
+            ],
+            "run_to_completion": True,
+        },
+    }
+)
+class RunToCompletionTestCase(TestCase):
+    all_tasks = [
+        "django_dbq.tests.appending_task",
+        "django_dbq.tests.appending_task_2",
+        "django_dbq.tests.appending_task_3",
+    ]
+
+    def test_job_returns_to_queue_between_tasks_by_default(self):
+        Job.objects.create(name="testjob")
+
+        Worker("default", 1)._process_job()
+
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.READY)
+        self.assertEqual(job.next_task, self.all_tasks[1])
+
+    def test_job_configured_to_run_to_completion(self):
+        Job.objects.create(name="completingjob")
+
+        with CaptureQueriesContext(connection) as context:
+            Worker("default", 1)._process_job()
+
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.COMPLETE)
+        self.assertEqual(job.workspace, {"ran": self.all_tasks})
+        selects = [
+            query
+            for query in context.captured_queries
+            if query["sql"].startswith("SELECT")
+        ]
+        self.assertEqual(len(selects), 1)
+
+    def test_worker_runs_every_job_to_completion(self):
+        Job.objects.create(name="testjob")
+
+        Worker("default", 1, run_to_completion=True)._process_job()
+
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.COMPLETE)
+        self.assertEqual(job.workspace, {"ran": self.all_tasks})
+
+    def test_async_worker_runs_job_to_completion(self):
+        Job.objects.create(name="completingjob")
+
+        worker = AsyncWorker("default", 1)
+
+        async def process():
+            await worker._aprocess_job()
+            await asyncio.wait(worker.futures)
+
+        async_to_sync(process)()
+
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.COMPLETE)
+        self.assertEqual(job.workspace, {"ran": self.all_tasks})
+
+    def test_progress_is_checkpointed_between_tasks(self):
+        Job.objects.create(name="interruptedjob")
+
+        with self.assertRaises(KeyboardInterrupt):
+            Worker("default", 1)._process_job()
+
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.PROCESSING)
+        self.assertEqual(job.next_task, "django_dbq.tests.interrupting_task")
+        self.assertEqual(job.workspace, {"ran": ["django_dbq.tests.appending_task"]})
+
+    def test_worker_stops_between_tasks_when_shutting_down(self):
+        Job.objects.create(name="completingjob")
+        worker = Worker("default", 1)
+        run_next_task = Job.run_next_task
+
+        def run_next_task_and_shut_down(job):
+            run_next_task(job)
+            worker.alive = False
+
+        with mock.patch.object(Job, "run_next_task", run_next_task_and_shut_down):
+            worker._process_job()
+
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.READY)
+        self.assertEqual(job.next_task, self.all_tasks[1])
+        self.assertIsNone(job.lease_expires)
+
+
+class RetryPolicyTestCase(SimpleTestCase):
+    def test_delay_doubles_up_to_max_backoff(self):
+        retry_policy = RetryPolicy(5, backoff=2, max_backoff=10, jitter=0)
+
+        self.assertEqual(
+            [retry_policy.get_delay(attempts) for attempts in range(1, 5)],
+            [2, 4, 8, 10],
+        )
+
+    @mock.patch("django_dbq.tasks.random.random", return_value=0.5)
+    def test_jitter_shortens_delay(self, mock_random):
+        retry_policy = RetryPolicy(5, backoff=2, jitter=0.5)
+
+        self.assertEqual(retry_policy.get_delay(2), 3)
+
+    def test_should_retry(self):
+        retry_policy = RetryPolicy(3, exceptions=["builtins.ValueError"])
+
+        self.assertTrue(retry_policy.should_retry(ValueError(), 2))
+        self.assertFalse(retry_policy.should_retry(ValueError(), 3))
+        self.assertFalse(retry_policy.should_retry(KeyError(), 1))
+        self.assertTrue(RetryPolicy(3).should_retry(KeyError(), 1))
+
+    @override_settings(JOBS={"testjob": {"tasks": ["a"], "retry": 3}})
+    def test_retry_can_be_given_as_max_attempts(self):
+        retry_policy = get_job_definition("testjob").retry_policy
+
+        self.assertEqual(retry_policy.max_attempts, 3)
+        self.assertEqual(retry_policy.backoff, 5)
+
+    def test_invalid_retry_policies(self):
+        for retry in (
+            0,
+            "x",
+            {"backoff": 1},
+            {"max_attempts": 3, "jitter": 2},
+            {"max_attempts": 3, "backoff": -1},
+        ):
+            with self.subTest(retry=retry), override_settings(
+                JOBS={"testjob": {"tasks": ["a"], "retry": retry}}
+            ):
+                with self.assertRaises(ImproperlyConfigured):
+                    get_job_definition("testjob")
+
+    @override_settings(
+        JOBS={
+            "testjob": {
+                "tasks": ["django_dbq.tests.test_task"],
+                "retry": {
+                    "max_attempts": 3,
+                    "exceptions": ["django_dbq.tests.test_task"],
+                },
+            }
+        }
+    )
+    def test_retried_exceptions_are_checked_on_load(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_job_definition("testjob").load()
+
+
+@freezegun.freeze_time("2026-01-01 12:00:00")
+@override_settings(
+    JOBS={
+        "testjob": {
+            "tasks": ["django_dbq.tests.failing_task"],
+            "failure_hook": "django_dbq.tests.failure_hook",
+            "retry": {"max_attempts": 3, "backoff": 10, "jitter": 0},
+        },
+        "keyerrorjob": {
+            "tasks": ["django_dbq.tests.failing_task"],
+            "retry": {"max_attempts": 3, "exceptions": "builtins.KeyError"},
+        },
+    }
+)
+class RetryTestCase(TestCase):
+    def test_failed_task_is_retried_with_backoff(self):
+        Job.objects.create(name="testjob")
+        worker = Worker("default", 1)
+
+        with CaptureQueriesContext(connection) as context:
+            worker._process_job()
+
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.READY)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.run_after, timezone.now() + timedelta(seconds=10))
+        self.assertEqual(job.next_task, "django_dbq.tests.failing_task")
+        self.assertNotIn("output", job.workspace)
+        updates = [
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].startswith('UPDATE "django_dbq_job"')
+        ]
+        self.assertEqual(len(updates), 2)
+        self.assertFalse(worker._process_job())
+
+        with freezegun.freeze_time("2026-01-01 12:00:10"):
+            worker._process_job()
+        job = Job.objects.get()
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(job.run_after, timezone.now() + timedelta(seconds=10 + 20))
+
+        with freezegun.freeze_time("2026-01-01 12:00:30"):
+            worker._process_job()
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.FAILED)
+        self.assertEqual(job.attempts, 3)
+        self.assertEqual(job.workspace["output"], "failure hook ran")
+
+    def test_other_exceptions_are_not_retried(self):
+        Job.objects.create(name="keyerrorjob")
+
+        Worker("default", 1)._process_job()
+
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.FAILED)
+        self.assertEqual(job.attempts, 1)
+
+    def test_async_worker_retries_failed_task(self):
+        Job.objects.create(name="testjob")
+        worker = AsyncWorker("default", 1)
+
+        async def process():
+            await worker._aprocess_job()
+            await asyncio.wait(worker.futures)
+
+        async_to_sync(process)()
+
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.READY)
+        self.assertEqual(job.attempts, 1)
+
+
+@override_settings(JOBS={"testjob": {"tasks": ["django_dbq.tests.barrier_task"]}})
+class ConcurrencyTestCase(TransactionTestCase):
+    def test_worker_runs_jobs_concurrently_on_thread_pool(self):
+        """
+        Each job waits on a barrier shared by all three, so they can only
+        finish if the worker runs them at the same time.
+        """
+        for _ in range(3):
+            Job.objects.create(name="testjob")
+        worker = Worker("default", 0, concurrency=3)
+
+        for _ in range(3):
+            self.assertTrue(worker._process_job())
+        worker.executor.shutdown(wait=True)
+        worker.collect_finished_jobs()
+
+        self.assertEqual(worker.current_jobs, set())
+        self.assertEqual(Job.objects.filter(state=Job.STATES.COMPLETE).count(), 3)
+
+    @override_settings(JOBS={"testjob": {"tasks": ["django_dbq.tests.test_task"]}})
+    def test_worker_waits_for_a_free_slot(self):
+        Job.objects.create(name="testjob")
+        worker = Worker("default", 0, concurrency=2)
+        worker.futures = {
+            mock.MagicMock(**{"done.return_value": False}) for _ in range(2)
+        }
+
+        with mock.patch(
+            "django_dbq.management.commands.worker.wait",
+            side_effect=lambda futures, return_when: worker.futures.clear(),
+        ) as mock_wait:
+            worker._process_job()
+
+        self.assertEqual(mock_wait.call_count, 1)
+        worker.executor.shutdown(wait=True)
+
+
+@override_settings(JOBS={"testjob": {"tasks": ["django_dbq.tests.async_task"]}})
+class AsyncWorkerTestCase(TestCase):
+    def process_jobs(self, worker, count):
+        async def process():
+            for _ in range(count):
+                await worker._aprocess_job()
+            if worker.futures:
+                await asyncio.wait(worker.futures)
+            worker.collect_finished_jobs()
+
+        async_to_sync(process)()
+
+    def test_async_worker_runs_coroutine_tasks_concurrently(self):
+        for _ in range(3):
+            Job.objects.create(name="testjob")
+        worker = AsyncWorker("default", 0, concurrency=3)
+
+        self.process_jobs(worker, 3)
+
+        self.assertEqual(worker.current_jobs, set())
+        jobs = Job.objects.all()
+        self.assertTrue(all(job.state == Job.STATES.COMPLETE for job in jobs))
+        self.assertEqual(max(job.workspace["max_in_flight"] for job in jobs), 3)
+
+    def test_async_worker_bounds_jobs_in_flight(self):
+        for _ in range(4):
+            Job.objects.create(name="testjob")
+        worker = AsyncWorker("default", 0, concurrency=2)
+
+        self.process_jobs(worker, 4)
+
+        jobs = Job.objects.all()
+        self.assertTrue(all(job.state == Job.STATES.COMPLETE for job in jobs))
+        self.assertEqual(max(job.workspace["max_in_flight"] for job in jobs), 2)
+
+    @override_settings(
+        JOBS={"testjob": {"tasks": ["django_dbq.tests.plain_barrier_task"]}}
+    )
+    def test_async_worker_runs_plain_tasks_concurrently(self):
+        for _ in range(2):
+            Job.objects.create(name="testjob")
+        worker = AsyncWorker("default", 0, concurrency=2)
+
+        self.process_jobs(worker, 2)
+
+        self.assertEqual(
+            list(Job.objects.values_list("state", flat=True)),
+            [Job.STATES.COMPLETE] * 2,
+        )
+
+    @override_settings(
+        JOBS={"testjob": {"tasks": ["django_dbq.tests.plain_barrier_task"]}}
+    )
+    def test_async_worker_runs_more_plain_tasks_than_default_executor_threads(self):
+        concurrency = min(32, (os.cpu_count() or 1) + 4) + 1
+        for _ in range(concurrency):
+            Job.objects.create(name="testjob")
+        worker = AsyncWorker("default", 0, concurrency=concurrency)
+
+        async def process():
+            worker.set_task_executor(asyncio.get_running_loop())
+            for _ in range(concurrency):
+                await worker._aprocess_job()
+            await asyncio.wait(worker.futures)
+            worker.task_executor.shutdown(wait=True)
+
+        with mock.patch(
+            "django_dbq.tests.plain_concurrency_barrier",
+            threading.Barrier(concurrency, timeout=10),
+        ):
+            async_to_sync(process)()
+
+        self.assertEqual(
+            set(Job.objects.values_list("state", flat=True)), {Job.STATES.COMPLETE}
+        )
+
+    @override_settings(
+        JOBS={
+            "testjob": {
+                "tasks": ["django_dbq.tests.workspace_test_task"],
+                "pre_task_hook": "django_dbq.tests.pre_task_hook",
+                "post_task_hook": "django_dbq.tests.post_task_hook",
+            }
+        }
+    )
+    def test_async_worker_runs_plain_tasks_and_hooks(self):
+        Job.objects.create(name="testjob", workspace={"input": "test"})
+        worker = AsyncWorker("default", 0)
+
+        self.process_jobs(worker, 1)
+
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.COMPLETE)
+        self.assertEqual(job.workspace["output"], "post task hook ran")
+
+    @override_settings(
+        JOBS={
+            "testjob": {
+                "tasks": ["django_dbq.tests.async_failing_task"],
+                "failure_hook": "django_dbq.tests.async_failure_hook",
+            }
+        }
+    )
+    def test_async_worker_runs_failure_hook(self):
+        Job.objects.create(name="testjob")
+        worker = AsyncWorker("default", 0)
+
+        self.process_jobs(worker, 1)
+
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.FAILED)
+        self.assertEqual(job.workspace["output"], "failure hook ran")
+
+    def test_sync_worker_runs_coroutine_tasks(self):
+        Job.objects.create(name="testjob")
+
+        Worker("default", 0)._process_job()
+
+        job = Job.objects.get()
+        self.assertEqual(job.state, Job.STATES.COMPLETE)
+        self.assertEqual(job.workspace["output"], "async task ran")
+
+    def test_shutdown_marks_jobs_stopping_on_the_event_loop(self):
+        Job.objects.create(name="testjob")
+        worker = AsyncWorker("default", 0)
+        worker.current_jobs.update(Job.objects.claim("default"))
+
+        async def shutdown():
+            worker.loop = asyncio.get_running_loop()
+            worker.shutdown(None, None)
+            await asyncio.wrap_future(worker.stopping)
+
+        async_to_sync(shutdown)()
+
+        self.assertFalse(worker.alive)
+        self.assertEqual(Job.objects.get().state, Job.STATES.STOPPING)
+
+    def test_run_finishes_jobs_in_flight_before_exiting(self):
+        for _ in range(2):
+            Job.objects.create(name="testjob")
+        worker = AsyncWorker("default", 0, concurrency=2, prefetch=2)
+
+        async def process_one_job_then_stop():
+            await worker._aprocess_job()
+            worker.alive = False
+
+        with mock.patch.object(
+            worker, "aprocess_job", side_effect=process_one_job_then_stop
+        ):
+            async_to_sync(worker.arun)()
+
+        self.assertEqual(Job.objects.filter(state=Job.STATES.COMPLETE).count(), 1)
+        self.assertEqual(Job.objects.filter(state=Job.STATES.READY).count(), 1)
+
+    def test_worker_command_accepts_async(self):
+        stdout = StringIO()
+        call_command("worker", use_async=True, dry_run=True, stdout=stdout)
+        self.assertTrue("Starting job worker" in stdout.getvalue())
+
+
+class RecordingMetrics(Metrics):
+    def __init__(self):
+        self.calls = []
+
+    def observe_claim(self, queue_name, seconds, claimed):
+        self.calls.append(("claim", queue_name, claimed))
+
+    def observe_queue_wait(self, job, seconds):
+        self.calls.append(("queue_wait", job.name, seconds))
+
+    def observe_task(self, job, task_name, seconds):
+        self.calls.append(("task", job.name, task_name))
+
+    def observe_hook(self, job, hook_name, seconds):
+        self.calls.append(("hook", job.name, hook_name))
+
+    def observe_outcome(self, job):
+        self.calls.append(("outcome", job.name, job.state))
+
+    def set_in_flight(self, count):
+        self.calls.append(("in_flight", count))
+
+
+@freezegun.freeze_time("2026-01-01 12:00:00")
+@override_settings(
+    JOBS={
+        "testjob": {
+            "tasks": ["django_dbq.tests.workspace_test_task"],
+            "pre_task_hook": "django_dbq.tests.pre_task_hook",
+            "post_task_hook": "django_dbq.tests.post_task_hook",
+        }
+    }
+)
+class WorkerMetricsTestCase(TestCase):
+    def test_worker_reports_metrics_for_a_job(self):
+        with freezegun.freeze_time("2026-01-01 11:59:30"):
+            Job.objects.create(name="testjob", workspace={"input": "test"})
+        metrics = RecordingMetrics()
+        worker = Worker("default", 0, metrics=metrics)
+
+        worker._process_job()
+        worker._process_job()
+
+        self.assertEqual(
+            metrics.calls,
+            [
+                ("claim", "default", 1),
+                ("queue_wait", "testjob", 30),
+                ("in_flight", 1),
+                ("hook", "testjob", "pre_task_hook"),
+                ("task", "testjob", "django_dbq.tests.workspace_test_task"),
+                ("hook", "testjob", "post_task_hook"),
+                ("in_flight", 0),
+                ("outcome", "testjob", Job.STATES.COMPLETE),
+                ("claim", "default", 0),
+            ],
+        )
+
+    def test_async_worker_reports_metrics_for_a_job(self):
+        Job.objects.create(name="testjob", workspace={"input": "test"})
+        metrics = RecordingMetrics()
+        worker = AsyncWorker("default", 0, metrics=metrics)
+
+        async def process():
+            await worker._aprocess_job()
+            await asyncio.wait(worker.futures)
+
+        async_to_sync(process)()
+
+        self.assertIn(
+            ("task", "testjob", "django_dbq.tests.workspace_test_task"), metrics.calls
+        )
+        self.assertEqual(
+            metrics.calls[-2:],
+            [("in_flight", 0), ("outcome", "testjob", Job.STATES.COMPLETE)],
+        )
+
+    def test_prometheus_metrics_are_served(self):
+        job = Job(name="testjob", queue_name="default", state=Job.STATES.COMPLETE)
+        metrics = PrometheusMetrics(0, address="127.0.0.1")
+        metrics.observe_claim("default", 0.02, 1)
+        metrics.observe_claim("default", 0.5, 0)
+        metrics.observe_task(job, "a.task", 3)
+        metrics.observe_outcome(job)
+        metrics.set_in_flight(2)
+
+        metrics.start()
+        try:
+            port = metrics.server.server_address[1]
+            with urllib.request.urlopen("http://127.0.0.1:%s/" % port) as response:
+                body = response.read().decode("utf-8")
+        finally:
+            metrics.server.shutdown()
+            metrics.server.server_close()
+
+        self.assertIn(
+            'dbq_claim_duration_seconds_bucket{queue="default",le="0.025"} 1', body
+        )
+        self.assertIn(
+            'dbq_claim_duration_seconds_bucket{queue="default",le="+Inf"} 2', body
+        )
+        self.assertIn('dbq_claim_duration_seconds_count{queue="default"} 2', body)
+        self.assertIn('dbq_claims_total{queue="default",result="miss"} 1', body)
+        self.assertIn(
+            'dbq_task_duration_seconds_sum{job="testjob",task="a.task"} 3', body
+        )
+        self.assertIn('dbq_jobs_total{job="testjob",state="COMPLETE"} 1', body)
+        self.assertIn("dbq_jobs_in_flight 2", body)
+
+    def test_statsd_metrics_are_sent(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(5)
+        self.addCleanup(receiver.close)
+        job = Job(name="testjob", queue_name="default", state=Job.STATES.FAILED)
+        metrics = StatsdMetrics("127.0.0.1", receiver.getsockname()[1])
+        metrics.start()
+
+        metrics.observe_task(job, "a.task", 0.25)
+        metrics.observe_outcome(job)
+        metrics.set_in_flight(3)
+
+        self.assertEqual(
+            [receiver.recv(1024).decode("utf-8") for _ in range(3)],
+            [
+                "dbq.task.testjob.a_task:250.0|ms",
+                "dbq.jobs.testjob.failed:1|c",
+                "dbq.in_flight:3|g",
+            ],
+        )
+
+    def test_get_metrics(self):
+        self.assertEqual(get_metrics("prometheus:9100").port, 9100)
+        self.assertEqual(get_metrics("statsd:stats:9125").address, ("stats", 9125))
+        self.assertEqual(get_metrics("statsd").address, ("localhost", 8125))
+        self.assertIsInstance(
+            get_metrics("django_dbq.tests.RecordingMetrics"), RecordingMetrics
+        )
+        for spec in [
+            "prometheus:lots",
+            "django_dbq.tests.missing",
+            "django_dbq.tests.Job",
+        ]:
+            with self.subTest(spec=spec):
+                with self.assertRaises(ValueError):
+                    get_metrics(spec)
+
+    def test_worker_command_rejects_invalid_metrics(self):
+        with self.assertRaises(CommandError):
+            call_command("worker", metrics="graphite", dry_run=True, stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command(
+                "worker",
+                metrics="prometheus:9100",
+                processes=2,
+                dry_run=True,
+                stdout=StringIO(),
+            )
+
+
+class CrashOnceWorker:
+    """
+    Stands in for a Worker in a forked child. The first child to run
+    crashes; every other child exits cleanly.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def run(self):
+        open(os.path.join(self.directory, str(os.getpid())), "w").close()
+        try:
+            open(os.path.join(self.directory, "crashed"), "x").close()
+        except FileExistsError:
+            return
+        raise Exception("uh oh")
+
+
+@skipUnless(hasattr(os, "fork"), "Requires os.fork")
+@mock.patch("django_dbq.management.commands.worker.sleep")
+class SupervisorTestCase(SimpleTestCase):
+    def test_supervisor_restarts_crashed_workers(self, mock_sleep):
+        with tempfile.TemporaryDirectory() as directory:
+            supervisor = Supervisor(2, partial(CrashOnceWorker, directory))
+            supervisor.run()
+            started = set(os.listdir(directory)) - {"crashed"}
+
+        self.assertEqual(len(started), 3)
+        self.assertEqual(supervisor.children, set())
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    def test_supervisor_does_not_restart_workers_after_shutdown(self, mock_sleep):
+        with tempfile.TemporaryDirectory() as directory:
+            supervisor = Supervisor(1, partial(CrashOnceWorker, directory))
+            supervisor.alive = False
+            supervisor.run()
+            started = set(os.listdir(directory)) - {"crashed"}
+
+        self.assertEqual(len(started), 1)
+
+    @mock.patch("django_dbq.management.commands.worker.os.kill")
+    def test_shutdown_forwards_sigterm_to_children(self, mock_kill, mock_sleep):
+        supervisor = Supervisor(2, mock.MagicMock())
+        supervisor.children = {123, 456}
+
+        supervisor.shutdown(None, None)
+
+        self.assertFalse(supervisor.alive)
+        self.assertEqual(
+            {call.args for call in mock_kill.call_args_list},
+            {(123, signal.SIGTERM), (456, signal.SIGTERM)},
+        )
+
+
+@override_settings(
+    JOBS={
+        "testjob": {
+            "tasks": ["django_dbq.tests.test_task"],
+            "creation_hook": "django_dbq.tests.creation_hook",
+        }
+    }
+)
+class JobCreationHookTestCase(TestCase):
+    def test_creation_hook(self):
         job = Job.objects.create(name="testjob")
         job = Job.objects.get()
         self.assertEqual(job.workspace["output"], "creation hook ran")
@@ -382,6 +2221,73 @@ class JobCreationHookTestCase(TestCase):
         self.assertEqual(job.workspace["output"], "creation hook output removed")
 
 
+@override_settings(
+    JOBS={
+        "testjob": {
+            "tasks": ["a", "b"],
+            "creation_hook": "django_dbq.tests.failing_creation_hook",
+        }
+    }
+)
+class BulkEnqueueTestCase(TestCase):
+    def test_bulk_enqueue_prepares_jobs_like_save(self):
+        created = Job.objects.bulk_enqueue(
+            [Job(name="testjob"), Job(name="testjob", workspace={"input": "x"})]
+        )
+
+        self.assertEqual(len(created), 2)
+        for job in Job.objects.all():
+            self.assertEqual(job.state, Job.STATES.NEW)
+            self.assertEqual(job.next_task, "a")
+            self.assertEqual(job.workspace["output"], "creation hook ran")
+            self.assertEqual(job.workspace["job_id"], str(job.id))
+        self.assertEqual(
+            Job.objects.get(workspace__input="x").pk,
+            created[1].pk,
+        )
+
+    def test_bulk_enqueue_skips_jobs_whose_creation_hook_fails(self):
+        created = Job.objects.bulk_enqueue(
+            [
+                Job(name="testjob"),
+                Job(name="testjob", workspace={"fail": True}),
+                Job(name="testjob"),
+            ]
+        )
+
+        self.assertEqual(len(created), 2)
+        self.assertEqual(Job.objects.count(), 2)
+        self.assertFalse(Job.objects.filter(workspace__fail=True).exists())
+
+    def test_bulk_enqueue_continues_after_batch_whose_creation_hooks_fail(self):
+        created = Job.objects.bulk_enqueue(
+            [Job(name="testjob", workspace={"fail": True})]
+            + [Job(name="testjob") for _ in range(5)],
+            batch_size=1,
+        )
+
+        self.assertEqual(len(created), 5)
+        self.assertEqual(Job.objects.count(), 5)
+
+    def test_bulk_enqueue_inserts_in_batches(self):
+        with CaptureQueriesContext(connection) as context:
+            created = Job.objects.bulk_enqueue(
+                (Job(name="testjob") for _ in range(5)), batch_size=2
+            )
+
+        inserts = [
+            query for query in context.captured_queries if "INSERT" in query["sql"]
+        ]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(len(created), 5)
+        self.assertEqual(Job.objects.count(), 5)
+
+    def test_bulk_enqueued_jobs_can_be_claimed(self):
+        Job.objects.bulk_enqueue([Job(name="testjob", queue_name="lol")])
+        [job] = Job.objects.claim("lol")
+        self.assertEqual(job.next_task, "a")
+
+
 @override_settings(
     JOBS={
         "testjob": {
@@ -437,6 +2343,370 @@ class JobFailureHookTestCase(TestCase):
         self.assertEqual(job.workspace["job_id"], str(job.id))
 
 
+@override_settings(JOBS={"testjob": {"tasks": ["a"]}})
+class DedupKeyTestCase(TestCase):
+    def create_job(self, dedup_key, state=Job.STATES.NEW, **kwargs):
+        job = Job.objects.create(name="testjob", dedup_key=dedup_key, **kwargs)
+        Job.objects.filter(pk=job.pk).update(state=state)
+        return job
+
+    def test_duplicate_of_unfinished_job_cannot_be_created(self):
+        self.create_job("a", Job.STATES.PROCESSING)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Job.objects.create(name="testjob", dedup_key="a")
+
+    def test_duplicate_of_finished_job_can_be_created(self):
+        self.create_job("a", Job.STATES.COMPLETE)
+        self.create_job("a", Job.STATES.FAILED)
+
+        self.assertIsNotNone(Job.objects.enqueue(Job(name="testjob", dedup_key="a")))
+        self.assertEqual(Job.objects.filter(dedup_key="a").count(), 3)
+
+    def test_bulk_enqueue_ignores_duplicates(self):
+        waiting = self.create_job("a")
+        processing = self.create_job("b", Job.STATES.PROCESSING)
+        new_c = Job(name="testjob", dedup_key="c")
+        new_none = Job(name="testjob")
+
+        created = Job.objects.bulk_enqueue(
+            [
+                Job(name="testjob", dedup_key="a"),
+                Job(name="testjob", dedup_key="b"),
+                new_c,
+                Job(name="testjob", dedup_key="c"),
+                new_none,
+            ],
+            on_duplicate="ignore",
+        )
+
+        self.assertEqual(created, [new_c, new_none])
+        self.assertEqual(
+            set(Job.objects.values_list("pk", flat=True)),
+            {waiting.pk, processing.pk, new_c.pk, new_none.pk},
+        )
+
+    def test_bulk_enqueue_replaces_waiting_duplicates(self):
+        waiting = self.create_job("a", Job.STATES.READY, workspace={"v": 1})
+        processing = self.create_job("b", Job.STATES.PROCESSING, workspace={"v": 1})
+        run_after = timezone.now() + timedelta(hours=1)
+
+        created = Job.objects.bulk_enqueue(
+            [
+                Job(name="testjob", dedup_key="a", workspace={"v": 2}),
+                Job(
+                    name="testjob",
+                    dedup_key="a",
+                    workspace={"v": 3},
+                    priority=5,
+                    run_after=run_after,
+                ),
+                Job(name="testjob", dedup_key="b", workspace={"v": 2}),
+            ],
+            on_duplicate="replace",
+        )
+
+        self.assertEqual(created, [])
+        self.assertEqual(Job.objects.count(), 2)
+        waiting.refresh_from_db()
+        self.assertEqual(waiting.workspace, {"v": 3})
+        self.assertEqual(waiting.priority, 5)
+        self.assertEqual(waiting.run_after, run_after)
+        self.assertEqual(waiting.state, Job.STATES.READY)
+        processing.refresh_from_db()
+        self.assertEqual(processing.workspace, {"v": 1})
+
+    def test_duplicates_are_checked_for_without_partial_indexes(self):
+        self.create_job("a", Job.STATES.PROCESSING)
+        new_b = Job(name="testjob", dedup_key="b")
+
+        with mock.patch.object(connection.features, "supports_partial_indexes", False):
+            created = Job.objects.bulk_enqueue(
+                [Job(name="testjob", dedup_key="a"), new_b], on_duplicate="ignore"
+            )
+
+        self.assertEqual(created, [new_b])
+        self.assertEqual(Job.objects.count(), 2)
+
+    def test_enqueue_returns_none_for_duplicate(self):
+        self.create_job("a")
+
+        self.assertIsNone(
+            Job.objects.enqueue(
+                Job(name="testjob", dedup_key="a"), on_duplicate="ignore"
+            )
+        )
+        self.assertEqual(Job.objects.count(), 1)
+
+    @override_settings(DBQ_QUEUE_DEPTH_COUNTERS=True)
+    def test_ignored_duplicates_are_not_counted(self):
+        Job.objects.enqueue(Job(name="testjob", dedup_key="a"), on_duplicate="ignore")
+        Job.objects.enqueue(Job(name="testjob", dedup_key="a"), on_duplicate="ignore")
+
+        self.assertEqual(QueueDepthCounter.objects.get_queue_depths(), {"default": 1})
+
+    def test_invalid_on_duplicate(self):
+        with self.assertRaises(ValueError):
+            Job.objects.bulk_enqueue([Job(name="testjob")], on_duplicate="merge")
+
+
+@override_settings(
+    JOBS={
+        "testjob": {"tasks": ["django_dbq.tests.test_task"]},
+        "failingjob": {"tasks": ["django_dbq.tests.failing_task"]},
+    }
+)
+class JobDependencyTestCase(TestCase):
+    def process_jobs(self):
+        worker = Worker("default", 1)
+        while worker._process_job():
+            pass
+
+    @override_settings(DBQ_QUEUE_DEPTH_COUNTERS=True)
+    def test_fan_out_fan_in(self):
+        children = Job.objects.bulk_enqueue(
+            [Job(name="testjob", queue_name="map") for _ in range(3)]
+        )
+        reducer = Job.objects.enqueue(Job(name="testjob"), depends_on=children)
+
+        reducer.refresh_from_db()
+        self.assertEqual(reducer.state, Job.STATES.BLOCKED)
+        self.assertEqual(reducer.pending_dependencies, 3)
+        self.assertEqual(JobDependency.objects.count(), 3)
+        self.assertEqual(QueueDepthCounter.objects.get_queue_depths(), {"map": 3})
+        self.assertFalse(Worker("default", 1)._process_job())
+
+        map_worker = Worker("map", 1)
+        map_worker._process_job()
+        map_worker._process_job()
+
+        reducer.refresh_from_db()
+        self.assertEqual(reducer.state, Job.STATES.BLOCKED)
+        self.assertEqual(reducer.pending_dependencies, 1)
+
+        map_worker._process_job()
+
+        reducer.refresh_from_db()
+        self.assertEqual(reducer.state, Job.STATES.READY)
+        self.assertEqual(reducer.pending_dependencies, 0)
+        self.assertEqual(JobDependency.objects.count(), 0)
+        self.assertEqual(QueueDepthCounter.objects.get_queue_depths(), {"default": 1})
+
+        self.process_jobs()
+
+        reducer.refresh_from_db()
+        self.assertEqual(reducer.state, Job.STATES.COMPLETE)
+
+    def test_dependent_is_ready_once_last_dependency_completes(self):
+        first = Job.objects.create(name="testjob")
+        last = Job.objects.create(name="testjob")
+        dependent = Job.objects.enqueue(Job(name="testjob"), depends_on=[first, last])
+        first, last = Job.objects.claim("default", count=2)
+
+        first.state = Job.STATES.COMPLETE
+        self.assertTrue(first.save_transition(Job.ACTIVE_STATES))
+        dependent.refresh_from_db()
+        self.assertEqual(dependent.state, Job.STATES.BLOCKED)
+        self.assertEqual(dependent.pending_dependencies, 1)
+
+        last.state = Job.STATES.COMPLETE
+        self.assertTrue(last.save_transition(Job.ACTIVE_STATES))
+        dependent.refresh_from_db()
+        self.assertEqual(dependent.state, Job.STATES.READY)
+        self.assertEqual(dependent.pending_dependencies, 0)
+        self.assertEqual(Job.objects.claim("default"), [dependent])
+
+    def test_release_is_a_single_update(self):
+        dependency = Job.objects.create(name="testjob")
+        dependents = Job.objects.bulk_enqueue(
+            [Job(name="testjob", queue_name="reduce") for _ in range(3)],
+            depends_on=[dependency],
+        )
+
+        with CaptureQueriesContext(connection) as context:
+            self.process_jobs()
+
+        updates = [
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].startswith("UPDATE")
+            and "pending_dependencies" in query["sql"]
+        ]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            set(
+                Job.objects.filter(pk__in=[job.pk for job in dependents]).values_list(
+                    "state", flat=True
+                )
+            ),
+            {Job.STATES.READY},
+        )
+
+    def test_jobs_without_dependents_do_not_look_for_them(self):
+        Job.objects.create(name="testjob")
+
+        with CaptureQueriesContext(connection) as context:
+            self.process_jobs()
+
+        self.assertEqual(Job.objects.get().state, Job.STATES.COMPLETE)
+        self.assertFalse(
+            any(
+                JobDependency._meta.db_table in query["sql"]
+                for query in context.captured_queries
+            )
+        )
+
+    def test_dependent_enqueued_after_dependency_was_claimed(self):
+        Job.objects.create(name="testjob")
+        dependency = Job.objects.claim("default")[0]
+        dependent = Job.objects.enqueue(Job(name="testjob"), depends_on=[dependency])
+
+        dependency.state = Job.STATES.COMPLETE
+        self.assertTrue(dependency.save_transition(Job.ACTIVE_STATES))
+
+        self.assertTrue(dependency.has_dependents)
+        dependent.refresh_from_db()
+        self.assertEqual(dependent.state, Job.STATES.READY)
+
+    def test_finished_and_missing_dependencies_are_ignored(self):
+        complete = Job.objects.create(name="testjob")
+        Job.objects.filter(pk=complete.pk).update(state=Job.STATES.COMPLETE)
+        pending = Job.objects.create(name="testjob")
+
+        ready = Job.objects.enqueue(
+            Job(name="testjob"), depends_on=[complete, uuid.uuid4()]
+        )
+        blocked = Job.objects.enqueue(
+            Job(name="testjob"), depends_on=[complete.pk, pending.pk]
+        )
+
+        ready.refresh_from_db()
+        blocked.refresh_from_db()
+        self.assertEqual(ready.state, Job.STATES.NEW)
+        self.assertEqual(blocked.state, Job.STATES.BLOCKED)
+        self.assertEqual(blocked.pending_dependencies, 1)
+
+    def test_job_depending_on_failed_job_is_created_failed(self):
+        failed = Job.objects.create(name="testjob")
+        Job.objects.filter(pk=failed.pk).update(state=Job.STATES.FAILED)
+
+        job = Job.objects.enqueue(Job(name="testjob"), depends_on=[failed])
+
+        job.refresh_from_db()
+        self.assertEqual(job.state, Job.STATES.FAILED)
+        self.assertFalse(JobDependency.objects.exists())
+
+    def test_failure_is_propagated_to_dependents(self):
+        failing = Job.objects.create(name="failingjob")
+        other = Job.objects.create(name="testjob", queue_name="other")
+        child = Job.objects.enqueue(Job(name="testjob"), depends_on=[failing, other])
+        grandchild = Job.objects.enqueue(Job(name="testjob"), depends_on=[child])
+        unrelated = Job.objects.enqueue(Job(name="testjob"), depends_on=[other])
+
+        self.process_jobs()
+
+        for job in (failing, child, grandchild):
+            job.refresh_from_db()
+            self.assertEqual(job.state, Job.STATES.FAILED)
+        unrelated.refresh_from_db()
+        self.assertEqual(unrelated.state, Job.STATES.BLOCKED)
+
+        Worker("other", 1)._process_job()
+
+        unrelated.refresh_from_db()
+        self.assertEqual(unrelated.state, Job.STATES.READY)
+        self.assertFalse(JobDependency.objects.exists())
+
+    def test_dependents_are_released_when_dependency_is_saved_complete(self):
+        dependency = Job.objects.create(name="testjob")
+        loaded = Job.objects.get(pk=dependency.pk)
+        dependent = Job.objects.enqueue(Job(name="testjob"), depends_on=[dependency])
+
+        loaded.state = Job.STATES.COMPLETE
+        loaded.save()
+
+        dependent.refresh_from_db()
+        self.assertEqual(dependent.state, Job.STATES.READY)
+        self.assertTrue(Job.objects.get(pk=dependency.pk).has_dependents)
+        self.assertFalse(JobDependency.objects.exists())
+
+    def test_dependents_fail_when_dependency_is_saved_failed(self):
+        dependency = Job.objects.create(name="testjob")
+        dependent = Job.objects.enqueue(Job(name="testjob"), depends_on=[dependency])
+
+        dependency.refresh_from_db()
+        dependency.state = Job.STATES.FAILED
+        dependency.save()
+
+        dependent.refresh_from_db()
+        self.assertEqual(dependent.state, Job.STATES.FAILED)
+
+    def test_dependents_fail_when_unfinished_dependency_is_deleted(self):
+        dependency = Job.objects.create(name="testjob")
+        dependent = Job.objects.enqueue(Job(name="testjob"), depends_on=[dependency])
+
+        Job.objects.get(pk=dependency.pk).delete()
+
+        dependent.refresh_from_db()
+        self.assertEqual(dependent.state, Job.STATES.FAILED)
+        self.assertFalse(JobDependency.objects.exists())
+
+    def test_delete_old_releases_dependents_first(self):
+        complete = Job.objects.create(name="testjob")
+        stopping = Job.objects.create(name="testjob")
+        released = Job.objects.enqueue(Job(name="testjob"), depends_on=[complete])
+        failed = Job.objects.enqueue(Job(name="testjob"), depends_on=[stopping])
+        Job.objects.filter(pk=complete.pk).update(state=Job.STATES.COMPLETE)
+        Job.objects.filter(pk=stopping.pk).update(state=Job.STATES.STOPPING)
+        Job.objects.filter(pk__in=[complete.pk, stopping.pk]).update(
+            created=timezone.now() - timedelta(days=2)
+        )
+
+        self.assertEqual(Job.objects.delete_old(), 2)
+
+        released.refresh_from_db()
+        failed.refresh_from_db()
+        self.assertEqual(released.state, Job.STATES.READY)
+        self.assertEqual(failed.state, Job.STATES.FAILED)
+        self.assertFalse(JobDependency.objects.exists())
+
+    def test_archive_old_releases_dependents_first(self):
+        dependency = Job.objects.create(name="testjob")
+        dependent = Job.objects.enqueue(Job(name="testjob"), depends_on=[dependency])
+        Job.objects.filter(pk=dependency.pk).update(
+            state=Job.STATES.COMPLETE, created=timezone.now() - timedelta(days=2)
+        )
+
+        self.assertEqual(Job.objects.archive_old(), 1)
+
+        dependent.refresh_from_db()
+        self.assertEqual(dependent.state, Job.STATES.READY)
+        self.assertFalse(JobDependency.objects.exists())
+
+    def test_release_finished_dependencies(self):
+        updated = Job.objects.create(name="testjob")
+        deleted = Job.objects.create(name="testjob")
+        pending = Job.objects.create(name="testjob")
+        dependent = Job.objects.enqueue(
+            Job(name="testjob"), depends_on=[updated, deleted]
+        )
+        blocked = Job.objects.enqueue(Job(name="testjob"), depends_on=[pending])
+        Job.objects.filter(pk=updated.pk).update(state=Job.STATES.COMPLETE)
+        Job.objects.filter(pk=deleted.pk).delete()
+
+        stdout = StringIO()
+        call_command("delete_old_jobs", stdout=stdout)
+
+        self.assertIn(
+            "Released the dependents of finished or deleted jobs: 2", stdout.getvalue()
+        )
+        dependent.refresh_from_db()
+        blocked.refresh_from_db()
+        self.assertEqual(dependent.state, Job.STATES.READY)
+        self.assertEqual(blocked.state, Job.STATES.BLOCKED)
+        self.assertEqual(Job.objects.release_finished_dependencies(), 0)
+
+
 @override_settings(JOBS={"testjob": {"tasks": ["a"]}})
 class DeleteOldJobsTestCase(TestCase):
     def test_delete_old_jobs(self):
@@ -479,3 +2749,203 @@ class DeleteOldJobsTestCase(TestCase):
 
         self.assertEqual(Job.objects.count(), 1)
         self.assertTrue(j2 in Job.objects.all())
+
+    def create_old_jobs(self, count):
+        Job.objects.bulk_create(
+            [
+                Job(name="testjob", next_task="a", state=Job.STATES.COMPLETE)
+                for _ in range(count)
+            ]
+        )
+        Job.objects.update(created=timezone.now() - timedelta(days=2))
+
+    def test_delete_old_jobs_in_batches(self):
+        self.create_old_jobs(5)
+        keep = Job.objects.create(name="testjob")
+        progress = mock.MagicMock()
+
+        with CaptureQueriesContext(connection) as context:
+            deleted = Job.objects.delete_old(batch_size=2, progress=progress)
+
+        self.assertEqual(deleted, 5)
+        self.assertEqual(list(Job.objects.all()), [keep])
+        self.assertEqual([call.args[0] for call in progress.call_args_list], [2, 4, 5])
+        deletes = [
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].startswith("DELETE")
+        ]
+        self.assertEqual(len(deletes), 3)
+        self.assertFalse(
+            any("workspace" in query["sql"] for query in context.captured_queries)
+        )
+
+    def test_delete_old_jobs_sends_delete_signals(self):
+        self.create_old_jobs(3)
+        receiver = mock.MagicMock()
+        pre_delete.connect(receiver, sender=Job)
+        self.addCleanup(pre_delete.disconnect, receiver, sender=Job)
+
+        deleted = Job.objects.delete_old(batch_size=2)
+
+        self.assertEqual(deleted, 3)
+        self.assertEqual(receiver.call_count, 3)
+        self.assertFalse(Job.objects.exists())
+
+    @mock.patch("django_dbq.models.time.sleep")
+    def test_delete_old_jobs_pauses_between_batches(self, mock_sleep):
+        self.create_old_jobs(4)
+
+        Job.objects.delete_old(batch_size=2, pause_in_seconds=0.5)
+
+        self.assertEqual(Job.objects.count(), 0)
+        self.assertEqual(mock_sleep.call_args_list, [mock.call(0.5)] * 2)
+
+    def test_delete_old_jobs_command(self):
+        self.create_old_jobs(3)
+        stdout = StringIO()
+
+        call_command("delete_old_jobs", batch_size=2, stdout=stdout)
+
+        self.assertEqual(Job.objects.count(), 0)
+        self.assertEqual(
+            stdout.getvalue().splitlines(),
+            [
+                "Deleted 2 old jobs so far",
+                "Deleted 3 old jobs so far",
+                "Deleted old jobs: 3 in total",
+            ],
+        )
+
+
+@override_settings(JOBS={"testjob": {"tasks": ["a"]}})
+class ArchiveJobsTestCase(TestCase):
+    def create_job(self, state, days_old, **kwargs):
+        job = Job.objects.create(name="testjob", **kwargs)
+        Job.objects.filter(pk=job.pk).update(
+            state=state, created=timezone.now() - timedelta(days=days_old)
+        )
+        return Job.objects.get(pk=job.pk)
+
+    def test_archive_old_jobs(self):
+        complete = self.create_job(
+            Job.STATES.COMPLETE, 2, workspace={"a": 1}, queue_name="other", priority=3
+        )
+        failed = self.create_job(Job.STATES.FAILED, 2)
+        stopping = self.create_job(Job.STATES.STOPPING, 2)
+        ready = self.create_job(Job.STATES.READY, 2)
+        recent = self.create_job(Job.STATES.COMPLETE, 0)
+
+        with freezegun.freeze_time() as frozen:
+            self.assertEqual(Job.objects.archive_old(), 2)
+
+        self.assertEqual(
+            set(Job.objects.values_list("pk", flat=True)),
+            {stopping.pk, ready.pk, recent.pk},
+        )
+        self.assertEqual(
+            set(ArchivedJob.objects.values_list("pk", flat=True)),
+            {complete.pk, failed.pk},
+        )
+        archived = ArchivedJob.objects.get(pk=complete.pk)
+        for field in (
+            "created",
+            "modified",
+            "name",
+            "state",
+            "next_task",
+            "workspace",
+            "queue_name",
+            "priority",
+        ):
+            self.assertEqual(getattr(archived, field), getattr(complete, field))
+        self.assertEqual(
+            archived.archived, frozen().replace(tzinfo=datetime_timezone.utc)
+        )
+
+    def test_archive_old_jobs_in_batches(self):
+        for _ in range(5):
+            self.create_job(Job.STATES.COMPLETE, 2)
+        progress = mock.MagicMock()
+
+        with CaptureQueriesContext(connection) as context:
+            archived = Job.objects.archive_old(batch_size=2, progress=progress)
+
+        self.assertEqual(archived, 5)
+        self.assertEqual(Job.objects.count(), 0)
+        self.assertEqual(ArchivedJob.objects.count(), 5)
+        self.assertEqual([call.args[0] for call in progress.call_args_list], [2, 4, 5])
+        statements = [
+            query["sql"].split(" ", 1)[0] for query in context.captured_queries
+        ]
+        self.assertEqual(statements.count("INSERT"), 3)
+        self.assertEqual(statements.count("DELETE"), 3)
+
+    def test_archive_jobs_command(self):
+        for _ in range(3):
+            self.create_job(Job.STATES.COMPLETE, 2)
+        stdout = StringIO()
+
+        call_command("archive_jobs", batch_size=2, stdout=stdout)
+
+        self.assertEqual(ArchivedJob.objects.count(), 3)
+        self.assertEqual(
+            stdout.getvalue().splitlines(),
+            [
+                "Archived 2 old jobs so far",
+                "Archived 3 old jobs so far",
+                "Archived old jobs: 3 in total",
+            ],
+        )
+
+
+@override_settings(JOBS={"testjob": {"tasks": ["a"]}})
+class BenchmarkTestCase(TestCase):
+    def test_parse_mix(self):
+        self.assertEqual(
+            parse_mix("noop:8,sleep,cpu:1"), {"noop": 8, "sleep": 1, "cpu": 1}
+        )
+
+    def test_parse_mix_rejects_invalid_mixes(self):
+        for mix in ("noop:x", "noop:0", "unknown:1"):
+            with self.assertRaises(ValueError):
+                parse_mix(mix)
+
+    def test_benchmark_command(self):
+        other = Job.objects.create(name="testjob", state=Job.STATES.COMPLETE)
+        Job.objects.filter(pk=other.pk).update(
+            created=timezone.now() - timedelta(days=2)
+        )
+        stdout = StringIO()
+
+        call_command(
+            "benchmark",
+            jobs=6,
+            mix="noop:2,cpu:1",
+            history=3,
+            cpu_iterations=10,
+            prefetch=2,
+            stdout=stdout,
+        )
+
+        output = stdout.getvalue()
+        results = dict(
+            line.split("=", 1) for line in output.splitlines()[1:] if "=" in line
+        )
+        self.assertGreater(float(results["jobs_per_second"]), 0)
+        self.assertGreater(float(results["claims_per_second"]), 0)
+        self.assertGreater(float(results["queries_per_job"]), 1)
+        self.assertLess(float(results["queries_per_job"]), 10)
+        self.assertIn("completed_jobs=6", output)
+        self.assertIn("delete_old_jobs=3", output)
+        self.assertIn("latency_p99_seconds=", output)
+        self.assertFalse(Job.objects.filter(queue_name=BENCHMARK_QUEUE_NAME).exists())
+        self.assertEqual(list(Job.objects.all()), [other])
+
+    def test_benchmark_command_rejects_invalid_options(self):
+        with self.assertRaises(CommandError):
+            call_command("benchmark", mix="noop:0", stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command("benchmark", jobs=0, stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command("benchmark", concurrency=2, stdout=StringIO())
@@ -0,0 +1,199 @@
+"""
+Storage of large job workspaces.
+
+A workspace is normally stored in the jobs table as plain JSON. Workspaces
+whose JSON is at least `DBQ_WORKSPACE_COMPRESSION_THRESHOLD` bytes are
+stored zlib compressed instead, and if `DBQ_WORKSPACE_STORAGE` names one of
+the `STORAGES`, workspaces of at least `DBQ_WORKSPACE_STORAGE_THRESHOLD`
+bytes are compressed and written to that storage, with only a reference
+left in the row. Either way, the stored workspace is only decompressed (or
+read from storage) when `job.workspace` is first accessed.
+"""
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.db.models import JSONField
+from django.db.models.fields.json import KeyTransform
+from django.db.models.query_utils import DeferredAttribute
+import base64
+import hashlib
+import json
+import uuid
+import zlib
+
+
+# The key which marks a stored workspace as compressed or offloaded
+MARKER_KEY = "__dbq_workspace__"
+
+COMPRESSED = "zlib"
+
+OFFLOADED = "storage"
+
+DEFAULT_STORAGE_THRESHOLD = 256 * 1024
+
+STORAGE_DIRECTORY = "dbq_workspaces"
+
+
+def get_compression_threshold():
+    return getattr(settings, "DBQ_WORKSPACE_COMPRESSION_THRESHOLD", None)
+
+
+def get_storage_alias():
+    return getattr(settings, "DBQ_WORKSPACE_STORAGE", None)
+
+
+def get_storage_threshold():
+    return getattr(
+        settings, "DBQ_WORKSPACE_STORAGE_THRESHOLD", DEFAULT_STORAGE_THRESHOLD
+    )
+
+
+def get_storage(alias):
+    try:
+        return storages[alias]
+    except Exception as exception:
+        raise ImproperlyConfigured(
+            'Invalid workspace storage "%s": %s' % (alias, exception)
+        )
+
+
+def dump_workspace(workspace, encoder=None):
+    return json.dumps(workspace, cls=encoder).encode("utf-8")
+
+
+def get_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def encode_workspace(workspace, encoder=None):
+    """
+    Return the form in which a workspace should be stored in the database:
+    the workspace itself if it is small, or a reference to its compressed
+    or offloaded JSON if it is big enough.
+    """
+    compression_threshold = get_compression_threshold()
+    storage_alias = get_storage_alias()
+    if compression_threshold is None and storage_alias is None:
+        return workspace
+
+    data = dump_workspace(workspace, encoder)
+    if storage_alias is not None and len(data) >= get_storage_threshold():
+        storage = get_storage(storage_alias)
+        name = storage.save(
+            "%s/%s.json.zlib" % (STORAGE_DIRECTORY, uuid.uuid4().hex),
+            ContentFile(zlib.compress(data)),
+        )
+        return {
+            MARKER_KEY: OFFLOADED,
+            "storage": storage_alias,
+            "name": name,
+            "sha256": get_digest(data),
+        }
+    if compression_threshold is not None and len(data) >= compression_threshold:
+        return {
+            MARKER_KEY: COMPRESSED,
+            "data": base64.b64encode(zlib.compress(data)).decode("ascii"),
+            "sha256": get_digest(data),
+        }
+    return workspace
+
+
+class StoredWorkspace:
+    """
+    A compressed or offloaded workspace, as loaded from the database. It is
+    only decompressed, or read from storage, when `load` is called.
+
+    `job.workspace` loads it on first access, but querysets which return
+    values rather than jobs (such as `values("workspace")`) return it as it
+    is, so call `load` to get the workspace.
+    """
+
+    def __init__(self, stored, decoder=None):
+        self.stored = stored
+        self.decoder = decoder
+
+    @property
+    def kind(self):
+        return self.stored[MARKER_KEY]
+
+    @property
+    def digest(self):
+        return self.stored.get("sha256")
+
+    def read(self):
+        if self.kind == COMPRESSED:
+            return base64.b64decode(self.stored["data"])
+        if self.kind == OFFLOADED:
+            with get_storage(self.stored["storage"]).open(self.stored["name"]) as file:
+                return file.read()
+        raise ValueError('Unknown kind of stored workspace "%s"' % self.kind)
+
+    def load(self):
+        return json.loads(zlib.decompress(self.read()), cls=self.decoder)
+
+    def __repr__(self):
+        return "<StoredWorkspace %s>" % self.kind
+
+
+def workspace_changed(workspace, saved_workspace, encoder=None):
+    """
+    Return True if `workspace` differs from `saved_workspace` (as remembered
+    by `Job.track_workspace`). A stored workspace which has since been
+    loaded is compared by the digest of its JSON, rather than loading the
+    saved one again.
+    """
+    if workspace is saved_workspace:
+        return False
+    if isinstance(saved_workspace, StoredWorkspace):
+        if isinstance(workspace, StoredWorkspace):
+            return workspace.digest != saved_workspace.digest
+        return get_digest(dump_workspace(workspace, encoder)) != saved_workspace.digest
+    return workspace != saved_workspace
+
+
+class WorkspaceDescriptor(DeferredAttribute):
+    """Load a stored workspace on first access"""
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        workspace = super().__get__(instance, cls)
+        if isinstance(workspace, StoredWorkspace):
+            workspace = instance.__dict__[self.field.attname] = workspace.load()
+        return workspace
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class WorkspaceField(JSONField):
+    """
+    A JSONField which compresses or offloads big values when they are saved
+    (see `encode_workspace`), and loads them lazily.
+    """
+
+    descriptor_class = WorkspaceDescriptor
+
+    def from_db_value(self, value, expression, connection):
+        value = super().from_db_value(value, expression, connection)
+        if (
+            isinstance(value, dict)
+            and MARKER_KEY in value
+            and not isinstance(expression, KeyTransform)
+        ):
+            return StoredWorkspace(value, self.decoder)
+        return value
+
+    def pre_save(self, model_instance, add):
+        # Read the raw value, so that a workspace which was never accessed
+        # is saved as it was loaded rather than being loaded first.
+        return model_instance.__dict__.get(self.attname)
+
+    def get_db_prep_save(self, value, connection):
+        if isinstance(value, StoredWorkspace):
+            value = value.stored
+        elif value is not None and not hasattr(value, "resolve_expression"):
+            value = encode_workspace(value, self.encoder)
+        return super().get_db_prep_save(value, connection)